@@ -0,0 +1,155 @@
+"""Request/response applications over TCP, with persistent connections.
+
+A request is a line of text. A response is the length of its body in decimal, a newline, then the
+body. A connection stays open for any number of requests, and a client may pipeline them: send
+several before reading their responses, which come back in order.
+
+	server = RequestServer(host2, 80, lambda request: 'ok')
+	context = host1.context
+	context.new_thread(server.run)
+	pool = ConnectionPool(host1, (host2.ip, 80), size=4)
+	def client():
+		pool.request('hello')
+		pool.pipeline(['a', 'b', 'c'])
+		pool.close()
+	context.new_thread(client)
+"""
+from inet_sim.network.host import AF_INET, SOCK_STREAM
+from sim import Event
+
+class Stream:
+	"""Buffered reading of lines and fixed-size bodies from a TCP socket."""
+
+	def __init__(self, socket):
+		self.socket = socket
+		self.__buffer = ''
+
+	def __fill(self):
+		"""Read more data into the buffer. Return False if the other side has closed."""
+		data = ''.join(self.socket.recv())
+		self.__buffer += data
+		return bool(data)
+
+	def read_line(self):
+		"""Return the next line, without its newline, or None if the other side closed first."""
+		while '\n' not in self.__buffer:
+			if not self.__fill():
+				return None
+		line, self.__buffer = self.__buffer.split('\n', 1)
+		return line
+
+	def read(self, size):
+		"""Return the next size bytes."""
+		while len(self.__buffer) < size:
+			if not self.__fill():
+				raise Exception('Connection closed')
+		data, self.__buffer = self.__buffer[:size], self.__buffer[size:]
+		return data
+
+class RequestServer:
+	"""Serves requests on a port, calling handler(request) for each response."""
+
+	def __init__(self, host, port, handler):
+		self.socket = host.socket(AF_INET, SOCK_STREAM)
+		self.socket.bind((host.ip, port))
+		self.handler = handler
+		self.requests = 0 # served
+
+	def run(self, count=None):
+		"""Accept count connections (or forever), serving each in its own thread."""
+		self.socket.listen()
+		while count is None or count > 0:
+			socket = self.socket.accept()
+			self.socket.host.context.new_thread(lambda socket=socket: self.serve(socket))
+			if count is not None:
+				count -= 1
+
+	def serve(self, socket):
+		"""Answer requests on a connection, in order, until the client closes it."""
+		stream = Stream(socket)
+		while True:
+			request = stream.read_line()
+			if request is None:
+				break
+			self.requests += 1
+			response = self.handler(request)
+			socket.sendall('%d\n%s' % (len(response), response))
+		socket.close()
+
+class Connection:
+	"""A persistent client connection."""
+
+	def __init__(self, host, addr):
+		self.socket = host.socket(AF_INET, SOCK_STREAM)
+		self.socket.connect(addr)
+		self.stream = Stream(self.socket)
+
+	def request(self, request):
+		"""Send a request, and return its response."""
+		return self.pipeline([request])[0]
+
+	def pipeline(self, requests):
+		"""Send all requests, then read their responses. Return the responses in order."""
+		self.socket.sendall(''.join(request + '\n' for request in requests))
+		responses = []
+		for _ in requests:
+			line = self.stream.read_line()
+			if line is None:
+				raise Exception('Connection closed')
+			responses.append(self.stream.read(int(line)))
+		return responses
+
+	def close(self):
+		self.socket.close()
+
+class ConnectionPool:
+	"""Connections to one address, reused across requests. At most size are open at once (or any
+	number, if size is None). Without reuse, every request opens a new connection and closes it
+	afterwards, for comparison.
+	"""
+
+	def __init__(self, host, addr, size=None, reuse=True):
+		self.host = host
+		self.addr = addr
+		self.size = size
+		self.reuse = reuse
+		self.connections = 0 # opened in total
+		self.__idle = []
+		self.__open = 0
+		self.__available = Event()
+
+	def get(self):
+		"""Return an idle connection, or a new one. Wait if size connections are in use."""
+		while not self.__idle and self.size is not None and self.__open >= self.size:
+			self.__available.wait()
+		if self.__idle:
+			return self.__idle.pop()
+		self.__open += 1
+		self.connections += 1
+		return Connection(self.host, self.addr)
+
+	def put(self, connection):
+		"""Return a connection obtained from get()."""
+		if self.reuse:
+			self.__idle.append(connection)
+		else:
+			self.__open -= 1
+			connection.close()
+		self.__available.notify()
+
+	def request(self, request):
+		"""Send a request on a pooled connection, and return its response."""
+		return self.pipeline([request])[0]
+
+	def pipeline(self, requests):
+		"""Send requests on one pooled connection, and return their responses in order."""
+		connection = self.get()
+		responses = connection.pipeline(requests)
+		self.put(connection)
+		return responses
+
+	def close(self):
+		"""Close the idle connections."""
+		while self.__idle:
+			self.__open -= 1
+			self.__idle.pop().close()
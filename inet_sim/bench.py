@@ -0,0 +1,666 @@
+"""Performance benchmarks of the simulator core.
+
+Each scenario runs in a fresh process and reports the wall time per simulated second, simulator
+events (log records) per second, peak RSS and, with --trace-alloc, the peak number of live objects.
+Results are written as JSON, and can be compared against a stored baseline:
+
+	python -m inet_sim.bench -o bench.json
+	python -m inet_sim.bench -o new.json --baseline bench.json
+
+A comparison instead runs scenarios in several modes, and reports measurements of each run; -s
+restricts it to some of its scenarios. --offload compares TCP segmentation offload against per-MSS
+simulation in the TCP scenarios: flow completion times, events and wall time. --ecmp compares
+per-flow hashing against per-packet spraying over the equal-cost paths of a fat-tree. --requests
+compares requests per second with a new connection per request, with pooled persistent
+connections, and with pipelining. --udp compares receiving a constant bit rate stream of UDP
+datagrams one per call against batches. --nagle compares the packets sent and message latency of
+small writes sent at once, coalesced by Nagle's algorithm, and corked. --failover reports the
+time to update routes after a core link of a 1,344 node fat-tree fails and is repaired, and the
+packets lost before routes converge.
+
+--contexts compares running many small simulations, each in its own Context, back-to-back in one
+process, in parallel threads, and each in a new interpreter.
+"""
+from __future__ import division
+import argparse
+import gc
+import json
+import logging
+import multiprocessing
+import platform
+import Queue
+import subprocess
+import sys
+import threading
+import timeit
+import traceback
+
+from inet_sim.app import ConnectionPool, RequestServer, Stream
+from inet_sim.context import Context
+from inet_sim.loop import EventLoop
+from inet_sim.network.aio import AsyncHost, AsyncLink
+from inet_sim.network.dynamics import LinkEvents
+from inet_sim.network.host import AF_INET, Host, SOCK_DGRAM, SOCK_STREAM
+from inet_sim.network.link import Link
+from inet_sim.network.routing import Node, static_routes
+from inet_sim.network.topology import FatTree, imbalance, utilization
+
+# applications
+
+_completions = [] # simulated times at which sinks finished reading a connection
+_received = [0] # bytes read by sinks
+_latencies = [] # simulated times from sending to receiving a message
+_route_updates = [] # (simulated time, destinations changed, wall seconds) of incremental updates
+_route_setup = [] # wall seconds to build and fully route a topology
+
+def _socket(host, options, sock_type=SOCK_STREAM):
+	"""Create a (TCP) socket with the given attributes (e.g. offload=True)."""
+	socket = host.socket(AF_INET, sock_type)
+	for name, value in options.iteritems():
+		setattr(socket, name, value)
+	return socket
+
+def _sink(host, port, count, options={}):
+	"""Accept count connections on port, and read each until the other side closes."""
+	listener = _socket(host, options)
+	listener.bind((host.ip, port))
+	listener.listen()
+	def read(socket):
+		while True:
+			data = socket.recv()
+			if not data:
+				break
+			_received[0] += len(data)
+		_completions.append(host.context.time())
+		socket.close()
+	def accept():
+		for _ in xrange(count):
+			socket = listener.accept()
+			host.context.new_thread(lambda socket=socket: read(socket))
+	host.context.new_thread(accept)
+
+def _source(host, addr, size, delay=0, options={}):
+	"""After delay, connect to addr and send size bytes."""
+	def send():
+		if delay:
+			host.context.sleep(delay)
+		socket = _socket(host, options)
+		socket.connect(addr)
+		socket.sendall('x' * size)
+		socket.close()
+	host.context.new_thread(send)
+
+def _ip(*parts):
+	return '10.%d.%d.%d' % parts
+
+def _bottleneck(links):
+	"""Mark links as bottlenecks, where super-segments are split into wire packets."""
+	for link in links:
+		link.segment = True
+
+# scenarios; each builds a topology in context and starts its applications, whose sockets get
+# options, and may return links whose load balance to report
+
+def bulk(context, scale, **options):
+	"""A single bulk flow over one link."""
+	client, server = Host(_ip(0, 0, 1), context), Host(_ip(0, 0, 2), context)
+	_bottleneck(Link.duplex_link(client, server, .01, 1e6))
+	_sink(server, 80, 1, options)
+	_source(client, (server.ip, 80), int(1e6 * scale), options=options)
+
+def competing(context, scale, **options):
+	"""N flows sharing one bottleneck link between two routers."""
+	n = max(1, int(4 * scale))
+	router1, router2 = Node(_ip(1, 0, 1), context), Node(_ip(1, 0, 2), context)
+	server = Host(_ip(1, 1, 1), context)
+	_bottleneck(Link.duplex_link(router1, router2, .02, 2e5))
+	Link.duplex_link(router2, server, .001, 1e7)
+	nodes = [router1, router2, server]
+	_sink(server, 80, n, options)
+	for i in xrange(n):
+		client = Host(_ip(1, 2, i), context)
+		Link.duplex_link(client, router1, .001, 1e7)
+		nodes.append(client)
+		_source(client, (server.ip, 80), int(2e5 * scale), delay=.1*i, options=options)
+	static_routes(nodes)
+
+def lossy(context, scale, loss=.02, **options):
+	"""A single flow over a long-delay path that loses packets."""
+	client, server = Host(_ip(2, 0, 1), context), Host(_ip(2, 0, 2), context)
+	for link in Link.duplex_link(client, server, .25, 1e5):
+		link.loss = loss
+	_sink(server, 80, 1, options)
+	_source(client, (server.ip, 80), int(2e5 * scale), options=options)
+
+def short(context, scale, **options):
+	"""Many short connections, staggered in time."""
+	n = max(1, int(50 * scale))
+	client, server = Host(_ip(3, 0, 1), context), Host(_ip(3, 0, 2), context)
+	Link.duplex_link(client, server, .005, 1e6)
+	_sink(server, 80, n, options)
+	for i in xrange(n):
+		_source(client, (server.ip, 80), 200, delay=.05*i, options=options)
+
+def multihop(context, scale, **options):
+	"""Flows across a two-level tree of routers."""
+	k = max(2, int(8 * scale)) # aggregation routers
+	hosts_per_router = 4
+	core = Node(_ip(4, 0, 1), context)
+	nodes = [core]
+	hosts = []
+	for a in xrange(k):
+		router = Node(_ip(4, 1, a), context)
+		_bottleneck(Link.duplex_link(core, router, .005, 1e6))
+		nodes.append(router)
+		hosts.append([])
+		for h in xrange(hosts_per_router):
+			host = Host(_ip(4, 2 + a, h), context)
+			Link.duplex_link(router, host, .001, 1e7)
+			nodes.append(host)
+			hosts[a].append(host)
+	static_routes(nodes)
+	for a in xrange(k):
+		for h, client in enumerate(hosts[a]):
+			server = hosts[(a + 1) % k][h]
+			_sink(server, 80, 1, options)
+			_source(client, (server.ip, 80), int(5e4 * scale), delay=.01*h, options=options)
+
+def fattree(context, scale, spray=False, **options):
+	"""A permutation of flows between the hosts of a k=4 fat-tree, each to a host in another pod.
+	With spray, switches spread packets over equal-cost links instead of hashing flows."""
+	topology = FatTree(4, .001, 1e6, context=context)
+	for node in topology.nodes:
+		node.spray = spray
+	hosts = topology.hosts
+	for i, client in enumerate(hosts):
+		server = hosts[(i + len(hosts) // 2 + 1) % len(hosts)]
+		_sink(server, 80 + i, 1, options)
+		_source(client, (server.ip, 80 + i), int(2e5 * scale), options=options)
+	return topology.core_links
+
+def requests(context, scale, reuse=True, depth=1, **options):
+	"""Clients making many small requests of one server, over a pool of persistent connections
+	(or a new connection per request, without reuse), pipelining depth requests at a time."""
+	n = max(1, int(100 * scale)) # requests per client
+	clients = 4
+	client, server = Host(_ip(5, 0, 1), context), Host(_ip(5, 0, 2), context)
+	Link.duplex_link(client, server, .005, 1e6)
+	app = RequestServer(server, 80, lambda request: 'x' * 1000)
+	for name, value in options.iteritems():
+		setattr(app.socket, name, value)
+	context.new_thread(app.run)
+	pool = ConnectionPool(client, (server.ip, 80), size=clients, reuse=reuse)
+	def run():
+		for i in xrange(0, n, depth):
+			count = min(depth, n - i)
+			pool.pipeline(['get'] * count)
+			_completions.extend([context.time()] * count)
+	for _ in xrange(clients):
+		context.new_thread(run)
+
+def cbr(context, scale, batch=1, **options):
+	"""A constant bit rate UDP stream, sent one datagram per interval and received batch
+	datagrams per call."""
+	n = max(1, int(5000 * scale)) # datagrams
+	size, interval = 1000, .001
+	client, server = Host(_ip(6, 0, 1), context), Host(_ip(6, 0, 2), context)
+	Link.duplex_link(client, server, .01, 2e6)
+	receiver = _socket(server, options, SOCK_DGRAM)
+	receiver.bind((server.ip, 5000))
+	def send():
+		sender = _socket(client, options, SOCK_DGRAM)
+		sender.connect(receiver.local)
+		for _ in xrange(n):
+			sender.send('x' * size)
+			context.sleep(interval)
+	def receive():
+		received = 0
+		while received < n:
+			datagrams = receiver.recvmmsg(batch, wait_for=batch, timeout=.1)
+			if not datagrams:
+				break
+			received += len(datagrams)
+		_completions.append(context.time())
+	context.new_thread(send)
+	context.new_thread(receive)
+
+def chatty(context, scale, cork=1, **options):
+	"""A client making many small timestamped writes to a server over a long path. With cork > 1,
+	every cork writes are corked and sent together."""
+	n = max(1, int(2000 * scale)) # messages
+	size, interval = 50, .002
+	client, server = Host(_ip(7, 0, 1), context), Host(_ip(7, 0, 2), context)
+	Link.duplex_link(client, server, .02, 1e6)
+	listener = _socket(server, options)
+	listener.bind((server.ip, 80))
+	listener.listen()
+	def receive():
+		socket = listener.accept()
+		stream = Stream(socket)
+		for _ in xrange(n):
+			sent = float(stream.read(size))
+			_latencies.append(context.time() - sent)
+			_received[0] += size
+		_completions.append(context.time())
+		socket.close()
+	def send():
+		socket = _socket(client, options)
+		socket.connect((server.ip, 80))
+		for i in xrange(n):
+			if cork > 1 and i % cork == 0:
+				socket.cork()
+			socket.sendall('%*.6f' % (size, context.time()))
+			if cork > 1 and i % cork == cork - 1:
+				socket.uncork()
+			context.sleep(interval)
+		socket.close()
+	context.new_thread(receive)
+	context.new_thread(send)
+
+def failover(context, scale, k=16, convergence=.05, **options):
+	"""Constant bit rate UDP flows between pods of a fat-tree (k=16: 1,344 nodes). The busiest
+	core link fails, and is repaired, each time with routes updated convergence seconds later."""
+	n = max(1, int(32 * scale)) # flows
+	count, size, interval = 500, 1000, .002
+	start = timeit.default_timer()
+	topology = FatTree(k, .001, 1e7, context=context)
+	_route_setup.append(timeit.default_timer() - start)
+	events = LinkEvents(topology.routes, convergence)
+	events.updates = _route_updates
+	def busiest():
+		link = max(topology.core_links, key=lambda link: link.bytes)
+		reverse = next(l for l in link.dest.links() if l.dest is link.source)
+		busiest.links = [link, reverse]
+		return busiest.links
+	events.schedule(count * interval * .3, busiest, up=False)
+	events.schedule(count * interval * .7, lambda: busiest.links, up=True)
+	hosts = topology.hosts
+	step = len(hosts) // n
+	for i in xrange(n):
+		client = hosts[i * step]
+		server = hosts[(i * step + len(hosts) // 2 + 1) % len(hosts)]
+		receiver = _socket(server, options, SOCK_DGRAM)
+		receiver.bind((server.ip, 5000))
+		def send(client=client, addr=receiver.local):
+			sender = _socket(client, options, SOCK_DGRAM)
+			sender.connect(addr)
+			for _ in xrange(count):
+				sender.send('x' * size)
+				context.sleep(interval)
+		def receive(receiver=receiver):
+			while True:
+				for message, _ in receiver.recvmmsg(64, timeout=.5):
+					_received[0] += len(message)
+				if context.time() > count * interval + 1:
+					break
+		context.new_thread(send)
+		context.new_thread(receive)
+
+SCENARIOS = dict((f.__name__, f) for f in (bulk, competing, lossy, short, multihop, fattree,
+	requests, cbr, chatty, failover))
+
+# measurement
+
+class _CountingHandler(logging.Handler):
+	"""Counts log records, and link events by type, without formatting them. With sample_objects,
+	also samples the number of objects tracked by the garbage collector every that many records."""
+
+	def __init__(self, sample_objects=None):
+		logging.Handler.__init__(self)
+		self.count = 0
+		self.link_events = {} # e.g. 'transmit-end' to count
+		self.sample_objects = sample_objects
+		self.objects_peak = None
+
+	def sample(self):
+		self.objects_peak = max(self.objects_peak, len(gc.get_objects()))
+
+	def emit(self, record):
+		self.count += 1
+		if self.sample_objects and self.count % self.sample_objects == 0:
+			self.sample()
+		if record.name == 'inet_sim.network.link':
+			event = record.msg.split(' ', 3)[2] # from 'link %s->%s <event> ...'
+			self.link_events[event] = self.link_events.get(event, 0) + 1
+
+def _peak_rss():
+	"""Return the peak resident set size of this process, in KB, or None if unknown."""
+	try:
+		import resource
+	except ImportError:
+		return None
+	rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	return rss // 1024 if sys.platform == 'darwin' else rss
+
+def run(name, scale=1., trace_alloc=False, options={}, seed=0):
+	"""Run one scenario in this process, in a new Context seeded with seed, with the given socket
+	options. Return a dict of measurements."""
+	context = Context(seed=seed)
+	context.reset()
+	del _completions[:]
+	del _latencies[:]
+	del _route_updates[:]
+	del _route_setup[:]
+	_received[0] = 0
+	counter = _CountingHandler(1000 if trace_alloc else None)
+	root = logging.getLogger()
+	root.handlers = [counter]
+	root.setLevel(logging.INFO)
+	links = SCENARIOS[name](context, scale, **options)
+	if trace_alloc:
+		counter.sample()
+	start = timeit.default_timer()
+	context.run()
+	wall = timeit.default_timer() - start
+	if trace_alloc:
+		counter.sample()
+	result = {
+		'wall_seconds': wall,
+		'sim_seconds': context.time(),
+		'wall_per_sim_second': wall / context.time() if context.time() else None,
+		'events': counter.count,
+		'events_per_second': counter.count / wall if wall else None,
+		'peak_rss_kb': _peak_rss(),
+		'objects_peak': counter.objects_peak,
+		'completion_times': sorted(_completions),
+		'packets': counter.link_events.get('transmit-end', 0),
+		'lost_to_link_down': counter.link_events.get('link-drop', 0),
+	}
+	if _completions:
+		result['completion_mean'] = sum(_completions) / len(_completions)
+		result['goodput'] = _received[0] / max(_completions)
+	if _latencies:
+		result['messages'] = len(_latencies)
+		result['latency_mean'] = sum(_latencies) / len(_latencies)
+	events = counter.link_events
+	drops = events.get('packet-loss', 0) + events.get('queue-overflow', 0) + events.get('link-drop', 0)
+	if drops + events.get('transmit-end', 0):
+		result['drop_rate'] = drops / (drops + events.get('transmit-end', 0))
+	if _route_updates:
+		result['route_updates'] = list(_route_updates)
+		result['route_setup_seconds'] = _route_setup[0]
+	if links:
+		result['link_imbalance'] = imbalance(links)
+		result['link_utilization_max'] = max(utilization(links, context.time()).values())
+	return result
+
+def _child(queue, name, scale, trace_alloc, options):
+	try:
+		queue.put((run(name, scale, trace_alloc, options), None))
+	except BaseException:
+		queue.put((None, traceback.format_exc()))
+
+def run_isolated(name, scale=1., trace_alloc=False, options={}):
+	"""Run one scenario in a new process, so that its peak RSS is its own. Raise an exception if
+	the scenario raises one or the process dies."""
+	queue = multiprocessing.Queue()
+	process = multiprocessing.Process(target=_child,
+		args=(queue, name, scale, trace_alloc, options))
+	process.start()
+	result, error = None, None
+	while True:
+		try:
+			result, error = queue.get(timeout=1.)
+			break
+		except Queue.Empty:
+			if not process.is_alive():
+				try:
+					result, error = queue.get(timeout=1.)
+				except Queue.Empty:
+					error = 'process exited with code %s' % (process.exitcode,)
+				break
+	process.join()
+	if error is None and process.exitcode != 0:
+		error = 'process exited with code %s' % (process.exitcode,)
+	if error is not None:
+		raise Exception('Scenario %s failed: %s' % (name, error))
+	return result
+
+# comparison
+
+class Comparison:
+	"""Runs scenarios in each of several modes, a name and the options passed to the scenario (and
+	its sockets), and reports measurements of each run. report(result, first) returns a dict of
+	them from the result of a run, and that of the same scenario in the first mode."""
+
+	def __init__(self, description, scenarios, modes, report):
+		self.description = description
+		self.scenarios = scenarios
+		self.modes = modes
+		self.report = report
+
+	def run(self, scale=1., scenarios=None):
+		"""Run each scenario (of those given, by default all) in each mode, each in a new process.
+		Return a list of (scenario, mode, report)."""
+		reports = []
+		for name in [name for name in scenarios or self.scenarios if name in self.scenarios]:
+			first = None
+			for mode, options in self.modes:
+				result = run_isolated(name, scale, options=options)
+				first = first or result
+				reports.append((name, mode, self.report(result, first)))
+		return reports
+
+def _format(value):
+	if isinstance(value, float):
+		return '%.4g' % (value,)
+	if isinstance(value, (list, tuple)):
+		return '(%s)' % (', '.join(_format(v) for v in value),)
+	return '-' if value is None else str(value)
+
+TCP_SCENARIOS = ['bulk', 'competing', 'lossy', 'short', 'multihop', 'fattree', 'requests', 'chatty']
+
+def _offload_report(result, first):
+	"""Mean relative error of flow completion times against the first (per-MSS) run, completed
+	flows, and the ratios of events and wall time."""
+	pairs = zip(first['completion_times'], result['completion_times'])
+	errors = [abs(b - a) / a for a, b in pairs if a]
+	return {
+		'completion_error': sum(errors) / len(errors) if errors else None,
+		'completed': len(result['completion_times']),
+		'event_ratio': result['events'] / first['events'],
+		'wall_ratio': result['wall_seconds'] / first['wall_seconds'],
+	}
+
+def _ecmp_report(result, first):
+	"""Imbalance and peak utilization of core links, and the mean and last completion times."""
+	times = result['completion_times']
+	return {
+		'link_imbalance': result['link_imbalance'],
+		'link_utilization_max': result['link_utilization_max'],
+		'completion_mean': sum(times) / len(times),
+		'completion_max': max(times),
+	}
+
+def _requests_report(result, first):
+	"""Requests per simulated second, events per request and wall time."""
+	times = result['completion_times']
+	return {
+		'requests_per_second': len(times) / max(times),
+		'events_per_request': result['events'] / len(times),
+		'wall_seconds': result['wall_seconds'],
+	}
+
+def _udp_report(result, first):
+	"""Wall time, its ratio to that of the first mode, and when the receiver had read everything."""
+	return {
+		'wall_seconds': result['wall_seconds'],
+		'wall_ratio': result['wall_seconds'] / first['wall_seconds'],
+		'completed': result['completion_times'][0] if result['completion_times'] else None,
+	}
+
+def _nagle_report(result, first):
+	"""Packets sent per message, mean message latency and wall time."""
+	return {
+		'packets_per_message': result['packets'] / result['messages'],
+		'latency_mean': result['latency_mean'],
+		'wall_seconds': result['wall_seconds'],
+	}
+
+def _failover_report(result, first):
+	"""Time to build and fully route the topology, the (simulated time, destinations changed, wall
+	seconds) of each route update, packets lost on the failed link, and wall time."""
+	return {
+		'route_setup_seconds': result['route_setup_seconds'],
+		'route_updates': result['route_updates'],
+		'lost_to_link_down': result['lost_to_link_down'],
+		'wall_seconds': result['wall_seconds'],
+	}
+
+COMPARISONS = {
+	'offload': Comparison('compare segmentation offload against per-MSS simulation', TCP_SCENARIOS,
+		[('mss', {}), ('offload', {'offload': True}),
+		('offload+coalesce', {'offload': True, 'coalesce': True})], _offload_report),
+	'ecmp': Comparison('compare per-flow and per-packet multipath on a fat-tree', ['fattree'],
+		[('flow', {}), ('spray', {'spray': True})], _ecmp_report),
+	'requests': Comparison('compare requests per second with and without connection reuse',
+		['requests'], [('new', {'reuse': False}), ('pool', {}), ('pipeline', {'depth': 8})],
+		_requests_report),
+	'udp': Comparison('compare batched and unbatched UDP receives', ['cbr'],
+		[('batch 1', {'batch': 1}), ('batch 32', {'batch': 32})], _udp_report),
+	'nagle': Comparison('compare small writes with and without Nagle\'s algorithm and corking',
+		['chatty'], [('nodelay', {}), ('nagle', {'nodelay': False}), ('cork', {'cork': 10})],
+		_nagle_report),
+	'failover': Comparison(
+		'report route update times and loss after link failures in a large fat-tree', ['failover'],
+		[('failover', {})], _failover_report),
+}
+
+def transfer(seed, size=100000, loss=.01):
+	"""Send size bytes over a lossy link, as a simulation of its own (coroutines in a Context with
+	an EventLoop), seeded with seed. Return the simulated time at which the receiver read them all.
+	"""
+	context = Context(EventLoop(), seed)
+	client, server = AsyncHost('10.0.0.1', context), AsyncHost('10.0.0.2', context)
+	link, _ = AsyncLink.duplex_link(client, server, .01, 1e6, loop=context)
+	link.loss = loss
+	listener = server.socket(AF_INET, SOCK_STREAM)
+	listener.bind((server.ip, 80))
+	listener.listen()
+	finish = []
+	def sink():
+		socket = yield listener.accept()
+		while (yield socket.recv()):
+			pass
+		finish.append(context.time())
+		yield socket.close()
+	def source():
+		socket = client.socket(AF_INET, SOCK_STREAM)
+		yield socket.connect((server.ip, 80))
+		yield socket.sendall('x' * size)
+		yield socket.close()
+	context.new_thread(sink)
+	context.new_thread(source)
+	context.run()
+	return finish[0] if finish else None
+
+def _transfer_process(seed):
+	output = subprocess.check_output([sys.executable, '-c',
+		'import json; from inet_sim.bench import transfer; print json.dumps(transfer(%d))' % (seed,)])
+	return json.loads(output)
+
+def compare_contexts(scale=1., threads=4):
+	"""Run many transfers, each a simulation in its own Context: back-to-back in this process, in
+	threads, and each in a new interpreter. Return a list of (mode, dict) with the wall time per
+	simulation, and whether the results match those run back-to-back."""
+	seeds = range(max(1, int(40 * scale)))
+	start = timeit.default_timer()
+	expected = [transfer(seed) for seed in seeds]
+	comparisons = [('sequential', timeit.default_timer() - start, expected)]
+
+	results = [None] * len(seeds)
+	def work(indices):
+		for i in indices:
+			results[i] = transfer(seeds[i])
+	workers = [threading.Thread(target=work, args=(range(i, len(seeds), threads),))
+		for i in xrange(threads)]
+	start = timeit.default_timer()
+	for worker in workers:
+		worker.start()
+	for worker in workers:
+		worker.join()
+	comparisons.append(('threads', timeit.default_timer() - start, results))
+
+	start = timeit.default_timer()
+	results = [_transfer_process(seed) for seed in seeds]
+	comparisons.append(('processes', timeit.default_timer() - start, results))
+	return [(mode, {
+		'wall_per_simulation': wall / len(seeds),
+		'matches': mode_results == expected,
+	}) for mode, wall, mode_results in comparisons]
+
+METRICS = { # compared against the baseline; True if higher is better
+	'wall_per_sim_second': False,
+	'events_per_second': True,
+	'peak_rss_kb': False,
+	'objects_peak': False,
+	'goodput': True,
+	'completion_mean': False,
+	'latency_mean': False,
+	'drop_rate': False,
+}
+
+def compare(results, baseline, tolerance=.1):
+	"""Return a list of (scenario, metric, baseline value, value) that regressed by more than
+	tolerance (a fraction of the baseline value).
+	"""
+	regressions = []
+	for name, result in sorted(results['scenarios'].iteritems()):
+		base = baseline['scenarios'].get(name)
+		if base is None or base.get('scale') != result.get('scale'):
+			continue
+		for metric, higher_is_better in sorted(METRICS.iteritems()):
+			old, new = base.get(metric), result.get(metric)
+			if not old or new is None:
+				continue
+			change = (new - old) / old
+			if (-change if higher_is_better else change) > tolerance:
+				regressions.append((name, metric, old, new))
+	return regressions
+
+def _parse_args():
+		parser = argparse.ArgumentParser(description='Benchmark the simulator')
+		parser.add_argument('-s', '--scenario', dest='scenarios', action='append',
+			choices=sorted(SCENARIOS), help='scenario to run (default: all)')
+		parser.add_argument('--scale', type=float, default=1., help='size of each scenario')
+		parser.add_argument('--trace-alloc', action='store_true',
+			help='sample the number of live objects (slows the run)')
+		parser.add_argument('-o', '--output' , dest='output_file', help='output file')
+		parser.add_argument('-b', '--baseline', dest='baseline_file', help='baseline file')
+		parser.add_argument('-t', '--tolerance', type=float, default=.1,
+			help='fraction by which a metric may be worse than the baseline')
+		for name, comparison in sorted(COMPARISONS.iteritems()):
+			parser.add_argument('--' + name, dest='comparison', action='store_const', const=name,
+				help=comparison.description)
+		parser.add_argument('--contexts', action='store_true',
+			help='compare many small simulations in one process, in threads and in new processes')
+		return parser.parse_args()
+
+if __name__ == '__main__':
+	args = _parse_args()
+	if args.comparison:
+		for name, mode, report in COMPARISONS[args.comparison].run(args.scale, args.scenarios):
+			print '%-10s %-16s %s' % (name, mode,
+				' '.join('%s=%s' % (k, _format(v)) for k, v in sorted(report.iteritems())))
+		sys.exit(0)
+	if args.contexts:
+		for mode, c in compare_contexts(args.scale):
+			print '%-10s %8.4f wall s/simulation, results %s' % (mode, c['wall_per_simulation'],
+				'match' if c['matches'] else 'DIFFER')
+		sys.exit(0)
+	results = {'python': platform.python_version(), 'platform': platform.platform(), 'scenarios': {}}
+	for name in args.scenarios or sorted(SCENARIOS):
+		result = run_isolated(name, args.scale, args.trace_alloc)
+		result['scale'] = args.scale
+		results['scenarios'][name] = result
+		print '%-10s %8.4f wall/sim s %10.0f events/s %8s KB' % (name, result['wall_per_sim_second'],
+			result['events_per_second'], result['peak_rss_kb'])
+	if args.output_file:
+		with open(args.output_file, 'w') as file:
+			json.dump(results, file, indent=2, sort_keys=True)
+	if args.baseline_file:
+		with open(args.baseline_file) as file:
+			regressions = compare(results, json.load(file), args.tolerance)
+		for name, metric, old, new in regressions:
+			print 'REGRESSION %s %s: %.4g -> %.4g' % (name, metric, old, new)
+		sys.exit(1 if regressions else 0)
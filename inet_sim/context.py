@@ -0,0 +1,94 @@
+"""Simulation contexts: the state of one simulation, which Nodes, Links and sockets share.
+
+A Context owns the clock and scheduler, the counters which number packets and links, and the
+random number generator (of link losses). With an EventLoop, a context is self-contained, so any
+number of simulations can exist in one process, one after another or in parallel threads; use it
+with the coroutine classes of inet_sim.network.aio:
+
+	context = Context(EventLoop(), seed=1)
+	host1, host2 = AsyncHost('10.0.0.1', context), AsyncHost('10.0.0.2', context)
+	AsyncLink.duplex_link(host1, host2, .01, 1e6, loop=context)
+	...
+	context.run()
+
+Without one, a context schedules with the sim module's threads, which are global to the process.
+DEFAULT is such a context; it is used by Nodes created without one, and draws random numbers from
+the random module, so random.seed() seeds it.
+"""
+import itertools
+import random
+import types
+
+from sim import sim
+
+class Context:
+	"""The clock, scheduler, ID counters and random number generator of a simulation."""
+
+	def __init__(self, loop=None, seed=None):
+		self.loop = loop # EventLoop, or None to schedule with the sim module
+		if loop is not None:
+			loop.context = self
+		self.random = random.Random(seed)
+		self.packet_ids = itertools.count()
+		self.link_ids = itertools.count()
+
+	@classmethod
+	def of(cls, loop):
+		"""Return the Context of an EventLoop (creating it if there is none), or loop itself if it
+		is a Context."""
+		if isinstance(loop, Context):
+			return loop
+		return loop.context or cls(loop)
+
+	def time(self):
+		"""Return the current simulated time."""
+		return self.loop.time() if self.loop is not None else sim.time()
+
+	def sleep(self, delay):
+		"""Block the current thread for delay; with a loop, return a Future to yield instead."""
+		if self.loop is not None:
+			return self.loop.sleep(delay)
+		sim.sleep(delay)
+
+	def new_thread(self, f):
+		"""Run f() in a new thread; with a loop, f() may return a coroutine, which is run as a
+		task."""
+		if self.loop is not None:
+			self.loop.call_soon(self.__start, f)
+		else:
+			sim.new_thread(f)
+
+	def __start(self, f):
+		coroutine = f()
+		if isinstance(coroutine, types.GeneratorType):
+			self.loop.create_task(coroutine)
+
+	def call_later(self, delay, f, *args):
+		"""Call f(*args) after delay."""
+		if self.loop is not None:
+			self.loop.call_later(delay, f, *args)
+		else:
+			def call():
+				sim.sleep(delay)
+				f(*args)
+			sim.new_thread(call)
+
+	def run(self, until=None):
+		"""Run the simulation until there is nothing left to do (or, with a loop, until the given
+		time)."""
+		if self.loop is not None:
+			self.loop.run(until)
+		else:
+			sim.run()
+
+	def reset(self):
+		"""Discard everything scheduled and restart the clock, for a new run on the same
+		topology."""
+		if self.loop is not None:
+			self.loop.__init__()
+			self.loop.context = self
+		else:
+			sim.__init__()
+
+DEFAULT = Context()
+DEFAULT.random = random
@@ -0,0 +1,210 @@
+"""A single-threaded event loop with virtual time, running generator-based coroutines.
+
+This is an alternative to the thread-based sim module: a coroutine is a generator which yields
+Futures (or other coroutines, which are run as sub-tasks) and is resumed with their results.
+As Python 2 generators cannot return values, a coroutine returns by raising Return(value).
+
+	def client(loop, socket, addr):
+		yield socket.connect(addr)
+		yield socket.sendall('time\\n')
+		message = yield socket.recv()
+		raise Return(message)
+
+	loop = EventLoop()
+	result = loop.run_until_complete(client(loop, socket, addr))
+
+Time only advances when nothing is ready to run, so the loop runs as fast as the CPU allows.
+"""
+from __future__ import division
+import heapq
+import itertools
+import types
+
+class TimeoutException(Exception):
+	"""Raised into a coroutine when a wait times out."""
+	pass
+
+class Return(Exception):
+	"""Raised by a coroutine to return a value."""
+
+	def __init__(self, value=None):
+		Exception.__init__(self, value)
+		self.value = value
+
+class Future:
+	"""The result of an operation that has not finished yet."""
+
+	def __init__(self, loop):
+		self.loop = loop
+		self.__done = False
+		self.__result = None
+		self.__exception = None
+		self.__callbacks = []
+
+	def done(self):
+		return self.__done
+
+	def result(self):
+		"""Return the result, or raise the exception, of a finished Future."""
+		if not self.__done:
+			raise Exception('Future is not done')
+		if self.__exception is not None:
+			raise self.__exception
+		return self.__result
+
+	def exception(self):
+		return self.__exception
+
+	def set_result(self, result):
+		if not self.__done:
+			self.__result = result
+			self.__finish()
+
+	def set_exception(self, exception):
+		if not self.__done:
+			self.__exception = exception
+			self.__finish()
+
+	def add_done_callback(self, callback):
+		"""Call callback(future) once this Future is done."""
+		if self.__done:
+			self.loop.call_soon(callback, self)
+		else:
+			self.__callbacks.append(callback)
+
+	def __finish(self):
+		self.__done = True
+		callbacks, self.__callbacks = self.__callbacks, []
+		for callback in callbacks:
+			self.loop.call_soon(callback, self)
+
+class Task(Future):
+	"""Runs a coroutine; done when the coroutine finishes."""
+
+	def __init__(self, loop, coroutine):
+		Future.__init__(self, loop)
+		self.coroutine = coroutine
+		loop.call_soon(self.__step)
+
+	def __step(self, value=None, exception=None):
+		try:
+			if exception is not None:
+				future = self.coroutine.throw(exception)
+			else:
+				future = self.coroutine.send(value)
+		except StopIteration:
+			self.set_result(None)
+		except Return as r:
+			self.set_result(r.value)
+		except Exception as e:
+			self.set_exception(e)
+		else:
+			if future is None:
+				self.loop.call_soon(self.__step)
+				return
+			if isinstance(future, types.GeneratorType):
+				future = Task(self.loop, future)
+			future.add_done_callback(self.__wakeup)
+
+	def __wakeup(self, future):
+		if future.exception() is not None:
+			self.__step(exception=future.exception())
+		else:
+			self.__step(future.result())
+
+class EventLoop:
+	"""Runs callbacks and coroutines in order of virtual time."""
+
+	def __init__(self):
+		self.__time = 0.
+		self.__heap = []
+		self.__seq = itertools.count()
+		self.context = None # the Context of this loop, if any
+
+	def time(self):
+		"""Return the current virtual time."""
+		return self.__time
+
+	def call_at(self, time, callback, *args):
+		"""Call callback(*args) at time. Return a handle which can be passed to cancel()."""
+		handle = [time, next(self.__seq), callback, args]
+		heapq.heappush(self.__heap, handle)
+		return handle
+
+	def call_later(self, delay, callback, *args):
+		return self.call_at(self.__time + delay, callback, *args)
+
+	def call_soon(self, callback, *args):
+		return self.call_at(self.__time, callback, *args)
+
+	def cancel(self, handle):
+		handle[2] = None
+
+	def create_task(self, coroutine):
+		"""Start running a coroutine. Return its Task."""
+		return Task(self, coroutine)
+
+	def sleep(self, delay, result=None):
+		"""Return a Future which is done after delay."""
+		future = Future(self)
+		self.call_later(delay, future.set_result, result)
+		return future
+
+	def wait_for(self, future, timeout):
+		"""Return a Future with the result of future, or a TimeoutException after timeout."""
+		if timeout is None:
+			return future
+		waiter = Future(self)
+		handle = self.call_later(timeout, waiter.set_exception, TimeoutException())
+		def done(future):
+			self.cancel(handle)
+			if future.exception() is not None:
+				waiter.set_exception(future.exception())
+			else:
+				waiter.set_result(future.result())
+		future.add_done_callback(done)
+		return waiter
+
+	def run(self, until=None):
+		"""Run until there is nothing left to do, or until the given time."""
+		heap = self.__heap
+		while heap:
+			if until is not None and heap[0][0] > until:
+				self.__time = until
+				break
+			time, _, callback, args = heapq.heappop(heap)
+			if callback is None:
+				continue
+			self.__time = time
+			callback(*args)
+
+	def run_until_complete(self, coroutine):
+		"""Run a coroutine (or Future) and the loop until it is done. Return its result."""
+		future = Task(self, coroutine) if isinstance(coroutine, types.GeneratorType) else coroutine
+		heap = self.__heap
+		while heap and not future.done():
+			time, _, callback, args = heapq.heappop(heap)
+			if callback is None:
+				continue
+			self.__time = time
+			callback(*args)
+		return future.result()
+
+class Event:
+	"""The coroutine counterpart of sim.Event: wait() returns a Future, and notify(value) wakes
+	all current waiters with value. Notifications without waiters are not remembered.
+	"""
+
+	def __init__(self, loop):
+		self.loop = loop
+		self.__waiters = []
+
+	def wait(self, timeout=None):
+		future = Future(self.loop)
+		self.__waiters.append(future)
+		return self.loop.wait_for(future, timeout)
+
+	def notify(self, value=None):
+		waiters, self.__waiters = self.__waiters, []
+		for future in waiters:
+			future.set_result(value)
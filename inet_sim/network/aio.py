@@ -0,0 +1,195 @@
+"""Coroutine versions of Host, Link, TcpSocket and UdpSocket, which run on an inet_sim.loop.EventLoop instead
+of sim threads.
+
+The blocking TcpSocket methods (accept, connect, sendall, recv and close) are coroutines here, so
+an application is itself a coroutine which yields them:
+
+	def handle_conn(socket):
+		message = ''
+		while not message.endswith('\\n'):
+			message += ''.join((yield socket.recv()))
+		yield socket.sendall('ok')
+		yield socket.close()
+
+Likewise UdpSocket's recv, recvfrom and recvmmsg. Each Link transmits with one coroutine while its
+queue is non-empty, and propagation and TCP timers are plain loop callbacks.
+"""
+from __future__ import division
+
+from .host import AF_INET, Host, SOCK_DGRAM, SOCK_STREAM
+from .link import Link
+from .tcp import TcpSocket
+from .udp import UdpSocket
+from ..context import Context
+from ..loop import Event, Return, TimeoutException
+
+class AsyncLink(Link):
+	"""A Link which transmits with a coroutine on an EventLoop (or the loop of a Context)."""
+
+	threaded = False
+
+	def __init__(self, source, dest, prop_delay, bandwidth, loop):
+		Link.__init__(self, source, dest, prop_delay, bandwidth, Context.of(loop))
+		self.loop = self.context.loop
+		self.__transmitting = False
+
+	def _schedule(self):
+		if not self.__transmitting:
+			self.__transmitting = True
+			self.loop.create_task(self.send())
+
+	def send(self):
+		"""Transmit queued packets until the queue is empty."""
+		while self._queue:
+			packet = self._dequeue()
+			failures = self.failures
+			self._log('transmit-start %d', packet.id)
+			yield self.loop.sleep(self._transmission(packet))
+			if self.failures != failures:
+				self._lost(packet)
+				continue
+			self._transmitted(packet)
+			self._log('propogate-start %d', packet.id)
+			self.loop.call_later(self.prop_delay, self.__propagated, packet, failures)
+		self.__transmitting = False
+
+	def __propagated(self, packet, failures):
+		if self.failures != failures:
+			self._lost(packet)
+			return
+		self._log('propogate-end %d', packet.id)
+		self.dest.received(packet, self)
+
+class AsyncHost(Host):
+	"""A Host whose links and sockets run on an EventLoop (or the loop of a Context)."""
+
+	threaded = False
+
+	def __init__(self, ip, loop):
+		context = Context.of(loop)
+		self.loop = context.loop
+		Host.__init__(self, ip, context)
+
+	def _add_loopback(self):
+		AsyncLink.duplex_link(self, self, 1e-6, 1e9, loop=self.loop)
+
+	def socket(self, domain, sock_type):
+		if domain == AF_INET and sock_type == SOCK_STREAM:
+			return AsyncTcpSocket(self)
+		if domain == AF_INET and sock_type == SOCK_DGRAM:
+			return AsyncUdpSocket(self)
+		return Host.socket(self, domain, sock_type)
+
+def _attempt(f, n):
+	"""Coroutine which runs coroutine function f up to n times, until it does not time out."""
+	for i in xrange(n):
+		try:
+			result = yield f()
+		except TimeoutException:
+			if i == n - 1:
+				raise
+		else:
+			raise Return(result)
+
+class AsyncTcpSocket(TcpSocket):
+	"""A TcpSocket whose blocking methods are coroutines."""
+
+	def __init__(self, host):
+		TcpSocket.__init__(self, host)
+		self.loop = host.loop
+		self.syn_event	   = Event(self.loop)
+		self.syn_ack_event = Event(self.loop)
+		self.ack_event	   = Event(self.loop)
+		self.data_event	   = Event(self.loop)
+		self.fin_event	   = Event(self.loop)
+
+	def accept(self):
+		"""Accept a connection. The socket is returned."""
+		if self.state != 'LISTEN':
+			raise Exception('Must call listen() first')
+		packet = yield self.syn_event.wait()
+		raise Return(self._accept(packet))
+
+	def connect(self, addr):
+		"""Establish a connection to the specified address."""
+		self._connecting(addr)
+		def syn():
+			self._send_syn()
+			return self.syn_ack_event.wait(self.timeout)
+		packet = yield _attempt(syn, 10)
+		self._connected(packet)
+
+	def sendall(self, message):
+		"""Send the message. Return once it is all in the send buffer."""
+		if not hasattr(self, 'remote'):
+			raise Exception('Must call connect() first')
+		i = 0
+		while i < len(message):
+			space = self._buffer_space()
+			if space:
+				self.out += message[i:i+space]
+				i += space
+				self._pump()
+			else:
+				yield self.ack_event.wait()
+
+	def recv(self):
+		"""Return incoming data. At least one byte will be returned, unless the other side has
+		closed."""
+		while self._recv_blocks():
+			yield self.data_event.wait()
+		raise Return(self._read())
+
+	def close(self):
+		"""Close this end of a connection. Return once all data and the FIN are acknowledged."""
+		def fin():
+			self._send_fin()
+			return self.ack_event.wait(self.timeout)
+
+		self.uncork()
+		if self.state == 'ESTABLISHED' or self.state == 'SYN_RCVD':
+			self.state = 'FIN_WAIT_1'
+			self._log('tcp-state', 'ESTABLISHED : FIN -> FIN_WAIT_1')
+			while self.out_ack_i < self.out_end:
+				yield self.ack_event.wait()
+			yield _attempt(fin, 10)
+			self._fin_acked()
+
+		elif self.state == 'CLOSE_WAIT':
+			self.state = 'LAST_ACK'
+			self._log('tcp-state', 'CLOSE_WAIT : FIN -> LAST_ACK')
+			yield _attempt(fin, 10)
+			self._fin_acked()
+
+class AsyncUdpSocket(UdpSocket):
+	"""A UdpSocket whose receiving methods are coroutines."""
+
+	def __init__(self, host):
+		UdpSocket.__init__(self, host)
+		self.loop = host.loop
+		self.data_event = Event(self.loop)
+
+	def recvfrom(self):
+		"""Return the next (message, origin), waiting for one if necessary."""
+		while not self.queue:
+			self._wake_at = 1
+			yield self.data_event.wait()
+		raise Return(self._pop())
+
+	def recv(self):
+		"""Return the next message, waiting for one if necessary."""
+		message, origin = yield self.recvfrom()
+		raise Return(message)
+
+	def recvmmsg(self, n, wait_for=1, timeout=None):
+		"""Return a list of up to n queued (message, origin) pairs, as UdpSocket.recvmmsg."""
+		count = min(wait_for, n)
+		try:
+			while len(self.queue) < count:
+				self._wake_at = count
+				yield self.data_event.wait(timeout)
+		except TimeoutException:
+			pass
+		finally:
+			self._wake_at = None
+		raise Return([self._pop() for _ in xrange(min(n, len(self.queue)))])
@@ -0,0 +1,53 @@
+"""Scheduled changes to links during a run: failures, repairs, and new bandwidths or delays.
+
+	events = LinkEvents(static_routes(nodes), convergence=.05)
+	events.schedule(1., [link1, link2], up=False)
+	events.schedule(3., [link1, link2], up=True)
+	events.schedule(5., [link3], bandwidth=5e5)
+
+After a change that affects routing, routes are updated incrementally, convergence seconds of
+simulated time later (standing in for failure detection and routing protocol messages); packets
+forwarded to a down link in the meantime are lost. The wall time of each update is recorded.
+"""
+import timeit
+
+from ..context import DEFAULT
+
+class LinkEvents:
+	"""Applies changes to links at scheduled times, and updates routes (if given) after them. Times
+	are those of context (by default, that of the routed nodes)."""
+
+	def __init__(self, routes=None, convergence=0., context=None):
+		self.routes = routes
+		self.convergence = convergence
+		self.context = context or (routes.nodes[0].context if routes and routes.nodes else DEFAULT)
+		self.updates = [] # (simulated time, destinations changed, wall seconds) of route updates
+
+	def schedule(self, time, links, up=None, bandwidth=None, prop_delay=None):
+		"""At simulated time, apply a change to links (a list, or a function returning one)."""
+		def change():
+			self.apply(links() if callable(links) else links, up, bandwidth, prop_delay)
+		self.context.call_later(max(0., time - self.context.time()), change)
+
+	def apply(self, links, up=None, bandwidth=None, prop_delay=None):
+		"""Bring links up or down, or set their bandwidth or propagation delay, now."""
+		for link in links:
+			if up is not None:
+				link.set_up(up)
+			if bandwidth is not None:
+				link.bandwidth = bandwidth
+			if prop_delay is not None:
+				link.prop_delay = prop_delay
+		if self.routes is not None and (up is not None or prop_delay is not None):
+			if self.convergence:
+				self.context.call_later(self.convergence, self.update, links)
+			else:
+				self.update(links)
+
+	def update(self, links):
+		"""Update the routes affected by changes to links. Return the number of destinations whose
+		routes changed, whether edited in place or recomputed."""
+		start = timeit.default_timer()
+		count = self.routes.update(links)
+		self.updates.append((self.context.time(), count, timeit.default_timer() - start))
+		return count
@@ -0,0 +1,301 @@
+"""Flow-level (fluid) simulation, for studies too large for packet-level simulation.
+
+Each transfer is a Flow along the routed path between two nodes of an ordinary Host/Node/Link
+topology. Whenever flows start or finish, the rates of all active flows are recomputed by max-min
+fair sharing of link bandwidths, and time jumps directly to the next start or finish. Flow
+completion times include a fixed latency of rtts round trips of propagation delay (by default one
+and a half: the handshake, then the last byte's trip).
+
+validate() runs the same flows through the packet-level TCP stack, for comparison.
+"""
+from __future__ import division
+import argparse
+import heapq
+import itertools
+import logging
+
+class Flow:
+	"""A transfer of size bytes from source to dest, starting at start."""
+
+	def __init__(self, source, dest, size, start=0.):
+		self.source = source
+		self.dest = dest
+		self.size = size
+		self.start = start
+		self.latency = None #fixed part of the completion time
+		self.finish = None  #completion time
+		self._group = None
+		self._target = None #service of the group at which this flow is done
+
+	@property
+	def path(self):
+		"""The links from source to dest."""
+		return self._group.path
+
+	@property
+	def rate(self):
+		"""The current rate, in bytes per second."""
+		return self._group.rate if self._target is not None and self.finish is None else 0.
+
+	@property
+	def completion_time(self):
+		return self.finish - self.start if self.finish is not None else None
+
+class _Group:
+	"""The active flows along one path, which all have the same max-min fair rate. Service is the
+	number of bytes each has been sent since the group was created; a flow is done once it has been
+	served its size since it started.
+	"""
+
+	def __init__(self, path, links):
+		self.path = path
+		self.links = links # link numbers
+		self.rate = 0.
+		self.service = 0.
+		self.flows = [] # heap of (target service, number, flow)
+		self.count = 0
+		self.bytes = 0. # total sent by all flows
+
+def path(source, dest_ip, key=None):
+	"""Return the list of links from source to the node with dest_ip, following routes. Among
+	equal-cost links, each node chooses by hashing key, as for the packets of a flow.
+	"""
+	links = []
+	node = source
+	visited = set()
+	while dest_ip not in node.addresses:
+		if node in visited:
+			raise Exception('Routing loop from %s to %s' % (source.ip, dest_ip))
+		visited.add(node)
+		link = node.next_hop(dest_ip, key)
+		if link is None:
+			raise Exception('No route from %s to %s' % (node.ip, dest_ip))
+		links.append(link)
+		node = link.dest
+	return links
+
+def max_min_rates(groups, bandwidth):
+	"""Set the rate of each group to its max-min fair share per flow. A group has links (a sequence
+	of link numbers, indexing bandwidth) and count (a number of flows) attributes.
+	"""
+	count = {} # link number to flows without a rate yet
+	unfrozen = {} # link number to groups without a rate yet
+	for group in groups:
+		group.rate = None
+		for link in group.links:
+			if link in count:
+				count[link] += group.count
+				unfrozen[link].append(group)
+			else:
+				count[link] = group.count
+				unfrozen[link] = [group]
+	capacity = dict((link, bandwidth[link]) for link in count) # unallocated bandwidth
+	heap = [(capacity[link] / n, link) for link, n in count.iteritems()]
+	heapq.heapify(heap)
+	while heap:
+		rate, link = heapq.heappop(heap)
+		n = count[link]
+		if not n or rate != max(capacity[link], 0) / n:
+			continue # stale entry
+		touched = set()
+		for group in unfrozen[link]:
+			if group.rate is not None:
+				continue
+			group.rate = rate
+			for other in group.links:
+				capacity[other] -= rate * group.count
+				count[other] -= group.count
+				touched.add(other)
+		for other in touched:
+			if count[other]:
+				heapq.heappush(heap, (max(capacity[other], 0) / count[other], other))
+	for group in groups:
+		if group.rate is None: # a path without links
+			group.rate = float('inf')
+
+class FluidSimulator:
+	"""Simulates flows over a topology at the flow level.
+
+	Flows along the same path are grouped, so the cost of each start or finish grows with the
+	number of distinct paths in use rather than the number of flows.
+	"""
+
+	def __init__(self, rtts=1.5):
+		self.rtts = rtts
+		self.time = 0.
+		self.flows = []
+		self.__groups = {} # tuple of links to _Group
+		self.__links = {} # link to number
+		self.__bandwidth = [] # by link number
+		self.__pending = [] # heap of (start, number, flow)
+		self.__active = set() # groups with flows
+		self.__count = itertools.count()
+
+	def add_flow(self, source, dest, size, start=0., ports=None):
+		"""Add a flow from the source node to the dest node (or ip address). Return the Flow.
+		ports, the (source, dest) TCP ports of the flow, choose among equal-cost paths as for its
+		packets; by default, each flow gets its own source port.
+		"""
+		dest_ip = getattr(dest, 'ip', dest)
+		flow = Flow(source, dest_ip, size, start)
+		source_port, dest_port = ports or (32768 + len(self.flows) % 32768, 80)
+		# the key routing._flow_key gives the flow's data packets
+		key = (source.ip, source_port), (dest_ip, dest_port), 'TcpPacket'
+		links = tuple(path(source, dest_ip, key))
+		if links not in self.__groups:
+			for link in links:
+				if link not in self.__links:
+					self.__links[link] = len(self.__bandwidth)
+					self.__bandwidth.append(link.bandwidth)
+			self.__groups[links] = _Group(links, tuple(self.__links[link] for link in links))
+		flow._group = self.__groups[links]
+		flow.latency = self.rtts * 2 * sum(link.prop_delay for link in links)
+		self.flows.append(flow)
+		heapq.heappush(self.__pending, (start, next(self.__count), flow))
+		return flow
+
+	def run(self, until=None):
+		"""Run until all flows have finished, or until the given time."""
+		active = self.__active
+		pending = self.__pending
+		while pending or active:
+			next_start = pending[0][0] if pending else float('inf')
+			finishes = [self.time + (g.flows[0][0] - g.service) / g.rate for g in active if g.rate > 0]
+			next_finish = min(finishes) if finishes else float('inf')
+			time = min(next_start, next_finish)
+			if until is not None and time > until:
+				self.__advance(active, until)
+				break
+			if time == float('inf'):
+				break # the remaining flows have no bandwidth (e.g. behind a down link), so never finish
+			self.__advance(active, time)
+			for group in list(active):
+				while group.flows and group.flows[0][0] - group.service <= 1e-9 * group.flows[0][2].size:
+					flow = heapq.heappop(group.flows)[2]
+					flow.finish = time + flow.latency
+					group.count -= 1
+				if not group.flows:
+					active.remove(group)
+			while pending and pending[0][0] <= time:
+				flow = heapq.heappop(pending)[2]
+				group = flow._group
+				flow._target = group.service + flow.size
+				heapq.heappush(group.flows, (flow._target, next(self.__count), flow))
+				group.count += 1
+				active.add(group)
+			max_min_rates(active, self.__bandwidth)
+		logging.getLogger(__name__).info('fluid-done %.4f %d flows', self.time, len(self.flows))
+
+	def __advance(self, active, time):
+		dt = time - self.time
+		if dt > 0:
+			for group in active:
+				group.service += group.rate * dt
+				group.bytes += group.rate * dt * group.count
+		self.time = time
+
+	def link_bytes(self):
+		"""Return a dict of link to the bytes it has carried."""
+		link_bytes = {}
+		for group in self.__groups.itervalues():
+			for link in group.path:
+				link_bytes[link] = link_bytes.get(link, 0) + group.bytes
+		return link_bytes
+
+	def utilization(self, duration=None):
+		"""Return a dict of link to the fraction of its bandwidth used over duration (by default,
+		the simulated time)."""
+		duration = duration or self.time
+		return dict((link, b / (link.bandwidth * duration)) for link, b in self.link_bytes().iteritems())
+
+	def completion_times(self):
+		return [flow.completion_time for flow in self.flows]
+
+def validate(nodes, flows, rtts=1.5):
+	"""Run flows, a list of (source, dest, size, start), on a topology both with packet-level TCP
+	and with the fluid model. Routes must have been set up (e.g. by static_routes), and the nodes'
+	context must not have an EventLoop. Return a list of (packet-level completion time, fluid
+	completion time) per flow.
+	"""
+	from .host import AF_INET, SOCK_STREAM
+
+	context = nodes[0].context
+	context.reset()
+	finish = {}
+	ports = {}
+	def sink(i, dest, port):
+		listener = dest.socket(AF_INET, SOCK_STREAM)
+		listener.bind((dest.ip, port))
+		listener.listen()
+		def accept():
+			socket = listener.accept()
+			while socket.recv():
+				pass
+			finish[i] = context.time()
+			socket.close()
+		context.new_thread(accept)
+	def source(i, source, addr, size, start):
+		def send():
+			context.sleep(start)
+			socket = source.socket(AF_INET, SOCK_STREAM)
+			socket.connect(addr)
+			ports[i] = socket.local[1], addr[1]
+			socket.sendall('x' * size)
+			socket.close()
+		context.new_thread(send)
+	for i, (src, dest, size, start) in enumerate(flows):
+		port = 10000 + i
+		sink(i, dest, port)
+		source(i, src, (dest.ip, port), size, start)
+	context.run()
+
+	fluid = FluidSimulator(rtts)
+	fluid_flows = [fluid.add_flow(src, dest, size, start, ports.get(i))
+		for i, (src, dest, size, start) in enumerate(flows)]
+	fluid.run()
+	return [(finish[i] - flows[i][3] if i in finish else None, f.completion_time)
+		for i, f in enumerate(fluid_flows)]
+
+def _dumbbell(n, bandwidth=2e5, delay=.02):
+	"""Return (nodes, clients, server) of n clients sharing one bottleneck to a server."""
+	from .host import Host
+	from .link import Link
+	from .routing import Node, static_routes
+	router1, router2, server = Node('10.0.0.1'), Node('10.0.0.2'), Host('10.1.0.1')
+	Link.duplex_link(router1, router2, delay, bandwidth)
+	Link.duplex_link(router2, server, .001, 1e7)
+	nodes, clients = [router1, router2, server], []
+	for i in xrange(n):
+		client = Host('10.2.%d.%d' % (i // 256, i % 256))
+		Link.duplex_link(client, router1, .001, 1e7)
+		nodes.append(client)
+		clients.append(client)
+	static_routes(nodes)
+	return nodes, clients, server
+
+def _parse_args():
+		parser = argparse.ArgumentParser(description='Fluid simulation of a dumbbell topology')
+		parser.add_argument('-n', '--flows', type=int, default=4, help='number of flows')
+		parser.add_argument('-s', '--size', type=int, default=200000, help='bytes per flow')
+		parser.add_argument('--validate', action='store_true',
+			help='compare against packet-level TCP')
+		return parser.parse_args()
+
+if __name__ == '__main__':
+	args = _parse_args()
+	nodes, clients, server = _dumbbell(args.flows if args.validate else min(args.flows, 1000))
+	flows = [(clients[i % len(clients)], server, args.size, .1*i) for i in xrange(args.flows)]
+	if args.validate:
+		for i, (packet, fluid) in enumerate(validate(nodes, flows)):
+			print '%4d packet %8.4f fluid %8.4f error %6.2f%%' % (i, packet, fluid,
+				100 * (fluid - packet) / packet)
+	else:
+		import timeit
+		start = timeit.default_timer()
+		fluid = FluidSimulator()
+		for flow in flows:
+			fluid.add_flow(*flow)
+		fluid.run()
+		times = fluid.completion_times()
+		print '%d flows in %.2f s; mean completion time %.4f' % (len(times),
+			timeit.default_timer() - start, sum(times) / len(times))
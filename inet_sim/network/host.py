@@ -11,16 +11,27 @@ SOCK_STREAM = 'SOCK_STREAM' #TCP
 
 class Host(Node):
 	"""Represents an endpoint on the Internet.
-	Currently, a Host may have exactly one IP address.
+	A Host may have several IP addresses (see Node.add_address); ip is the primary one, which
+	sockets use unless bound to another.
 	"""
 
-	def __init__(self, ip):
-		"""Construct a host with the given ip address."""
-		Node.__init__(self, ip)
-		Link.duplex_link(self, self, 1e-6, 1e9)
+	threaded = True #whether its sockets block sim threads, so need a context without an EventLoop
+
+	def __init__(self, ip, context=None):
+		"""Construct a host with the given ip address, in context (by default, the DEFAULT
+		Context). Its links and sockets share the context."""
+		Node.__init__(self, ip, context)
+		if self.threaded and self.context.loop is not None:
+			raise Exception('Host needs a context without an EventLoop; use aio.AsyncHost')
+		self._add_loopback()
 		self.port_to_udp = {}
 		self.port_to_tcp = {}
 		self.origin_to_tcp = {}
+		self.time_wait = {} # (local, remote) address to TcpSocket in TIME_WAIT
+		self.capture = None # optional PcapWriter, of packets sent and received
+
+	def _add_loopback(self):
+		Link.duplex_link(self, self, 1e-6, 1e9)
 
 	def __log(self, fmt, *args, **kwargs):
 		level = kwargs.get('level', logging.INFO)
@@ -28,24 +39,31 @@ class Host(Node):
 
 	def handle(self, packet):
 		"""Called (by Node) to handle a packet."""
+		if self.capture:
+			self.capture.write(self.context.time(), packet)
 		packet = packet.body # unpack TCP/UDP packet from IP Packet
 		if isinstance(packet, UdpPacket):
 			self.__log('recv-packet UDP %s:%d', packet.origin[0], packet.origin[1])
-			try:
-				self.port_to_udp[packet.dest[1]]._buffer(packet)
-			except KeyError:
-				pass
+			socket = self.port_to_udp.get(packet.dest[1])
+			if socket is None:
+				self.__log('no socket for UDP %s:%d', packet.dest[0], packet.dest[1])
+			else:
+				socket._buffer(packet)
 		elif isinstance(packet, TcpPacket):
 			self.__log('recv-packet TCP %s:%d', packet.origin[0], packet.origin[1])
-			try:
-				self.origin_to_tcp[packet.origin]._buffer(packet)
-			except KeyError:
-				self.port_to_tcp[packet.dest[1]]._buffer(packet)
+			socket = self.origin_to_tcp.get(packet.origin) or self.port_to_tcp.get(packet.dest[1])
+			if socket is None or socket.state == 'LISTEN' and not packet.syn:
+				self.__log('no connection for TCP %s:%d', packet.origin[0], packet.origin[1])
+			else:
+				socket._buffer(packet)
 		else:
 			raise Exception("Unrecognized protocol")
 
 	def send(self, packet):
-		Node.send(self, IpPacket(packet.origin[0], packet.dest[0], packet))
+		packet = IpPacket(packet.origin[0], packet.dest[0], packet, self.context)
+		if self.capture:
+			self.capture.write(self.context.time(), packet)
+		Node.send(self, packet)
 
 	# socket
 
@@ -56,6 +74,13 @@ class Host(Node):
 		elif domain == AF_INET and sock_type == SOCK_STREAM:
 			return TcpSocket(self)
 
+	def release_tcp(self, socket):
+		"""Remove a closed TcpSocket from the connection tables."""
+		if self.origin_to_tcp.get(getattr(socket, 'remote', None)) is socket:
+			del self.origin_to_tcp[socket.remote]
+		if self.port_to_tcp.get(socket.local[1]) is socket:
+			del self.port_to_tcp[socket.local[1]]
+
 	def get_available_udp(self):
 		"""Return an available UDP port on this Host."""
 		try:
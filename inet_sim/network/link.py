@@ -1,22 +1,21 @@
 from __future__ import division
 import heapq
-import itertools
 import logging
-import random
 
-from sim import sim, Mutex
+from ..context import DEFAULT
+from sim import Mutex
 
 class IpPacket:
 	"""Represents a network packet."""
-	
-	id_counter = itertools.count()
 
-	def __init__(self, origin, dest, body):
-		"""Create a IpPacket."""
-		self.id = next(IpPacket.id_counter)
+	def __init__(self, origin, dest, body, context=None):
+		"""Create a IpPacket, numbered by context (by default, the DEFAULT Context)."""
+		self.id = next((context or DEFAULT).packet_ids)
 		self.origin = origin
 		self.dest = dest
 		self.body = body
+		self.arrival = None # time it was queued at its current link
+		self.spacing = 0.   # time between the arrivals of the wire packets of a super-segment
 
 	def __len__(self):
 		"""Return the size, in bytes."""
@@ -25,57 +24,178 @@ class IpPacket:
 class Link:
 	"""Represents a unidirectional link."""
 
-	id_counter = itertools.count()
+	threaded = True #whether it transmits with sim threads, so needs a context without an EventLoop
 
-	@staticmethod
-	def duplex_link(node1, node2, prop_delay, bandwidth):
-		link1 = Link(node1, node2, prop_delay, bandwidth)
-		link2 = Link(node2, node1, prop_delay, bandwidth)
+	@classmethod
+	def duplex_link(cls, node1, node2, prop_delay, bandwidth, **kwargs):
+		link1 = cls(node1, node2, prop_delay, bandwidth, **kwargs)
+		link2 = cls(node2, node1, prop_delay, bandwidth, **kwargs)
 		node1.add_link(link1, link2)
 		node2.add_link(link2, link1)
 		return link1, link2
 
-	def __init__(self, source, dest, prop_delay, bandwidth):
-		"""Creates a Link between the specified Hosts.
+	def __init__(self, source, dest, prop_delay, bandwidth, context=None):
+		"""Creates a Link between the specified Hosts, in context (by default, that of source).
 		This also registers the Link with the source."""
 		self.source = source
 		self.dest = dest
 		self.prop_delay = prop_delay
 		self.bandwidth = bandwidth
-		self.id = next(Link.id_counter)
+		self.context = context or source.context
+		if self.threaded and self.context.loop is not None:
+			raise Exception('Link needs a context without an EventLoop; use aio.AsyncLink')
+		self.id = next(self.context.link_ids)
 		self.loss = 0.
+		self.bytes = 0 # transmitted
+		self.metrics = None # optional LinkMetrics
+		self.capture = None # optional PcapWriter
+		self.up = True # whether the link carries packets; see set_up()
+		self.failures = 0 # times the link has gone down
+		self.segment = False # whether to split TCP super-segments into wire packets, for accurate
+		                     # queueing; set on bottleneck links
 		
-		self.__max_queue_size = 48
-		self.__queue = []
+		self._max_queue_size = 48
+		self._queue = []
+		self._free = 0. # time the last transmission finished
 		self.__mutex = Mutex()
 		
 	
-	def __log(self, fmt, *args):
+	def _log(self, fmt, *args):
 		logging.getLogger(__name__).info('link %s->%s '+fmt, self.source.ip, self.dest.ip, *args)
 
+	def _now(self):
+		"""Return the current simulated time."""
+		return self.context.time()
+
+	def set_up(self, up):
+		"""Bring the link up or down. Going down loses the queued packets, and those being
+		transmitted or propagated. Routes are not changed; see Routes.update()."""
+		if up == self.up:
+			return
+		self.up = up
+		self._log('link-up' if up else 'link-down')
+		if not up:
+			self.failures += 1
+			for _, _, packet in self._queue:
+				self._lost(packet)
+			del self._queue[:]
+			if self.metrics:
+				self.metrics.queue_size(self._now(), 0)
+
+	def _lost(self, packet):
+		"""Called when a packet is lost because the link is down."""
+		self._log('link-drop %d', packet.id)
+		if self.metrics:
+			self.metrics.drop(self._now())
+
 	def enqueue(self, packet, priority=3):
 		"""Called to place this packet in the queue."""
-		if random.random() < self.loss:
-			self.__log('packet-loss %d', packet.id)
-		elif len(self.__queue) >= self.__max_queue_size:
-			self.__log('queue-overflow %d', packet.id)
+		if not self.up:
+			self._lost(packet)
+			return
+		body = packet.body
+		if getattr(body, 'segment_size', None):
+			if self.segment:
+				for body in body.split():
+					self.enqueue(IpPacket(packet.origin, packet.dest, body, self.context), priority)
+				return
+			if self.loss:
+				# each wire packet is lost on its own; if any are, the others go on separately
+				n = -(-len(body.message) // body.segment_size)
+				lost = [self.context.random.random() < self.loss for _ in xrange(n)]
+				if any(lost):
+					for body, dropped in zip(body.split(), lost):
+						wire = IpPacket(packet.origin, packet.dest, body, self.context)
+						if dropped:
+							self.__drop(wire, 'packet-loss')
+						else:
+							self.__push(wire, priority)
+					return
+			self.__push(packet, priority)
+		elif self.context.random.random() < self.loss:
+			self.__drop(packet, 'packet-loss')
+		else:
+			self.__push(packet, priority)
+
+	def __drop(self, packet, event):
+		self._log(event + ' %d', packet.id)
+		if self.metrics:
+			self.metrics.drop(self._now())
+
+	def __push(self, packet, priority):
+		"""Queue packet, unless the queue is full."""
+		if len(self._queue) >= self._max_queue_size:
+			self.__drop(packet, 'queue-overflow')
 		else:
-			heapq.heappush(self.__queue, (priority, packet))
-			self.__log('queue-start %d', packet.id)
-			sim.new_thread(self.send)
+			packet.arrival = self._now()
+			heapq.heappush(self._queue, (priority, packet.id, packet)) # FIFO within a priority
+			self._log('queue-start %d', packet.id)
+			if self.metrics:
+				self.metrics.queue_size(self._now(), len(self._queue))
+			self._schedule()
+
+	def _schedule(self):
+		"""Called when a packet has been queued, to arrange for it to be sent."""
+		self.context.new_thread(self.send)
+
+	def _dequeue(self):
+		"""Remove and return the next packet from the queue."""
+		priority, _, packet = heapq.heappop(self._queue)
+		self._log('queue-end %d', packet.id)
+		if self.metrics:
+			self.metrics.queue_size(self._now(), len(self._queue))
+		return packet
+
+	def _transmission(self, packet):
+		"""Return how long transmitting packet takes, starting now.
+		The wire packets of a super-segment arrived packet.spacing apart, the last of them when it
+		was queued, and each is sent on as soon as it has arrived and the link is free. So unless
+		it waited in the queue, its transmission overlaps their arrival, and only its last wire
+		packet is delayed by all of them.
+		"""
+		body = packet.body
+		if not getattr(body, 'segment_size', None):
+			return len(packet) / self.bandwidth
+		now = self._now()
+		n = -(-len(body.message) // body.segment_size)
+		wire = len(packet) / self.bandwidth / n # per wire packet
+		free = now if now > packet.arrival else min(self._free, now)
+		finish = max(free + n * wire, packet.arrival + wire,
+			packet.arrival - (n - 1) * packet.spacing + n * wire)
+		packet.spacing = max(packet.spacing, wire)
+		return finish - now
+
+	def _transmitted(self, packet):
+		"""Called when a packet has been transmitted."""
+		self._free = self._now()
+		self._log('transmit-end %d', packet.id)
+		self.bytes += len(packet)
+		if self.capture:
+			self.capture.write(self._now(), packet)
+		if self.metrics:
+			self.metrics.transmit(self._now(), len(packet))
 			
 	def send(self):
 		self.__mutex.lock()
-		priority, packet = heapq.heappop(self.__queue)
-		self.__log('queue-end %d', packet.id)
+		if not self._queue: # lost when the link went down
+			self.__mutex.unlock()
+			return
+		packet = self._dequeue()
+		failures = self.failures
 		
-		self.__log('transmit-start %d', packet.id)
-		sim.sleep(len(packet) / self.bandwidth)
-		self.__log('transmit-end %d', packet.id)
+		self._log('transmit-start %d', packet.id)
+		self.context.sleep(self._transmission(packet))
+		if self.failures != failures:
+			self.__mutex.unlock()
+			self._lost(packet)
+			return
+		self._transmitted(packet)
 		self.__mutex.unlock()
 		
-		self.__log('propogate-start %d', packet.id)
-		sim.sleep(self.prop_delay)
-		self.__log('propogate-end %d', packet.id)
+		self._log('propogate-start %d', packet.id)
+		self.context.sleep(self.prop_delay)
+		if self.failures != failures:
+			self._lost(packet)
+			return
+		self._log('propogate-end %d', packet.id)
 		self.dest.received(packet, self)
-
@@ -0,0 +1,284 @@
+"""Streaming metrics, computed during the simulation in bounded memory.
+
+Attach a LinkMetrics to a Link or a TcpMetrics to a TcpSocket (e.g. link.metrics =
+LinkMetrics(link)). Every interval of simulated time a snapshot is logged as a 'metrics' event and
+passed to any listeners, so long runs can be summarized without writing or parsing a full trace.
+Rates are averaged over a sliding window, which defaults to the snapshot interval.
+
+Snapshots are taken by a timer in the context of the link or socket. It stops after an interval
+without updates, so that it does not keep the simulation running; the next update first emits the
+snapshots missed meanwhile.
+"""
+from __future__ import division
+from abc import ABCMeta, abstractmethod
+from collections import deque
+import logging
+import math
+
+class WindowedRate:
+	"""Amount per second over a sliding window, kept as a ring of fixed-width buckets."""
+
+	def __init__(self, window=1., buckets=10):
+		self.width = window / buckets
+		self.window = window
+		self.buckets = [0] * buckets
+		self.last = 0 # index of the most recent bucket, counted from time 0
+		self.total = 0
+
+	def __advance(self, time):
+		i = int(time / self.width)
+		for j in xrange(self.last + 1, min(i, self.last + len(self.buckets)) + 1):
+			self.buckets[j % len(self.buckets)] = 0
+		self.last = max(self.last, i)
+
+	def add(self, time, amount):
+		self.__advance(time)
+		self.buckets[int(time / self.width) % len(self.buckets)] += amount
+		self.total += amount
+
+	def rate(self, time):
+		"""Return the amount per second over the window ending at time."""
+		self.__advance(time)
+		return sum(self.buckets) / self.window
+
+class TimeWeighted:
+	"""Time-weighted mean and maximum of a piecewise-constant value."""
+
+	def __init__(self, time=0., value=0):
+		self.value = value
+		self.max = value
+		self.__start = self.__time = time
+		self.__area = 0.
+
+	def update(self, time, value):
+		self.__area += self.value * (time - self.__time)
+		self.__time = time
+		self.value = value
+		self.max = max(self.max, value)
+
+	def mean(self, time):
+		"""Return the mean since the last reset."""
+		area = self.__area + self.value * (time - self.__time)
+		return area / (time - self.__start) if time > self.__start else self.value
+
+	def reset(self, time):
+		self.update(time, self.value)
+		self.__start = time
+		self.__area = 0.
+		self.max = self.value
+
+class Histogram:
+	"""Counts of values in buckets. With a linear width, bucket i holds [i*width, (i+1)*width).
+	With a relative precision instead, buckets grow geometrically so that any percentile is
+	within that relative error, and memory is logarithmic in the range of values.
+	"""
+
+	def __init__(self, width=None, precision=.01):
+		self.width = width
+		self.__base = math.log(1 + precision)
+		self.counts = {}
+		self.count = 0
+
+	def __bucket(self, value):
+		if self.width is not None:
+			return int(value // self.width)
+		return int(math.floor(math.log(value) / self.__base)) if value > 0 else None
+
+	def __value(self, bucket):
+		"""Return a representative value of the bucket."""
+		if self.width is not None:
+			return bucket * self.width
+		return math.exp((bucket + .5) * self.__base) if bucket is not None else 0.
+
+	def add(self, value):
+		bucket = self.__bucket(value)
+		self.counts[bucket] = self.counts.get(bucket, 0) + 1
+		self.count += 1
+
+	def percentile(self, p):
+		"""Return the value at percentile p (0 to 100), or None if there are no values."""
+		if not self.count:
+			return None
+		rank = p / 100 * (self.count - 1)
+		seen = 0
+		for bucket in sorted(self.counts, key=lambda b: (b is not None, b)):
+			seen += self.counts[bucket]
+			if seen > rank:
+				return self.__value(bucket)
+
+	def buckets(self):
+		"""Return a sorted list of (value, count)."""
+		return sorted((self.__value(b), c) for b, c in self.counts.iteritems())
+
+	def clear(self):
+		self.counts.clear()
+		self.count = 0
+
+class Metrics:
+	"""Base class of metrics which are snapshotted every interval of simulated time, by a timer in
+	context."""
+
+	__metaclass__ = ABCMeta
+
+	def __init__(self, interval, context):
+		self.interval = interval
+		self.context = context
+		self.snapshots = deque(maxlen=1000) # most recent snapshots
+		self.listeners = []
+		self.__intervals = 1 # number of the next snapshot time, in intervals
+		self.__timer = False # whether the timer is running
+		self.__updated = False # whether there were updates since the last snapshot
+
+	def __next(self):
+		return self.__intervals * self.interval
+
+	def _tick(self, time):
+		"""Called at every update. Start the timer if it has stopped, after emitting the snapshots
+		it missed."""
+		if not self.__timer:
+			while self.__next() <= time:
+				self.__snapshot()
+			self.__timer = True
+			self.context.call_later(self.__next() - time, self.__fire)
+		self.__updated = True
+
+	def __fire(self):
+		updated = self.__updated
+		self.__snapshot()
+		if updated:
+			self.context.call_later(self.__next() - self.context.time(), self.__fire)
+		else:
+			self.__timer = False
+
+	def __snapshot(self):
+		"""Emit the snapshot at the end of the current interval."""
+		self.flush(self.__next())
+		self.__intervals += 1
+		self.__updated = False
+
+	def flush(self, time):
+		"""Emit a snapshot now."""
+		snapshot = self.snapshot(time)
+		snapshot['time'] = time
+		self.snapshots.append(snapshot)
+		logging.getLogger(__name__).info('metrics %s %s', self.label(),
+			' '.join('%s=%s' % (k, _format(v)) for k, v in sorted(snapshot.iteritems()) if k != 'time'))
+		for listener in self.listeners:
+			listener(self, snapshot)
+		self.reset(time)
+
+	@abstractmethod
+	def label(self):
+		"""Return the name of what is measured, for the log."""
+		pass
+
+	@abstractmethod
+	def snapshot(self, time):
+		"""Return a dict of the current values."""
+		pass
+
+	def reset(self, time):
+		"""Called after a snapshot, to start the next interval."""
+		pass
+
+def _format(value):
+	return '%.4g' % (value,) if isinstance(value, float) else str(value)
+
+class LinkMetrics(Metrics):
+	"""Throughput, time-weighted queue occupancy and drops of a Link."""
+
+	def __init__(self, link, interval=1., window=None):
+		Metrics.__init__(self, interval, link.context)
+		self.link = link
+		self.rate = WindowedRate(window or interval)
+		self.queue = TimeWeighted()
+		self.drops = 0
+		self.__drops = 0 # since the last snapshot
+
+	def label(self):
+		return 'link %s->%s' % (self.link.source.ip, self.link.dest.ip)
+
+	def queue_size(self, time, size):
+		"""Called when the queue size changes."""
+		self._tick(time)
+		self.queue.update(time, size)
+
+	def drop(self, time):
+		"""Called when a packet is lost or the queue overflows."""
+		self._tick(time)
+		self.drops += 1
+		self.__drops += 1
+
+	def transmit(self, time, size):
+		"""Called when size bytes have been transmitted."""
+		self._tick(time)
+		self.rate.add(time, size)
+
+	def snapshot(self, time):
+		return {
+			'rate': self.rate.rate(time) * 8,
+			'bytes': self.rate.total,
+			'queue_mean': self.queue.mean(time),
+			'queue_max': self.queue.max,
+			'drops': self.__drops,
+			'utilization': self.rate.rate(time) / self.link.bandwidth,
+		}
+
+	def reset(self, time):
+		self.queue.reset(time)
+		self.__drops = 0
+
+class TcpMetrics(Metrics):
+	"""Goodput, RTT percentiles and cwnd histogram of a TcpSocket."""
+
+	def __init__(self, socket, interval=1., window=None):
+		Metrics.__init__(self, interval, socket.host.context)
+		self.socket = socket
+		self.window = window
+		self.acked = WindowedRate(window or interval)
+		self.received = WindowedRate(window or interval)
+		self.rtt = Histogram()
+		self.cwnd = Histogram(width=1500)
+		self.interval_rtt = Histogram()
+
+	def child(self, socket):
+		"""Return TcpMetrics for a socket accepted by this one's, with the same interval, window
+		and listeners."""
+		metrics = TcpMetrics(socket, self.interval, self.window)
+		metrics.listeners = list(self.listeners)
+		return metrics
+
+	def label(self):
+		local = getattr(self.socket, 'local', ('-', '-'))
+		return 'tcp %s:%s' % local
+
+	def rtt_sample(self, time, rtt):
+		self._tick(time)
+		self.rtt.add(rtt)
+		self.interval_rtt.add(rtt)
+
+	def cwnd_change(self, time, cwnd):
+		self._tick(time)
+		self.cwnd.add(cwnd)
+
+	def ack(self, time, num_bytes):
+		"""Called when num_bytes sent bytes are newly acknowledged."""
+		self._tick(time)
+		self.acked.add(time, num_bytes)
+
+	def data(self, time, num_bytes):
+		"""Called when num_bytes more bytes have been received in order."""
+		self._tick(time)
+		self.received.add(time, num_bytes)
+
+	def snapshot(self, time):
+		return {
+			'send_rate': self.acked.rate(time) * 8,
+			'recv_rate': self.received.rate(time) * 8,
+			'rtt_p50': self.interval_rtt.percentile(50),
+			'rtt_p99': self.interval_rtt.percentile(99),
+			'cwnd_p50': self.cwnd.percentile(50),
+		}
+
+	def reset(self, time):
+		self.interval_rtt.clear()
@@ -0,0 +1,435 @@
+"""Packet capture in the pcap format, and replay of captured traffic.
+
+A PcapWriter attached to links or hosts records each packet they carry, with IPv4 and TCP/UDP
+headers synthesised from the simulated packets, so that standard tools (tcpdump, Wireshark) can
+analyse simulated traffic:
+
+	writer = PcapWriter('out.pcap')
+	writer.attach(link1, host2)
+	...
+	sim.run()
+	writer.close()
+
+TCP sequence numbers start at 0 in each direction, and a SYN or FIN takes one, as on the wire.
+Checksums other than the IP header's are zero. Super-segments are written as their wire packets.
+
+read() parses a capture (raw IP or Ethernet) into Records, and Replay drives the TCP and UDP flows
+of a capture through a simulated network as open-loop traffic: every write or datagram is offered
+at its captured time with its captured size, whatever the simulated network does with it.
+
+	python -m inet_sim.network.pcap trace.pcap
+
+replays a capture between hosts on a single router, one per captured address.
+"""
+from __future__ import absolute_import, division
+import argparse
+from socket import inet_aton, inet_ntoa
+import struct
+
+from .tcp import TcpPacket
+from .udp import UdpPacket
+from sim import sim, Event
+
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101 #raw IPv4/IPv6
+WINDOW_SCALE = 7 #window scale option of synthesised SYNs
+
+_FILE_HEADER = struct.Struct('<IHHiIII')
+_RECORD_HEADER = struct.Struct('<IIII')
+_IP_HEADER = struct.Struct('!BBHHHBBH4s4s')
+_TCP_HEADER = struct.Struct('!HHIIBBHHH')
+_TCP_SYN_OPTIONS = struct.Struct('!BBHBBBB') #MSS, NOP, window scale
+_UDP_HEADER = struct.Struct('!HHHH')
+
+_TCP = 6
+_UDP = 17
+_FIN, _SYN, _ACK = 0x01, 0x02, 0x10
+
+class PcapWriter:
+	"""Writes packets to a pcap file (a path, or a file object opened for binary writing). Records
+	are collected in memory and written in blocks of about buffer_size bytes. At most snaplen bytes
+	of each packet are kept.
+	"""
+
+	def __init__(self, f, snaplen=65535, buffer_size=1 << 20):
+		self.__own = isinstance(f, basestring)
+		self.file = open(f, 'wb') if self.__own else f
+		self.snaplen = snaplen
+		self.buffer_size = buffer_size
+		self.packets = 0 #written
+		self.__chunks = []
+		self.__buffered = 0
+		self.__seq = {} #(origin, dest) to next TCP sequence number, for segments without one
+		self.__acks = {} #(origin, dest) to the last TCP acknowledgement number sent, on the wire
+		self.__syns = set() #(origin, dest) of TCP SYNs sent
+		self.file.write(_FILE_HEADER.pack(0xa1b2c3d4, 2, 4, 0, 0, snaplen, LINKTYPE_RAW))
+
+	def attach(self, *targets):
+		"""Record the packets carried by links (as they finish transmission), and sent or received by
+		hosts."""
+		for target in targets:
+			target.capture = self
+
+	def write(self, time, packet):
+		"""Record an IpPacket at the given simulated time."""
+		body = packet.body
+		if isinstance(body, TcpPacket):
+			if body.segment_size:
+				for i in xrange(0, len(body.message), body.segment_size):
+					self.__tcp(time, packet, body, body.seq_num + i,
+						body.message[i:i + body.segment_size])
+			else:
+				self.__tcp(time, packet, body, body.seq_num, body.message)
+		elif isinstance(body, UdpPacket):
+			self.__packet(time, packet, _UDP, _UDP_HEADER.pack(body.origin[1], body.dest[1],
+				8 + len(body.message), 0), body.message)
+
+	def __tcp(self, time, packet, body, seq_num, message):
+		key = body.origin, body.dest
+		reverse = body.dest, body.origin
+		ack = None
+		if body.ack:
+			ack = self.__acks[key] = (body.ack_num + 1) & 0xffffffff
+		elif not body.syn and reverse in self.__syns:
+			# once the other side's SYN is seen, every segment acknowledges as on the wire
+			ack = self.__acks.get(key, (self.__seq.get(reverse, 0) + 1) & 0xffffffff)
+		flags = (_FIN if body.fin else 0) | (_SYN if body.syn else 0) | (_ACK if ack is not None else 0)
+		if body.syn:
+			self.__syns.add(key)
+			seq = seq_num
+			options = _TCP_SYN_OPTIONS.pack(2, 4, body.mss or 0, 1, 3, 3, WINDOW_SCALE) \
+				if body.mss else ''
+			window = body.window
+		else:
+			if seq_num is None:
+				seq_num = self.__seq.get(key, 0)
+			seq = seq_num + 1
+			options = ''
+			window = body.window >> WINDOW_SCALE if body.window is not None else None
+			end = seq_num + (len(message) if message else 0) + (1 if body.fin else 0)
+			self.__seq[key] = max(self.__seq.get(key, 0), end)
+		header = _TCP_HEADER.pack(body.origin[1], body.dest[1], seq & 0xffffffff,
+			ack if ack is not None else 0, (5 + len(options) // 4) << 4, flags,
+			min(window, 0xffff) if window is not None else 0xffff, 0, 0)
+		self.__packet(time, packet, _TCP, header + options, message)
+
+	def __packet(self, time, packet, protocol, header, message):
+		payload = ''.join(message) if message else ''
+		length = 20 + len(header) + len(payload)
+		ip = _IP_HEADER.pack(0x45, 0, min(length, 0xffff), packet.id & 0xffff, 0x4000, 64, protocol,
+			0, inet_aton(packet.origin), inet_aton(packet.dest))
+		ip = ip[:10] + struct.pack('!H', _checksum(ip)) + ip[12:]
+		data = ip + header + payload
+		if len(data) > self.snaplen:
+			data = data[:self.snaplen]
+		seconds = int(time)
+		self.__chunks.append(_RECORD_HEADER.pack(seconds, int((time - seconds) * 1e6), len(data),
+			length))
+		self.__chunks.append(data)
+		self.packets += 1
+		self.__buffered += 16 + len(data)
+		if self.__buffered >= self.buffer_size:
+			self.flush()
+
+	def flush(self):
+		"""Write the buffered records."""
+		self.file.write(''.join(self.__chunks))
+		self.__chunks = []
+		self.__buffered = 0
+
+	def close(self):
+		self.flush()
+		if self.__own:
+			self.file.close()
+		else:
+			self.file.flush()
+
+def _checksum(header):
+	"""Return the Internet checksum of an IP header (whose checksum field is zero)."""
+	total = sum(struct.unpack('!%dH' % (len(header) // 2), header))
+	total = (total & 0xffff) + (total >> 16)
+	total += total >> 16
+	return ~total & 0xffff
+
+# reading
+
+class Record:
+	"""A captured TCP segment or UDP datagram. size is the length of its payload, which may be more
+	than was captured."""
+
+	def __init__(self, time, protocol, origin, dest, size, seq_num=None, flags=0):
+		self.time = time
+		self.protocol = protocol #'tcp' or 'udp'
+		self.origin = origin #(ip, port)
+		self.dest = dest
+		self.size = size
+		self.seq_num = seq_num
+		self.flags = flags
+
+	@property
+	def syn(self):
+		return bool(self.flags & _SYN)
+
+	@property
+	def ack(self):
+		return bool(self.flags & _ACK)
+
+def read(f):
+	"""Generate the TCP and UDP Records of an IPv4 pcap file (a path, or a file object opened for
+	binary reading), in order. Other packets, and fragments after the first, are skipped."""
+	own = isinstance(f, basestring)
+	if own:
+		f = open(f, 'rb')
+	try:
+		header = f.read(24)
+		magic, = struct.unpack('<I', header[:4])
+		if magic in (0xa1b2c3d4, 0xa1b23c4d):
+			order = '<'
+		elif magic in (0xd4c3b2a1, 0x4d3cb2a1):
+			order = '>'
+		else:
+			raise Exception('Not a pcap file')
+		resolution = 1e9 if magic in (0xa1b23c4d, 0x4d3cb2a1) else 1e6
+		linktype, = struct.unpack(order + 'I', header[20:24])
+		if linktype not in (LINKTYPE_RAW, LINKTYPE_ETHERNET, 228):
+			raise Exception('Unsupported link type %d' % linktype)
+		record_header = struct.Struct(order + 'IIII')
+		while True:
+			header = f.read(16)
+			if len(header) < 16:
+				break
+			seconds, fraction, captured, _ = record_header.unpack(header)
+			data = f.read(captured)
+			if linktype == LINKTYPE_ETHERNET:
+				data = _ethernet_payload(data)
+			record = _parse_ip(seconds + fraction / resolution, data)
+			if record is not None:
+				yield record
+	finally:
+		if own:
+			f.close()
+
+def _ethernet_payload(data):
+	"""Return the IPv4 packet of an Ethernet frame (possibly VLAN tagged), or None."""
+	offset = 12
+	while len(data) >= offset + 2:
+		ethertype, = struct.unpack('!H', data[offset:offset + 2])
+		if ethertype == 0x8100:
+			offset += 4
+		elif ethertype == 0x0800:
+			return data[offset + 2:]
+		else:
+			break
+
+def _parse_ip(time, data):
+	if not data or len(data) < 20 or ord(data[0]) >> 4 != 4:
+		return None
+	version_ihl, _, length, _, fragment, _, protocol, _, origin, dest = _IP_HEADER.unpack(data[:20])
+	if fragment & 0x1fff:
+		return None
+	ihl = (version_ihl & 0xf) * 4
+	origin, dest = inet_ntoa(origin), inet_ntoa(dest)
+	segment = data[ihl:]
+	if protocol == _TCP and len(segment) >= 20:
+		sport, dport, seq, _, offset, flags, _, _, _ = _TCP_HEADER.unpack(segment[:20])
+		return Record(time, 'tcp', (origin, sport), (dest, dport),
+			length - ihl - (offset >> 4) * 4, seq, flags)
+	if protocol == _UDP and len(segment) >= 8:
+		sport, dport, udp_length, _ = _UDP_HEADER.unpack(segment[:8])
+		return Record(time, 'udp', (origin, sport), (dest, dport), udp_length - 8)
+
+# replay
+
+class Flow:
+	"""A captured TCP connection, or the UDP datagrams from one address to another. writes are the
+	(time, size) of the payload sent by origin, and replies those sent back by dest (always empty
+	for UDP)."""
+
+	def __init__(self, protocol, origin, dest, start):
+		self.protocol = protocol
+		self.origin = origin
+		self.dest = dest
+		self.start = start
+		self.writes = []
+		self.replies = []
+
+def flows(records):
+	"""Return the Flows of Records, in order of their first packet. TCP retransmissions are not
+	counted twice: only payload beyond the highest sequence number seen so far is."""
+	result = []
+	by_key = {}
+	ends = {} #(origin, dest) to (initial sequence number, end of payload seen)
+	for record in records:
+		if record.protocol == 'udp':
+			key = 'udp', record.origin, record.dest
+		else:
+			key = 'tcp', min(record.origin, record.dest), max(record.origin, record.dest)
+		flow = by_key.get(key)
+		if flow is None:
+			origin, dest = record.origin, record.dest
+			if record.protocol == 'tcp' and record.syn and record.ack:
+				origin, dest = dest, origin # the SYN was missed
+			flow = by_key[key] = Flow(record.protocol, origin, dest, record.time)
+			result.append(flow)
+		if record.protocol == 'udp':
+			flow.writes.append((record.time, record.size))
+			continue
+		direction = record.origin, record.dest
+		if record.syn:
+			ends[direction] = record.seq_num, 0
+			continue
+		isn, end = ends.setdefault(direction, ((record.seq_num - 1) & 0xffffffff, 0))
+		offset = (record.seq_num - isn - 1) & 0xffffffff
+		if record.size > 0 and offset + record.size > end:
+			ends[direction] = isn, offset + record.size
+			sends = flow.writes if record.origin == flow.origin else flow.replies
+			sends.append((record.time, offset + record.size - max(offset, end)))
+	return result
+
+class Replay:
+	"""Replays captured flows between simulated hosts. hosts maps each captured ip to the Host which
+	plays it; flows with an unmapped end are skipped. TCP flows connect to the captured port of
+	their dest, and each side writes its captured payload at the captured times, then closes once it
+	has also read everything the other side sends. UDP datagrams are sent to the captured port.
+	Hosts are driven by threads, so must be of a context without an EventLoop.
+	"""
+
+	def __init__(self, records, hosts):
+		self.hosts = hosts
+		self.context = next(hosts.itervalues()).context if hosts else None
+		self.flows = [flow for flow in flows(records)
+			if flow.origin[0] in hosts and flow.dest[0] in hosts]
+		self.offered = sum(size for flow in self.flows for _, size in flow.writes + flow.replies)
+		self.sent = 0 #bytes written or sent so far
+		self.received = 0 #bytes read or received so far
+		self.completed = 0 #TCP connections closed by both sides
+		self.__base = None #simulated time of the capture's time 0
+		self.__connections = {} #client address to Flow
+		self.__connected = Event()
+
+	def start(self, delay=0.):
+		"""Start replaying, with the first packet after delay."""
+		if not self.flows:
+			return
+		self.__base = self.context.time() + delay - min(flow.start for flow in self.flows)
+		listeners = set()
+		for flow in self.flows:
+			dest = self.hosts[flow.dest[0]], flow.dest[1]
+			if dest not in listeners:
+				listeners.add(dest)
+				self.__listen(flow.protocol, *dest)
+		for flow in self.flows:
+			self.context.new_thread(lambda flow=flow: self.__client(flow))
+
+	def __sleep_until(self, time):
+		delay = self.__base + time - self.context.time()
+		if delay > 0:
+			self.context.sleep(delay)
+
+	def __listen(self, protocol, host, port):
+		from .host import AF_INET, SOCK_DGRAM, SOCK_STREAM
+		if protocol == 'udp':
+			socket = host.socket(AF_INET, SOCK_DGRAM)
+			socket.bind((host.ip, port))
+			def receive():
+				while True:
+					for message, _ in socket.recvmmsg(64):
+						self.received += len(message)
+			self.context.new_thread(receive)
+		else:
+			socket = host.socket(AF_INET, SOCK_STREAM)
+			socket.bind((host.ip, port))
+			socket.listen()
+			def accept():
+				while True:
+					connection = socket.accept()
+					self.context.new_thread(lambda connection=connection: self.__server(connection))
+			self.context.new_thread(accept)
+
+	def __client(self, flow):
+		from .host import AF_INET, SOCK_DGRAM, SOCK_STREAM
+		host, dest = self.hosts[flow.origin[0]], self.hosts[flow.dest[0]]
+		self.__sleep_until(flow.start)
+		if flow.protocol == 'udp':
+			socket = host.socket(AF_INET, SOCK_DGRAM)
+			for time, size in flow.writes:
+				self.__sleep_until(time)
+				socket.sendto('\0' * size, (dest.ip, flow.dest[1]))
+				self.sent += size
+			socket.close()
+		else:
+			socket = host.socket(AF_INET, SOCK_STREAM)
+			socket.connect((dest.ip, flow.dest[1]))
+			self.__connections[socket.local] = flow
+			self.__connected.notify()
+			self.__converse(socket, flow.writes, flow.replies)
+
+	def __server(self, socket):
+		while socket.remote not in self.__connections:
+			self.__connected.wait()
+		flow = self.__connections.pop(socket.remote)
+		self.__converse(socket, flow.replies, flow.writes)
+		self.completed += 1
+
+	def __converse(self, socket, writes, reads):
+		"""Make writes, and read the bytes of reads, then close."""
+		expected = sum(size for _, size in reads)
+		done = Event()
+		state = {'read': 0, 'done': False}
+		def read():
+			while state['read'] < expected:
+				data = socket.recv()
+				if not data:
+					break
+				state['read'] += len(data)
+				self.received += len(data)
+			state['done'] = True
+			done.notify()
+		self.context.new_thread(read)
+		for time, size in writes:
+			self.__sleep_until(time)
+			socket.sendall('\0' * size)
+			self.sent += size
+		if not state['done']:
+			done.wait()
+		socket.close()
+
+def _star(ips, prop_delay=.005, bandwidth=1e7):
+	"""Return a router, and a dict of ip to a Host on it."""
+	from .host import Host
+	from .link import Link
+	from .routing import Node, static_routes
+	router = Node('0.0.0.1' if '0.0.0.1' not in ips else '0.0.0.2')
+	hosts = dict((ip, Host(ip)) for ip in ips)
+	for host in hosts.itervalues():
+		Link.duplex_link(host, router, prop_delay, bandwidth)
+	static_routes([router] + hosts.values())
+	return router, hosts
+
+def _parse_args():
+		parser = argparse.ArgumentParser(description='Replay a pcap capture in a simulated network')
+		parser.add_argument('capture', help='pcap file to replay')
+		parser.add_argument('-b', '--bandwidth', type=float, default=1e7,
+			help='bandwidth of each host\'s link, in bytes per second')
+		parser.add_argument('-d', '--delay', type=float, default=.005,
+			help='propagation delay of each host\'s link, in seconds')
+		parser.add_argument('-w', '--write', help='capture the replayed traffic to this pcap file')
+		return parser.parse_args()
+
+if __name__ == '__main__':
+	args = _parse_args()
+	records = list(read(args.capture))
+	ips = set(ip for record in records for ip in (record.origin[0], record.dest[0]))
+	router, hosts = _star(ips, args.delay, args.bandwidth)
+	writer = None
+	if args.write:
+		writer = PcapWriter(args.write)
+		writer.attach(*router.links()) # each packet once, on its way to its dest
+	replay = Replay(records, hosts)
+	replay.start()
+	sim.run()
+	if writer:
+		writer.close()
+	print '%d flows; %d bytes offered, %d sent, %d received; %d TCP connections completed in %.4f s' \
+		% (len(replay.flows), replay.offered, replay.sent, replay.received, replay.completed,
+		sim.time())
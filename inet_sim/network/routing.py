@@ -1,10 +1,15 @@
 from __future__ import division
+from array import array
+import heapq
+import itertools
 import operator
 import pickle
 import logging
+import zlib
 
 from sim import sim
 from link import IpPacket
+from ..context import DEFAULT
 
 class RoutingPacket(IpPacket):
 	
@@ -30,9 +35,17 @@ from .routing import Routing
 class Node:
 	"""Represents an node on the Internet."""
 
-	def __init__(self, ip):
-		"""Construct a host with the given ip address."""
+	def __init__(self, ip, context=None):
+		"""Construct a host with the given (primary) ip address, in context (by default, the DEFAULT
+		Context)."""
 		self.ip = ip
+		self.context = context or DEFAULT
+		self.addresses = set([ip])
+		self.routes = {} # ip to equal-cost outgoing links; neighbors without a route are sent to
+		                 # directly
+		self.spray = False # whether to spread packets over equal-cost links round robin, instead
+		                   # of choosing one per flow
+		self.__spray_counter = itertools.count()
 		self.__incoming_to_outgoing = {}
 		self.__vector = None # ip to distance
 		self.__matrix = None # ip to link to distance
@@ -44,11 +57,32 @@ class Node:
 	def add_link(self, outgoing, incoming):
 		self.__incoming_to_outgoing[incoming] = outgoing
 
+	def add_address(self, ip):
+		"""Add an address to this Node. Each address is reachable over any of its links."""
+		self.addresses.add(ip)
+
+	def links(self):
+		"""Return the outgoing links of this Node."""
+		return self.__incoming_to_outgoing.values()
+
+	def next_hop(self, dest, key=None):
+		"""Return the outgoing link toward the dest ip, or None. Among equal-cost links, one is chosen
+		by hashing key, so packets of a flow take the same path, or round robin when spraying.
+		"""
+		links = self.routes.get(dest)
+		if not links:
+			return next((v for v in self.links() if dest in v.dest.addresses), None)
+		if len(links) == 1:
+			return links[0]
+		if self.spray:
+			return links[next(self.__spray_counter) % len(links)]
+		# hash with this node's ip too, so that each level of a topology splits flows differently
+		return links[zlib.crc32(repr((self.ip, key))) % len(links)]
+
 	def send(self, packet):
 		"""Send packet."""
-		try:
-			link = next(v for v in self.__incoming_to_outgoing.values() if v.dest.ip == packet.dest)
-		except KeyError:
+		link = self.next_hop(packet.dest, _flow_key(packet))
+		if link is None:
 			self.__log('no entry for %s', packet.dest, level=logging.WARNING)
 		else:
 			self.__log('send-packet %s', packet.dest)
@@ -57,8 +91,8 @@ class Node:
 	def received(self, packet, link):
 		"""Called (by Link) to deliver a packet to this Node."""
 		self.__log('recv-packet %s', packet.dest)
-		if packet.dest != self.ip:
-			pass
+		if packet.dest not in self.addresses:
+			Node.send(self, packet) # forward, without a Host wrapping it again
 		elif isinstance(packet, RoutingPacket):
 			self.__log('recv-packet ROUTING %s', packet.origin[0])
 			self.__routing.recv(packet, link)
@@ -67,3 +101,124 @@ class Node:
 
 	def handle(self, packet):
 		raise Exception("Unrecognized protocal")
+
+def _flow_key(packet):
+	"""Return the flow of an IP packet: its TCP/UDP 4-tuple and protocol, if any."""
+	body = packet.body
+	if isinstance(getattr(body, 'origin', None), tuple):
+		return body.origin, body.dest, body.__class__.__name__
+	return packet.origin, packet.dest
+
+def static_routes(nodes):
+	"""Fill in the routes of each Node with shortest paths (by propagation delay) to every address of
+	every other. Where several outgoing links are on shortest paths, all are used (ECMP). Return the
+	Routes, for updating them when links change.
+	"""
+	return Routes(nodes)
+
+class Routes:
+	"""Shortest-path routes among nodes, kept up to date as links go down or up or change delay.
+
+	update() recomputes only the destinations whose routes may change: for a link which went down
+	or got slower, those with a forwarding entry on it; for a link which came up or got faster,
+	those to which it would give a path at least as short as the current one. Where the link is one
+	of several equal-cost links (or ties with them), distances do not change, and only the entry of
+	its source is edited.
+	"""
+
+	def __init__(self, nodes):
+		self.nodes = list(nodes)
+		self.__index = index = dict((node, i) for i, node in enumerate(self.nodes))
+		self.__incoming = [[] for _ in self.nodes] # node index to (source index, link)
+		self.__outgoing = [[] for _ in self.nodes] # node index to (dest index, link), by link id
+		self.__costs = {} # link to the prop_delay it was routed with, or None if down
+		for i, node in enumerate(self.nodes):
+			for link in sorted(node.links(), key=lambda link: link.id):
+				j = index.get(link.dest)
+				if j is None or j == i:
+					continue
+				self.__outgoing[i].append((j, link))
+				self.__incoming[j].append((i, link))
+				self.__costs[link] = _cost(link)
+		self.__distances = [None] * len(self.nodes) # dest index to array of distances to it
+		for dest in xrange(len(self.nodes)):
+			self.__compute(dest)
+
+	def __compute(self, dest):
+		"""Compute the distances and routes of every node to dest (by Dijkstra over reversed links)."""
+		inf = float('inf')
+		distance = [inf] * len(self.nodes)
+		distance[dest] = 0.
+		heap = [(0., dest)]
+		incoming = self.__incoming
+		while heap:
+			d, node = heapq.heappop(heap)
+			if d > distance[node]:
+				continue
+			for source, link in incoming[node]:
+				if link.up:
+					d2 = d + link.prop_delay
+					if d2 < distance[source]:
+						distance[source] = d2
+						heapq.heappush(heap, (d2, source))
+		self.__distances[dest] = array('d', distance)
+		addresses = self.nodes[dest].addresses
+		for i, node in enumerate(self.nodes):
+			if i == dest:
+				continue
+			d = distance[i] * (1 + 1e-9)
+			links = [link for j, link in self.__outgoing[i]
+				if link.up and link.prop_delay + distance[j] <= d] if distance[i] < inf else []
+			for ip in addresses:
+				node.routes[ip] = links
+
+	def update(self, links):
+		"""Update the routes affected by changes to links (going down or up, or a new prop_delay)
+		since they were last routed. Return the number of destinations whose routes changed."""
+		affected = set() # destinations to recompute
+		edited = set()
+		for link in links:
+			if link not in self.__costs:
+				continue
+			old, new = self.__costs[link], _cost(link)
+			self.__costs[link] = new
+			if old == new:
+				continue
+			source, j = self.__index[link.source], self.__index[link.dest]
+			routes = link.source.routes
+			if old is not None and (new is None or new > old):
+				# destinations forwarded over the link
+				for dest, node in enumerate(self.nodes):
+					links = routes.get(node.ip, ())
+					if link not in links or dest in affected:
+						continue
+					if len(links) == 1:
+						affected.add(dest)
+					else:
+						self.__set(dest, link.source, [l for l in links if l is not link])
+						edited.add(dest)
+			if new is not None and (old is None or new < old):
+				# destinations to which the link is now on a shortest path
+				for dest, distance in enumerate(self.__distances):
+					if dest == source or dest in affected or distance[j] == float('inf'):
+						continue
+					d = new + distance[j]
+					if d < distance[source] * (1 - 1e-9):
+						affected.add(dest)
+					elif d <= distance[source] * (1 + 1e-9):
+						links = routes[self.nodes[dest].ip]
+						if link not in links:
+							self.__set(dest, link.source,
+								sorted(links + [link], key=lambda link: link.id))
+							edited.add(dest)
+		for dest in sorted(affected):
+			self.__compute(dest)
+		return len(affected | edited)
+
+	def __set(self, dest, node, links):
+		"""Set the links of node toward every address of dest."""
+		for ip in self.nodes[dest].addresses:
+			node.routes[ip] = links
+
+def _cost(link):
+	return link.prop_delay if link.up else None
@@ -1,16 +1,23 @@
 from __future__ import division
 
 from .socket import Socket
-from sim import sim, Event, TimeoutException
+from sim import Event, TimeoutException
 
 class TcpPacket:
 	"""Represents a TCP packet."""
 
-	mss = 1500 #maximum segment size
+	mss = 1500 #default maximum segment size
 
 	def __init__(self, origin, dest, message=None, seq_num=None, ack_num=None, syn=False, fin=False,
-			timestamp=None):
-		"""Create a TCP packet."""
+			timestamp=None, mss=None, segment_size=None, window=None):
+		"""Create a TCP packet.
+		mss is the MSS option of a SYN. A data packet with a segment_size is a super-segment, which
+		stands for several wire packets of at most segment_size bytes of data each. window is the
+		receive window advertised by the sender, in bytes after ack_num (or after the SYN).
+		timestamp, the simulated time it was sent (or echoed), is required.
+		"""
+		if timestamp is None:
+			raise Exception('TcpPacket requires a timestamp')
 		self.origin = origin
 		self.dest = dest
 		self.message = message
@@ -19,11 +26,25 @@ class TcpPacket:
 		self.ack = ack_num is not None
 		self.syn = syn
 		self.fin = fin
-		self.timestamp = timestamp if timestamp is not None else sim.time()
+		self.timestamp = timestamp
+		self.mss = mss
+		self.segment_size = segment_size
+		self.window = window
 
 	def __len__(self):
-		"""Return the size of this TcpPacket, in bytes."""
-		return 8 + (len(self.message) if self.message else 0)
+		"""Return the size of this TcpPacket, in bytes. A super-segment includes the header of
+		each of its wire packets."""
+		if not self.message:
+			return 8
+		if self.segment_size:
+			return 8 * -(-len(self.message) // self.segment_size) + len(self.message)
+		return 8 + len(self.message)
+
+	def split(self):
+		"""Return the wire packets of a super-segment."""
+		size = self.segment_size
+		return [TcpPacket(self.origin, self.dest, self.message[i:i+size], seq_num=self.seq_num+i,
+			timestamp=self.timestamp) for i in xrange(0, len(self.message), size)]
 		
 	def __str__(self):
 		"""Return a string representation of this TcpPacket."""
@@ -42,16 +63,27 @@ class TcpPacket:
 				s = '{} {}-{}'.format(s, self.seq_num, self.seq_num+len(self.message)-1)
 			else:
 				s = '{} {}'.format(s, self.seq_num)
+		if self.window is not None:
+			s = '{} win {}'.format(s, self.window)
 		return s
 
 
-class Congestion:
+class Congestion(object):
 	def __init__(self, socket):
 		self.socket = socket
-		self.cwnd = TcpPacket.mss
+		self._cwnd = TcpPacket.mss
 		self.ssthresh = 0
 		self.dup_ack_count = 0
 		self.min_ack = 0
+
+	@property
+	def cwnd(self):
+		return self._cwnd
+	@cwnd.setter
+	def cwnd(self, value):
+		self._cwnd = value
+		if self.socket.metrics:
+			self.socket.metrics.cwnd_change(self.socket._now(), value)
 		
 	def ack(self, ack_num):
 		#new ack
@@ -76,14 +108,14 @@ class Reno(Congestion):
 		Congestion.__init__(self, socket)
 		self.state = Tahoe.SLOW_START
 	def new_ack(self, num_bytes):
-		num_bytes = TcpPacket.mss
+		num_bytes = self.socket.mss
 		if self.state == Reno.SLOW_START:
 			self.cwnd += num_bytes
 			self.socket._log('tcp-cwnd-adjust', '%d', self.cwnd)
 			if self.cwnd >= self.ssthresh:
 				self.state = Reno.CONGESTION_AVOIDANCE
 		elif self.state == Reno.CONGESTION_AVOIDANCE:
-			self.cwnd += int(num_bytes * TcpPacket.mss / self.cwnd)
+			self.cwnd += int(num_bytes * self.socket.mss / self.cwnd)
 			self.socket._log('tcp-cwnd-adjust', '%d', self.cwnd)
 		elif self.state == Reno.FAST_RECOVERY:
 			self.cwnd = self.ssthresh
@@ -91,7 +123,7 @@ class Reno(Congestion):
 			self.state = Reno.CONGESTION_AVOIDANCE
 	def dup_ack(self, ack_num):
 		if self.state == Reno.FAST_RECOVERY:
-			self.cwnd += TcpPacket.mss
+			self.cwnd += self.socket.mss
 			self.socket._log('tcp-cwnd-adjust', '%d', self.cwnd)
 		else:
 			self.dup_ack_count += 1
@@ -100,13 +132,13 @@ class Reno(Congestion):
 				self.socket._log('tcp-loss triple-ack', '%d', ack_num)
 				self.ssthresh = int(self.cwnd / 2)
 				self.socket._log('tcp-ssthresh-adjust', '%d', self.ssthresh)
-				self.cwnd = self.ssthresh + 3 * TcpPacket.mss
+				self.cwnd = self.ssthresh + 3 * self.socket.mss
 				self.socket._log('tcp-cwnd-adjust', '%d', self.cwnd)
 				self.state = Reno.FAST_RECOVERY
 	def after_timeout(self):
 		self.ssthresh = int(self.cwnd / 2)
 		self.socket._log('tcp-ssthresh-adjust', '%d', self.ssthresh)
-		self.cwnd = TcpPacket.mss
+		self.cwnd = self.socket.mss
 		self.socket._log('tcp-cwnd-adjust', '%d', self.cwnd)
 		self.state = Reno.SLOW_START
 			
@@ -124,35 +156,57 @@ class Tahoe(Congestion):
 			if self.cwnd >= self.ssthresh:
 				self.state = Tahoe.CONGESTION_AVOIDANCE
 		elif self.state == Tahoe.CONGESTION_AVOIDANCE:
-			self.cwnd += int(num_bytes * TcpPacket.mss / self.cwnd)
+			self.cwnd += int(num_bytes * self.socket.mss / self.cwnd)
 			self.socket._log('tcp-cwnd-adjust', '%d', self.cwnd)
 	def dup_ack(self, ack_num):
 		pass
 	def after_timeout(self):
 		self.ssthresh = int(self.cwnd / 2)
 		self.socket._log('tcp-ssthresh-adjust', '%d', self.ssthresh)
-		self.cwnd = TcpPacket.mss
+		self.cwnd = self.socket.mss
 		self.socket._log('tcp-cwnd-adjust', '%d', self.cwnd)
 		self.state = Tahoe.SLOW_START
 
 class TcpSocket(Socket):
 	"""Represents a TcpSocket."""		
 
+	max_offload = 65536 #largest super-segment, with offload
+	coalesce_timeout = .001 #longest time that received segments are held for coalescing
+	sndbuf = 262144 #default send buffer size, in bytes
+	rcvbuf = 262144 #default receive buffer size, which bounds the advertised window
+	persist_max = 60. #longest interval between zero window probes
+
 	def __init__(self, host):
 		"""Create a TcpSocket."""
 		Socket.__init__(self, host)
-		self.inc = []		  #incoming buffer
+		self.inc = []		  #incoming buffer, of unread bytes from inc_base
+		self.inc_base = 0	  #sequence number of inc[0]
 		self.inc_i = 0		  #length of in-order bytes
 		self.inc_read_i = 0	  #length of read bytes
-		self.out = []		  #outgoing buffer
+		self.out = []		  #outgoing buffer, of unacknowledged bytes from out_base
+		self.out_base = 0	  #sequence number of out[0]
 		self.out_i = 0		  #length of bytes sent
 		self.out_ack_i = 0	  #length of bytes acknowledged
+		self.rwnd = float('inf') #receive window of the other side; known after the handshake
 		self.state = 'CLOSED'  #TCP state
 		self._timeout = 3.
 		self._cwnd = TcpPacket.mss
 		self._ssthresh = 96000
 		self.last_loss = 0
 		self.ack_count = 0    #count of last acks
+		self.metrics = None   #optional TcpMetrics
+		self.mss = TcpPacket.mss #maximum segment size; set before connecting to advertise less
+		self.offload = False  #whether to send super-segments for the links to split
+		self.coalesce = False #whether to merge received in-order segments
+		self.nodelay = True   #whether to send small segments at once; if not, Nagle's algorithm
+		                      #holds them while earlier data is unacknowledged
+		self.corked = False   #whether small segments are held until uncork()
+		self.__coalesced = None #received segment being coalesced
+		self.__coalesce_count = 0 #number of coalescing timers started
+		self.__advertised = None #last window advertised
+		self.__persisting = False #whether a zero window probe timer is running
+		self.__probed = None  #time the last zero window probe was sent
+		self.__fin_ack = None #acknowledgment number of the other side's FIN, once received
 		self.congestion  = Tahoe(self) #TCP method for dealing with loss
 		self.syn_event	   = Event()
 		self.syn_ack_event = Event()
@@ -169,6 +223,11 @@ class TcpSocket(Socket):
 		self._timeout = value
 		self._log('tcp-timeout-adjust', '%d', self.timeout)
 
+	@property
+	def out_end(self):
+		"""The sequence number after the last byte passed to sendall()."""
+		return self.out_base + len(self.out)
+
 	# public methods
 
 	def bind(self, addr):
@@ -187,22 +246,42 @@ class TcpSocket(Socket):
 		if self.state != 'LISTEN':
 			raise Exception('Must call listen() first')
 		
-		packet = self.syn_event.wait()
-		socket = TcpSocket(self.host)
+		return self._accept(self.syn_event.wait())
+
+	def _accept(self, packet):
+		"""Create a socket for the connection requested by a SYN packet, and return it."""
+		socket = self.__class__(self.host)
 		socket.state = self.state
 		socket.local = self.local
 		socket.remote = packet.origin
 		socket.host.origin_to_tcp[packet.origin] = socket
+		if self.metrics:
+			socket.metrics = self.metrics.child(socket)
+		socket.offload = self.offload
+		socket.coalesce = self.coalesce
+		socket.nodelay = self.nodelay
+		socket.sndbuf = self.sndbuf
+		socket.rcvbuf = self.rcvbuf
+		socket._set_mss(min(self.mss, packet.mss or TcpPacket.mss))
+		if packet.window is not None:
+			socket.rwnd = packet.window
 		
 		socket.state = 'SYN_RCVD'
 		socket._log('tcp-state', 'LISTEN <- SYN : SYN_RCVD -> SYN+ACK')
-		socket.__sched_send(TcpPacket(socket.local, socket.remote, seq_num=0, ack_num=0, syn=True,
-			timestamp=packet.timestamp))
+		socket._sched_send(TcpPacket(socket.local, socket.remote, seq_num=0, ack_num=0, syn=True,
+			timestamp=packet.timestamp, mss=socket.mss, window=socket._window()))
 		
 		return socket
 		
 	def connect(self, addr):
 		"""Establish a connection to the specified address."""
+		self._connecting(addr)
+		def syn():
+			self._send_syn()
+			return self.syn_ack_event.wait(self.timeout)
+		self._connected(attempt(syn, 10))
+
+	def _connecting(self, addr):
 		assert self.state == 'CLOSED'
 		self.local = self.host.get_available_tcp()
 		self.host.port_to_tcp[self.local[1]] = self
@@ -210,92 +289,221 @@ class TcpSocket(Socket):
 		
 		self.state = 'SYN_SENT'
 		self._log('tcp-state', 'CLOSED : SYN -> SYN_SENT')
-		def syn():
-			self.__sched_send(TcpPacket(self.local, self.remote, seq_num=0, syn=True))
-			return self.syn_ack_event.wait(self.timeout)
-		packet = attempt(syn, 10)
+
+	def _send_syn(self):
+		self._sched_send(TcpPacket(self.local, self.remote, seq_num=0, syn=True, timestamp=self._now(),
+			mss=self.mss, window=self._window()))
+
+	def _connected(self, packet):
+		"""Called with the SYN+ACK packet which establishes a connection."""
 		self.state = 'ESTABLISHED'
 		self._log('tcp-state', 'SYN_SENT <- SYN_ACK : ESTABLISHED -> ACK')
-		self.__sched_send(TcpPacket(self.local, self.remote, ack_num=0, timestamp=packet.timestamp))
+		self._set_mss(min(self.mss, packet.mss or TcpPacket.mss))
+		if packet.window is not None:
+			self.rwnd = packet.window
+		self._send_ack(0, packet.timestamp)
+
+	def _set_mss(self, mss):
+		"""Set the negotiated maximum segment size."""
+		self.mss = mss
+		self.congestion.cwnd = mss
+		self._log('tcp-mss', '%d', mss)
 
 	def _send_data(self, start):
-		"""Send a single data packet beginning at start, if data is available.
-		Return the next sequence number after this packet, or None is no data was available.
+		"""Send a single data packet (or super-segment, with offload) beginning at start, if data
+		is available and within both the congestion window and the receive window.
+		Return the next sequence number after this packet, or None is no data was available (or
+		it is held by _holds()).
 		"""
-		end = min(self.out_ack_i+self.congestion.cwnd, start+TcpPacket.mss, len(self.out))
-		if start < end:
-			message = self.out[start:end]
-			self.__sched_send(TcpPacket(self.local, self.remote, message, seq_num=start))
+		window = min(self.congestion.cwnd, self.rwnd)
+		size = self.mss
+		if self.offload:
+			# at most half the window, so that its ACK returns while the rest is sent and clocks out
+			# more data, as per-MSS ACKs would
+			size = min(TcpSocket.max_offload, max(1, int(window // 2 // self.mss)) * self.mss)
+		end = min(self.out_ack_i+window, start+size, self.out_end)
+		if start < end and not self._holds(start, end):
+			message = self.out[start-self.out_base:end-self.out_base]
+			self._sched_send(TcpPacket(self.local, self.remote, message, seq_num=start,
+				timestamp=self._now(), segment_size=self.mss if end-start > self.mss else None))
 			return end
 
+	def _holds(self, start, end):
+		"""Return whether to hold back a segment from start to end, of the last buffered data, for
+		more data to fill it: while corked, or (with Nagle's algorithm) while earlier data is
+		unacknowledged."""
+		return end - start < self.mss and end == self.out_end and \
+			(self.corked or not self.nodelay and start > self.out_ack_i)
+
+	def _pump(self):
+		"""Send as much buffered data as the windows allow, timing each packet for loss. Called
+		when data is buffered, acknowledged or lost."""
+		self.out_i = max(self.out_i, self.out_ack_i)
+		while True:
+			end = self._send_data(self.out_i)
+			if end is None:
+				break
+			self._call_later(self.timeout, self._check_loss, self.out_i, end, self._now(),
+				self.timeout)
+			self.out_i = end
+		if not self.rwnd and self.out_i < self.out_end and not self.__persisting:
+			self.__persisting = True
+			self._call_later(self.timeout, self.__probe, self.timeout)
+
+	def __probe(self, interval):
+		"""Probe a zero receive window with one byte, every interval (backing off), until it
+		opens."""
+		if self.rwnd or self.out_i >= self.out_end:
+			self.__persisting = False
+			return
+		self._log('tcp-probe', '%d', self.out_i)
+		self.__probed = self._now()
+		i = self.out_i - self.out_base
+		self._sched_send(TcpPacket(self.local, self.remote, self.out[i:i+1], seq_num=self.out_i,
+			timestamp=self._now()))
+		interval = min(2 * interval, TcpSocket.persist_max)
+		self._call_later(interval, self.__probe, interval)
+
+	def _buffer_space(self):
+		"""Return the number of bytes which sendall() can add to the send buffer."""
+		return max(0, self.sndbuf - (self.out_end - self.out_ack_i))
+
 	def sendall(self, message):
-		"""Send the message. Return only when finished."""
+		"""Send the message. Return once it is all in the send buffer, which holds at most sndbuf
+		unacknowledged bytes."""
 		if not hasattr(self, 'remote'):
 			raise Exception('Must call connect() first')
-		self.out += message
-		while self.out_ack_i < len(self.out):
-			end = self._send_data(self.out_i)
-			if end is not None:
-				def loss(start=self.out_i, end=end, timeout=self.timeout):
-					time = sim.time()
-					sim.sleep(self.timeout)
-					if start <= self.out_ack_i < end and self.last_loss < time \
-							and self.congestion.min_ack < end:
-						self.congestion.min_ack = end
-						self.out_i = start
-						self.last_loss = time
-						self.timeout *= 2
-						self._log('tcp-loss', 'timeout %d-%d %.4f', start, end-1, timeout)
-						self.congestion.timeout()
-						self.ack_event.notify()
-				
-				sim.new_thread(loss)
-				self.out_i = end
+		i = 0
+		while i < len(message):
+			space = self._buffer_space()
+			if space:
+				self.out += message[i:i+space]
+				i += space
+				self._pump()
 			else:
 				self.ack_event.wait()
 	
+	def cork(self):
+		"""Hold back segments smaller than the MSS until uncork(), so that several writes are sent
+		together."""
+		self.corked = True
+
+	def uncork(self):
+		"""Send the data held back since cork()."""
+		if self.corked:
+			self.corked = False
+			self._pump()
+
+	def _check_loss(self, start, end, time, timeout):
+		"""Called one timeout after bytes start to end were sent at time, to detect a loss."""
+		if start <= self.out_ack_i < end and self.last_loss < time \
+				and self.congestion.min_ack <= end:
+			self.congestion.min_ack = end
+			self.out_i = self.out_ack_i
+			self.last_loss = time
+			self.timeout *= 2
+			self._log('tcp-loss', 'timeout %d-%d %.4f', start, end-1, timeout)
+			self.congestion.timeout()
+			self._pump()
+			self.ack_event.notify()
+
 	def recv(self):
 		"""Return incoming data. At least one byte will be returned, unless the other side has
 		closed."""
-		while self.state in ('SYN_RCVD', 'ESTABLISHED', 'TIME_WAIT_1', 'TIME_WAIT_2') \
-				and not self.inc_read_i < self.inc_i:
+		while self._recv_blocks():
 			self.data_event.wait()
-		message, self.inc_read_i = self.inc[self.inc_read_i:self.inc_i], self.inc_i 
+		return self._read()
+
+	def _recv_blocks(self):
+		"""Return whether recv() has to wait for data."""
+		return self.state in ('SYN_RCVD', 'ESTABLISHED', 'TIME_WAIT_1', 'TIME_WAIT_2') \
+				and not self.inc_read_i < self.inc_i
+
+	def _read(self):
+		"""Return the unread in-order bytes, releasing them from the buffer."""
+		end = self.inc_i - self.inc_base
+		message = self.inc[self.inc_read_i-self.inc_base:end]
+		del self.inc[:end]
+		self.inc_base = self.inc_read_i = self.inc_i
+		if self.__advertised is not None and self.__advertised < self.mss <= self._window():
+			self._send_ack(self.inc_i, self._now()) # window update
 		return message
+
+	def _window(self):
+		"""Return the receive window: the space in the receive buffer after the in-order bytes."""
+		return max(0, self.inc_read_i + self.rcvbuf - self.inc_i)
+
+	def _send_ack(self, ack_num, timestamp):
+		"""Send an ACK, advertising the receive window."""
+		self.__advertised = self._window()
+		self._sched_send(TcpPacket(self.local, self.remote, ack_num=ack_num, timestamp=timestamp,
+			window=self.__advertised))
 	
 	def close(self):
-		"""Close this end of a connection."""
+		"""Close this end of a connection. Return once all data and the FIN are acknowledged; the
+		rest of the teardown, including TIME_WAIT, is driven by packets and timers."""
 		def fin():
-			self.__sched_send(TcpPacket(self.local, self.remote, seq_num=len(self.out), fin=True))
+			self._send_fin()
 			self.ack_event.wait(self.timeout)
 		
+		self.uncork()
 		if self.state == 'ESTABLISHED' or self.state == 'SYN_RCVD':
 			self.state = 'FIN_WAIT_1'
 			self._log('tcp-state', 'ESTABLISHED : FIN -> FIN_WAIT_1')
-			while self.out_ack_i < len(self.out):
+			while self.out_ack_i < self.out_end:
 				self.ack_event.wait()
 			attempt(fin, 10)
-			if self.state == 'FIN_WAIT_1':
-				self.state = 'FIN_WAIT_2'
-				self._log('tcp-state', 'FIN_WAIT_1 <- ACK : FIN_WAIT_2')
-				self.fin_event.wait()
-				self.state = 'TIME_WAIT'
-				self._log('tcp-state', 'FIN_WAIT_2 <- FIN : ACK -> TIME_WAIT')
-			elif self.state == 'CLOSING':
-				self.state = 'TIME_WAIT'
-				self._log('tcp-state', 'CLOSING <- ACK : TIME_WAIT')
-			sim.sleep(3*self.timeout)
-			self._log('tcp-state', 'TIME_WAIT : CLOSED')
+			self._fin_acked()
 		
 		elif self.state == 'CLOSE_WAIT':
 			self.state = 'LAST_ACK'
 			self._log('tcp-state', 'CLOSE_WAIT : FIN -> LAST_ACK')
 			attempt(fin, 10)
+			self._fin_acked()
+
+	def _fin_acked(self):
+		"""Called when the FIN sent by close() has been acknowledged."""
+		if self.state == 'FIN_WAIT_1':
+			self.state = 'FIN_WAIT_2'
+			self._log('tcp-state', 'FIN_WAIT_1 <- ACK : FIN_WAIT_2')
+		elif self.state == 'CLOSING':
+			self.state = 'TIME_WAIT'
+			self._log('tcp-state', 'CLOSING <- ACK : TIME_WAIT')
+			self._time_wait()
+		elif self.state == 'LAST_ACK':
+			self.state = 'CLOSED'
 			self._log('tcp-state', 'LAST_ACK <- ACK : CLOSED')
+			self.host.release_tcp(self)
+
+	def _time_wait(self):
+		"""Keep the connection in the host's tables for TIME_WAIT, to acknowledge a retransmitted
+		FIN, then close it."""
+		self.host.time_wait[(self.local, self.remote)] = self
+		self._call_later(3*self.timeout, self.__time_wait_end)
+
+	def __time_wait_end(self):
+		del self.host.time_wait[(self.local, self.remote)]
+		self.state = 'CLOSED'
+		self._log('tcp-state', 'TIME_WAIT : CLOSED')
+		self.host.release_tcp(self)
+
+	def _send_fin(self):
+		"""Send a FIN, which also acknowledges the other side's FIN if it has been received (so
+		that the other side can finish closing even if that ACK was lost)."""
+		self._sched_send(TcpPacket(self.local, self.remote, seq_num=self.out_end, fin=True,
+			ack_num=self.__fin_ack, timestamp=self._now()))
 
 	# I/O
 
-	def __sched_send(self, packet):
+	def _now(self):
+		"""Return the current simulated time."""
+		return self.host.context.time()
+
+	def _call_later(self, delay, f, *args):
+		"""Call f(*args) after delay."""
+		self.host.context.call_later(delay, f, *args)
+
+	def _sched_send(self, packet):
 		"""Queue the packet on the appropriate link.
 		This function is identical to Socket.scheduler_send, except for its debugging.
 		"""
@@ -305,14 +513,18 @@ class TcpSocket(Socket):
 	def _buffer(self, packet):
 		"""Called by the Host to pass a packet to this Socket."""
 		self._log('tcp-recv', '<- %s', packet)   
+		if self.__coalesced and (packet.message is None or packet.syn or packet.fin):
+			self.__flush_coalesced()
 		if packet.ack and packet.syn:
 			self.__syn_ack(packet)
+		elif packet.fin:
+			self.__fin(packet)
 		elif packet.ack:
 			self.__ack(packet)
 		elif packet.syn:
 			self.__syn(packet)
-		elif packet.fin:
-			self.__fin(packet)	
+		elif self.coalesce:
+			self.__coalesce(packet)
 		else:
 			self.__data(packet)
 		
@@ -324,43 +536,107 @@ class TcpSocket(Socket):
 
 	def __ack(self, packet):
 		"""Handle an ACK packet."""
-		self.timeout = (self.timeout + 2.5 * (sim.time() - packet.timestamp)) / 2
-		#print sim.time(), packet.timestamp
+		# a window update is neither a duplicate ACK nor an RTT sample
+		update = packet.window is not None and packet.window != self.rwnd \
+			and packet.ack_num == self.out_ack_i
+		if packet.window is not None:
+			self.rwnd = packet.window
+		rtt = self._now() - packet.timestamp
+		if not update:
+			self.timeout = (self.timeout + 2.5 * rtt) / 2
+		out_ack_i = self.out_ack_i
 		if self.state == 'SYN_RCVD':
 			self.state = 'ESTABLISHED'
 			self._log('tcp-state', 'SYN_RCVD <- ACK : ESTABLISHED')
-		if packet.ack_num <= len(self.out):
+		# nor is an ACK repeated while the window is closed, or one of a probe (or of earlier data)
+		repeated = packet.ack_num == self.out_ack_i and (not self.rwnd or
+			self.__probed is not None and packet.timestamp <= self.__probed)
+		if packet.ack_num <= self.out_end and not update and not repeated:
 			self.congestion.ack(packet.ack_num)
+		del self.out[:self.out_ack_i-self.out_base] # release acknowledged bytes
+		self.out_base = self.out_ack_i
+		if self.metrics:
+			if not update:
+				self.metrics.rtt_sample(self._now(), rtt)
+			if self.out_ack_i > out_ack_i:
+				self.metrics.ack(self._now(), self.out_ack_i - out_ack_i)
+		self._pump()
 		self.ack_event.notify()
 
 	def __syn(self, packet):
 		if self.state == 'SYN_RCVD' or self.state == 'ESTABLISHED':
-			self.__sched_send(TcpPacket(packet.dest, self.remote, seq_num=0, ack_num=0, syn=True))
+			self._sched_send(TcpPacket(packet.dest, self.remote, seq_num=0, ack_num=0, syn=True,
+				timestamp=self._now(), mss=self.mss, window=self._window()))
 		self.syn_event.notify(packet)
 
+	def __coalesce(self, packet):
+		"""Merge in-order data packets into one, which is handled after at most coalesce_timeout
+		(or when something else arrives). Other packets are handled immediately."""
+		coalesced = self.__coalesced
+		if coalesced is not None and packet.seq_num == coalesced.seq_num + len(coalesced.message) \
+				and len(coalesced.message) + len(packet.message) <= TcpSocket.max_offload:
+			coalesced.message = coalesced.message + packet.message
+			coalesced.timestamp = packet.timestamp
+			return
+		self.__flush_coalesced()
+		if packet.seq_num != self.inc_i:
+			self.__data(packet) # out of order: acknowledge at once, for fast retransmit
+			return
+		self.__coalesced = TcpPacket(packet.origin, packet.dest, packet.message,
+			seq_num=packet.seq_num, timestamp=packet.timestamp)
+		self.__coalesce_count += 1
+		self._call_later(TcpSocket.coalesce_timeout, self.__flush_coalesced, self.__coalesce_count)
+
+	def __flush_coalesced(self, count=None):
+		"""Handle the coalesced packet. With a count, only if it is from that timer."""
+		if self.__coalesced is not None and (count is None or count == self.__coalesce_count):
+			packet, self.__coalesced = self.__coalesced, None
+			self.__data(packet)
+
 	def __data(self, packet):
-		"""Handle a data packet."""
-		self.inc += (None,) * (packet.seq_num - len(self.inc))
-		self.inc[packet.seq_num:packet.seq_num+len(packet.message)] = packet.message
+		"""Handle a data packet. Bytes already received in order, or beyond the receive window, are
+		dropped."""
+		seq_num, message = packet.seq_num, packet.message
+		if seq_num < self.inc_i:
+			message, seq_num = message[self.inc_i-seq_num:], self.inc_i
+		limit = self.inc_read_i + self.rcvbuf - seq_num
+		if len(message) > limit:
+			self._log('tcp-window-full', '%d-%d', seq_num + max(limit, 0), seq_num+len(message)-1)
+			message = message[:max(limit, 0)]
+		if message:
+			i = seq_num - self.inc_base
+			self.inc += (None,) * (i - len(self.inc))
+			self.inc[i:i+len(message)] = message
+		inc_i = self.inc_i
 		self.inc_i = next(
-			(i for i,b in enumerate(self.inc[self.inc_i:], start=self.inc_i) if b is None),
-			len(self.inc)
+			(i for i,b in enumerate(self.inc[self.inc_i-self.inc_base:], start=self.inc_i)
+				if b is None),
+			self.inc_base + len(self.inc)
 		)
-		print packet.timestamp, sim.time()
-		self.__sched_send(TcpPacket(self.local, self.remote, ack_num=self.inc_i
-			, timestamp=packet.timestamp))
+		if self.metrics and self.inc_i > inc_i:
+			self.metrics.data(self._now(), self.inc_i - inc_i)
+		self._send_ack(self.inc_i, packet.timestamp)
 		self.data_event.notify()
 
 	def __fin(self, packet):
-		"""Handle a FIN packet."""
+		"""Handle a FIN packet, which may also acknowledge this side's FIN."""
+		if packet.ack:
+			self.ack_event.notify()
+		self.__fin_ack = packet.seq_num+1
 		if self.state == 'SYN_RCVD':
 			self.state = 'CLOSE_WAIT'
 			self._log('tcp-state', 'SYN_RCVD <- FIN : ACK -> CLOSE_WAIT')
 		elif self.state == 'ESTABLISHED':
 			self.state = 'CLOSE_WAIT'
 			self._log('tcp-state', 'ESTABLISHED <- FIN : ACK -> CLOSE_WAIT') 
-		self.__sched_send(TcpPacket(self.local, self.remote, ack_num=packet.seq_num+1
-			, timestamp=packet.timestamp))
+		elif self.state == 'FIN_WAIT_1':
+			self.state = 'CLOSING'
+			self._log('tcp-state', 'FIN_WAIT_1 <- FIN : ACK -> CLOSING')
+		elif self.state == 'FIN_WAIT_2':
+			self.state = 'TIME_WAIT'
+			self._log('tcp-state', 'FIN_WAIT_2 <- FIN : ACK -> TIME_WAIT')
+			self._time_wait()
+		self._send_ack(packet.seq_num+1, packet.timestamp)
 		self.data_event.notify()
 		self.fin_event.notify()
 
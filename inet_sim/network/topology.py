@@ -0,0 +1,72 @@
+"""Topology builders, and per-link utilization reports for measuring load balance."""
+from __future__ import division
+
+from .aio import AsyncHost, AsyncLink
+from .host import Host
+from .link import Link
+from .routing import Node, static_routes
+
+class FatTree:
+	"""A k-ary fat-tree: k pods, each of k/2 edge and k/2 aggregation switches, (k/2)**2 core
+	switches, and k/2 hosts per edge switch. Every link has the same delay and bandwidth, so there
+	are (k/2)**2 equal-cost paths between hosts in different pods.
+
+	Switch addresses are 10.pod.switch.1 (edge switches are numbered 0 to k/2-1, aggregation
+	switches k/2 to k-1) and 10.k.i.j for core switches; hosts are 10.pod.edge.(2+h). In a context
+	with an EventLoop, the hosts (by default) and links are the coroutine classes of aio.
+	"""
+
+	def __init__(self, k=4, prop_delay=.001, bandwidth=1e6, host_cls=None, node_cls=Node,
+			context=None):
+		if k % 2:
+			raise Exception('k must be even')
+		if context is not None and context.loop is not None:
+			host_cls = host_cls or AsyncHost
+			duplex_link = lambda node1, node2: AsyncLink.duplex_link(node1, node2, prop_delay,
+				bandwidth, loop=context)
+		else:
+			host_cls = host_cls or Host
+			duplex_link = lambda node1, node2: Link.duplex_link(node1, node2, prop_delay, bandwidth)
+		if context is not None:
+			host_cls = lambda ip, cls=host_cls: cls(ip, context)
+			node_cls = lambda ip, cls=node_cls: cls(ip, context)
+		half = k // 2
+		self.k = k
+		self.core = [node_cls('10.%d.%d.%d' % (k, i + 1, j + 1)) for i in xrange(half)
+			for j in xrange(half)]
+		self.aggregation = []
+		self.edge = []
+		self.hosts = []
+		self.core_links = [] # between aggregation and core switches, both directions
+		for pod in xrange(k):
+			edge = [node_cls('10.%d.%d.1' % (pod, s)) for s in xrange(half)]
+			aggregation = [node_cls('10.%d.%d.1' % (pod, half + s)) for s in xrange(half)]
+			for e, switch in enumerate(edge):
+				for h in xrange(half):
+					host = host_cls('10.%d.%d.%d' % (pod, e, 2 + h))
+					duplex_link(host, switch)
+					self.hosts.append(host)
+				for agg in aggregation:
+					duplex_link(switch, agg)
+			for a, agg in enumerate(aggregation):
+				for core in self.core[a*half:(a + 1)*half]:
+					self.core_links.extend(duplex_link(agg, core))
+			self.edge.extend(edge)
+			self.aggregation.extend(aggregation)
+		self.nodes = self.core + self.aggregation + self.edge + self.hosts
+		self.routes = static_routes(self.nodes)
+
+	def links(self):
+		"""Return all links, except loopbacks."""
+		return [link for node in self.nodes for link in node.links() if link.dest is not node]
+
+def utilization(links, duration):
+	"""Return a dict of link to the fraction of its bandwidth used over duration."""
+	return dict((link, link.bytes / (link.bandwidth * duration)) for link in links)
+
+def imbalance(links):
+	"""Return the ratio of the most bytes carried by any of links to the mean; 1 is perfect balance.
+	"""
+	carried = [link.bytes for link in links]
+	mean = sum(carried) / len(carried)
+	return max(carried) / mean if mean else None
@@ -1,86 +1,133 @@
-"""This has fallen into disuse and its functionality needs to be verfied."""
 from collections import deque
 
-from .link import IpPacket
 from .socket import Socket
+from sim import Event, TimeoutException
 
-class UdpPacket(IpPacket):
+class UdpPacket:
+	"""Represents a UDP datagram."""
 
 	def __init__(self, origin, dest, message):
-		Packet.__init__(self, message)
 		self.origin = origin
 		self.dest = dest
-		self.local = self.host.getAvailableUDP()
+		self.message = message
 
-	@property
-	def size(self):
-		return Packet.size(self) + 4
+	def __len__(self):
+		"""Return the size of this UdpPacket, in bytes."""
+		return 8 + len(self.message)
+
+	def __str__(self):
+		return 'datagram {}'.format(len(self.message))
 
 class UdpSocket(Socket):
+	"""Represents a UdpSocket. Received datagrams wait in a queue of at most rcvbuf bytes; any which
+	do not fit are dropped.
+	"""
+
+	rcvbuf = 262144 #default receive queue size, in bytes
 
 	def __init__(self, host):
+		"""Create a UdpSocket."""
 		Socket.__init__(self, host)
-		self.packets = deque()
+		self.queue = deque()  #received (message, origin)
+		self.queued = 0		  #bytes in queue
+		self.drops = 0		  #datagrams dropped because the queue was full
+		self.rcvbuf = UdpSocket.rcvbuf
+		self.data_event = Event()
+		self._wake_at = None  #queue length at which to wake a blocked receiver
 
 	def bind(self, addr):
+		"""Bind the socket to the specified address."""
+		if addr[0] not in self.host.addresses:
+			raise Exception('%s is an invalid ip for this socket\'s host' % (addr[0],))
+		if addr[1] in self.host.port_to_udp:
+			raise Exception('Port %d is already bound on this host' % (addr[1],))
 		self.local = addr
+		self.host.port_to_udp[addr[1]] = self
 
 	def connect(self, addr):
+		"""Set the default destination, and receive only from it."""
+		if not hasattr(self, 'local'):
+			self.bind(self.host.get_available_udp())
 		self.remote = addr
 
+	def close(self):
+		if self.host.port_to_udp.get(self.local[1]) is self:
+			del self.host.port_to_udp[self.local[1]]
+
+	# sending
+
 	def sendto(self, message, addr):
-		p = UDPPacket(self.local, addr, message)
-		self._log('socket-send %s:%s %s:%s' % (p.origin[0], p.origin[1], p.dest[0], p.dest[1]))
-		self.host.getLinks(addr[1]).next().enqueue(p)
+		"""Send a datagram to addr."""
+		if not hasattr(self, 'local'):
+			self.bind(self.host.get_available_udp())
+		packet = UdpPacket(self.local, addr, message)
+		self._log('udp-send', '-> %s:%d %s', addr[0], addr[1], packet)
+		self.sched_send(packet)
 
 	def send(self, message):
+		"""Send a datagram to the connected address."""
 		if not hasattr(self, 'remote'):
-			raise Exception("Must call connect() first")
+			raise Exception('Must call connect() first')
 		self.sendto(message, self.remote)
 
+	def sendmmsg(self, datagrams):
+		"""Send many datagrams in one call, back to back. Each is a message for the connected
+		address, or a (message, addr) pair. Return the number sent. This saves no simulation work
+		over calling sendto for each, and sends them as a burst."""
+		for datagram in datagrams:
+			if isinstance(datagram, tuple):
+				self.sendto(*datagram)
+			else:
+				self.send(datagram)
+		return len(datagrams)
+
+	# receiving
+
 	def recvfrom(self):
-		self.__check_buffer()
+		"""Return the next (message, origin), waiting for one if necessary."""
+		while not self.queue:
+			self._wait(1, None)
+		return self._pop()
 
 	def recv(self):
-		self.__check_buffer()
+		"""Return the next message, waiting for one if necessary."""
+		return self.recvfrom()[0]
 
-	def close(self):
-		del self.local
+	def recvmmsg(self, n, wait_for=1, timeout=None):
+		"""Return a list of up to n queued (message, origin) pairs. Wait until wait_for are queued,
+		or until timeout has passed (in which case fewer, even none, may be returned). The receiver
+		is woken once for the whole batch, not for every datagram."""
+		try:
+			while len(self.queue) < min(wait_for, n):
+				self._wait(min(wait_for, n), timeout)
+		except TimeoutException:
+			pass
+		return [self._pop() for _ in xrange(min(n, len(self.queue)))]
+
+	def _wait(self, count, timeout):
+		"""Block until count datagrams are queued."""
+		self._wake_at = count
+		try:
+			self.data_event.wait(timeout)
+		finally:
+			self._wake_at = None
+
+	def _pop(self):
+		message, origin = self.queue.popleft()
+		self.queued -= len(message)
+		return message, origin
 
 	def _buffer(self, packet):
+		"""Called by the Host to pass a packet to this Socket."""
 		if hasattr(self, 'remote') and packet.origin != self.remote:
 			return
-		self.packets.appendleft(packet)
-		self.__check_buffer()
-
-	def __try_handle(self):
-		if self.packets: #if no packets buffered
-			p = self.packets.pop()
-			self._log('socket-recv %s:%s %s:%s', p.origin[0], p.origin[1], p.dest[0], p.dest[1])
-			if hasattr(self, 'recvfrom_handler'):
-				scheduler.add(self.recvfrom_handler, [p.message, p.origin], 0)
-				del self.recvfrom_handler
-			elif hasattr(self, 'recv_handler'):
-				scheduler.add(self.recv_handler, [p.message], 0)
-				del self.recv_handler
-				
-	@property
-	def local(self):
-		return self.__local
-	@local.setter
-	def local(self, value):
-		if self.host.ip != value[0]:
-			raise Exception('%s is an invalid ip for this socket''s host' % (ip,))
-		if self.host.port_to_socket.has_key(value[1]):
-			raise Exception('Port %d is already bound on this host' % (value[1],))
-		#remove
-		if hasattr(self, 'local'):
-			del self.local
-		#add
-		if value:
-			self.host.port_to_socket[value[1]] = self
-			self.__local = value
-	@local.deleter
-	def local(self):
-		del self.host.port_to_handler[self._local[1]]
-		del self.__local
+		if self.queued + len(packet.message) > self.rcvbuf:
+			self.drops += 1
+			self._log('udp-drop', '<- %s:%d %s', packet.origin[0], packet.origin[1], packet)
+			return
+		self._log('udp-recv', '<- %s:%d %s', packet.origin[0], packet.origin[1], packet)
+		self.queue.append((packet.message, packet.origin))
+		self.queued += len(packet.message)
+		if self._wake_at is not None and len(self.queue) >= self._wake_at:
+			self._wake_at = None
+			self.data_event.notify()
@@ -0,0 +1,21 @@
+"""Lazy import of matplotlib, so that importing the plotters is cheap.
+
+pyplot() imports matplotlib.pyplot on first use, selecting the non-interactive Agg backend (or
+$MPLBACKEND) unless pyplot was already imported with another one. Figures are only ever saved to
+files, so no GUI toolkit is loaded.
+"""
+import os
+import sys
+
+_pyplot = None
+
+def pyplot():
+	"""Return the matplotlib.pyplot module."""
+	global _pyplot
+	if _pyplot is None:
+		import matplotlib
+		if 'matplotlib.pyplot' not in sys.modules:
+			matplotlib.use(os.environ.get('MPLBACKEND') or 'Agg')
+		import matplotlib.pyplot
+		_pyplot = matplotlib.pyplot
+	return _pyplot
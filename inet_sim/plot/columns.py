@@ -0,0 +1,192 @@
+"""Columnar parsing of event logs into NumPy arrays.
+
+Every event becomes one row of the columns:
+
+* time     : simulated time
+* name     : code of the event name in Columns.names
+* endpoint : code of the first argument in Columns.endpoints, or -1
+* tag      : code of the first word after the endpoint (e.g. 'data', 'ack') in Columns.tags, or -1
+* a, b     : the first number after the endpoint, or both ends of a range such as 0-1499;
+             NaN if there is none
+
+Parsed columns are cached next to the log as <log>.npz, keyed on its size and mtime.
+"""
+from __future__ import division
+from array import array
+import os
+
+import numpy
+
+from .trace import TraceReader, is_trace
+
+_ARROWS = frozenset(('->', '<-'))
+_NAN = float('nan')
+
+class Columns:
+	"""Parsed events, as parallel arrays."""
+
+	fields = ('time', 'name', 'endpoint', 'tag', 'a', 'b')
+
+	def __init__(self, names, endpoints, tags, **arrays):
+		self.names = names
+		self.endpoints = endpoints
+		self.tags = tags
+		for field in Columns.fields:
+			setattr(self, field, arrays[field])
+
+	def __len__(self):
+		return len(self.time)
+
+	def code(self, table, value):
+		"""Return the code of value in the named string table, or -1 if it never occurs."""
+		try:
+			return getattr(self, table).index(value)
+		except ValueError:
+			return -1
+
+	def mask(self, names=None, endpoints=None, tags=None):
+		"""Return a boolean mask of the rows matching the given names, endpoints and tags."""
+		mask = numpy.ones(len(self), dtype=bool)
+		for table, field, values in (('names', 'name', names), ('endpoints', 'endpoint', endpoints),
+				('tags', 'tag', tags)):
+			if values is not None:
+				codes = [self.code(table, v) for v in values]
+				mask &= numpy.in1d(getattr(self, field), [c for c in codes if c >= 0])
+		return mask
+
+	def select(self, names=None, endpoints=None, tags=None):
+		"""Return the Columns of the rows matching the given names, endpoints and tags."""
+		mask = self.mask(names, endpoints, tags)
+		return Columns(self.names, self.endpoints, self.tags,
+			**dict((f, getattr(self, f)[mask]) for f in Columns.fields))
+
+def _numbers(token):
+	"""Return the pair of numbers in a token such as 1500 or 0-1499."""
+	start, _, end = token.partition('-')
+	try:
+		start = float(start)
+		return start, float(end) if end else start
+	except ValueError:
+		return _NAN, _NAN
+
+class ColumnParser:
+	"""Parses a log (plain text or indexed trace) into Columns."""
+
+	def __init__(self, file_path, cache=True, chunk_size=1 << 22):
+		"""Initialize with a file name. chunk_size is the approximate number of bytes read at once."""
+		self.file_path = file_path
+		self.cache = cache
+		self.chunk_size = chunk_size
+
+	@property
+	def cache_path(self):
+		return self.file_path + '.npz'
+
+	def columns(self, names=None, endpoints=None):
+		"""Return the Columns of events with a name in names and endpoint in endpoints.
+		None matches everything. Without a cache, the filters are applied while parsing.
+		"""
+		if not self.cache:
+			return self.__parse(names, endpoints)
+		stamp = self.__stamp()
+		columns = self.__load(stamp)
+		if columns is None:
+			columns = self.__parse(None, None)
+			self.__save(columns, stamp)
+		if names is None and endpoints is None:
+			return columns
+		return columns.select(names, endpoints)
+
+	# parsing
+
+	def __chunks(self, names, endpoints):
+		"""Yield lists of lines."""
+		if is_trace(self.file_path):
+			chunk = []
+			for line in TraceReader(self.file_path).lines(names=names, endpoints=endpoints):
+				chunk.append(line)
+				if len(chunk) >= 65536:
+					yield chunk
+					chunk = []
+			yield chunk
+		else:
+			with open(self.file_path) as file:
+				while True:
+					chunk = file.readlines(self.chunk_size)
+					if not chunk:
+						break
+					yield chunk
+
+	def __parse(self, names, endpoints):
+		names = frozenset(names) if names is not None else None
+		endpoints = frozenset(endpoints) if endpoints is not None else None
+		tables = ({}, {}, {}) # string to code, for names, endpoints and tags
+		name_codes, endpoint_codes, tag_codes = tables
+		time, name, endpoint, tag, a, b = \
+			array('d'), array('i'), array('i'), array('i'), array('d'), array('d')
+		for chunk in self.__chunks(names, endpoints):
+			for line in chunk:
+				if line.startswith('#'):
+					continue
+				fields = line.split()
+				if len(fields) < 2 or names is not None and fields[1] not in names:
+					continue
+				if endpoints is not None and (len(fields) < 3 or fields[2] not in endpoints):
+					continue
+				time.append(float(fields[0]))
+				name.append(name_codes.setdefault(fields[1], len(name_codes)))
+				if len(fields) > 2:
+					endpoint.append(endpoint_codes.setdefault(fields[2], len(endpoint_codes)))
+				else:
+					endpoint.append(-1)
+				t, x, y = -1, _NAN, _NAN
+				for token in fields[3:]:
+					if token[0].isdigit():
+						x, y = _numbers(token)
+						break
+					elif t == -1 and token not in _ARROWS:
+						t = tag_codes.setdefault(token, len(tag_codes))
+				tag.append(t)
+				a.append(x)
+				b.append(y)
+		strings = [sorted(table, key=table.get) for table in tables]
+		return Columns(*strings, time=numpy.frombuffer(time, dtype=numpy.float64),
+			name=numpy.frombuffer(name, dtype=numpy.intc),
+			endpoint=numpy.frombuffer(endpoint, dtype=numpy.intc),
+			tag=numpy.frombuffer(tag, dtype=numpy.intc),
+			a=numpy.frombuffer(a, dtype=numpy.float64), b=numpy.frombuffer(b, dtype=numpy.float64))
+
+	# cache
+
+	def __stamp(self):
+		stat = os.stat(self.file_path)
+		return numpy.array([stat.st_size, stat.st_mtime], dtype=numpy.float64)
+
+	def __load(self, stamp):
+		try:
+			data = numpy.load(self.cache_path)
+		except (IOError, ValueError):
+			return None
+		try:
+			if not numpy.array_equal(data['stamp'], stamp):
+				return None
+			strings = [[str(s) for s in data[t]] for t in ('names', 'endpoints', 'tags')]
+			return Columns(*strings, **dict((f, data[f]) for f in Columns.fields))
+		except KeyError:
+			return None
+		finally:
+			data.close()
+
+	def __save(self, columns, stamp):
+		tmp_path = '%s.%d.tmp' % (self.cache_path, os.getpid()) # parsers may run in parallel
+		arrays = dict((f, getattr(columns, f)) for f in Columns.fields)
+		for table in ('names', 'endpoints', 'tags'):
+			arrays[table] = numpy.array(getattr(columns, table), dtype=str)
+		try:
+			with open(tmp_path, 'wb') as file:
+				numpy.savez(file, stamp=stamp, **arrays)
+			if os.path.exists(self.cache_path):
+				os.remove(self.cache_path) # rename does not replace on Windows
+			os.rename(tmp_path, self.cache_path)
+		except (IOError, OSError):
+			pass # the cache is an optimization only
@@ -0,0 +1,48 @@
+"""Pixel-aware downsampling, so that rendering time does not grow with trace length.
+
+Line plots keep the first, minimum, maximum and last point of every pixel column (so spikes
+survive), and scatter plots keep one point per occupied pixel. Either way the rendered figure
+looks the same as with every point.
+"""
+from __future__ import division
+
+import numpy
+
+def figure_pixels(figure):
+	"""Return the (width, height) of a matplotlib figure, in pixels."""
+	width, height = figure.get_size_inches() * figure.dpi
+	return int(width), int(height)
+
+def _bins(values, n, lim=None):
+	"""Return the bin (0 to n-1) of each value when lim, or the range of values, is cut into n."""
+	low, high = lim if lim is not None else (values.min(), values.max())
+	if high <= low:
+		return numpy.zeros(len(values), dtype=int)
+	return numpy.clip(((values - low) * (n / (high - low))).astype(int), 0, n - 1)
+
+def minmax(x, y, buckets):
+	"""Decimate a line with x in ascending order to at most 4 points per bucket.
+	Return the decimated (x, y) arrays.
+	"""
+	x, y = numpy.asarray(x, dtype=float), numpy.asarray(y, dtype=float)
+	if len(x) <= 4 * buckets:
+		return x, y
+	bins = _bins(x, buckets)
+	starts = numpy.concatenate(([0], numpy.flatnonzero(numpy.diff(bins)) + 1))
+	ends = numpy.concatenate((starts[1:], [len(x)])) - 1
+	order = numpy.lexsort((y, bins)) # by bin, then by y
+	keep = numpy.unique(numpy.concatenate((starts, order[starts], order[ends], ends)))
+	return x[keep], y[keep]
+
+def pixel_points(x, y, size, xlim=None, ylim=None):
+	"""Decimate scatter points to one per pixel of an area size=(width, height) pixels.
+	Return the decimated (x, y) arrays.
+	"""
+	x, y = numpy.asarray(x, dtype=float), numpy.asarray(y, dtype=float)
+	width, height = size
+	if len(x) <= width:
+		return x, y
+	cells = _bins(x, width, xlim) * height + _bins(y, height, ylim)
+	_, keep = numpy.unique(cells, return_index=True)
+	keep.sort()
+	return x[keep], y[keep]
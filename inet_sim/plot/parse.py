@@ -1,20 +1,40 @@
 from collections import namedtuple
 
+from .trace import TraceReader, is_trace
+
 Event = namedtuple('Event', 'time name args')
 
 class EventParser:
 	def __init__(self, file_path):
 			""" Initialize plotter with a file name. """
 			self.file_path = file_path
-	
-	def parse(self):
-		""" Parse the data file """
-		file = open(self.file_path)
+
+	def parse(self, start=None, end=None, names=None, endpoints=None):
+		""" Parse the data file.
+		Only events between start and end (inclusive), with a name in names and an endpoint
+		(the first argument) in endpoints are returned. None matches everything.
+		Indexed traces only read the blocks that may contain such events.
+		"""
+		if is_trace(self.file_path):
+			lines = TraceReader(self.file_path).lines(start, end, names, endpoints)
+		else:
+			lines = open(self.file_path)
+		names = frozenset(names) if names is not None else None
+		endpoints = frozenset(endpoints) if endpoints is not None else None
 		try:
-			for line in file:
+			for line in lines:
 				if line.startswith("#"):
 					continue
 				fields = line.split()
-				yield Event(time=float(fields[0]), name=fields[1], args=tuple(fields[2:]))
+				time = float(fields[0])
+				if start is not None and time < start:
+					continue
+				if end is not None and time > end:
+					break # events are logged in time order
+				if names is not None and fields[1] not in names:
+					continue
+				if endpoints is not None and (len(fields) < 3 or fields[2] not in endpoints):
+					continue
+				yield Event(time=time, name=fields[1], args=tuple(fields[2:]))
 		finally:
-			file.close()
\ No newline at end of file
+			lines.close()
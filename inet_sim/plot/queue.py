@@ -1,27 +1,40 @@
 import argparse
 import string
 
-import matplotlib
-from pylab import *
+import numpy
 
-from .parse import EventParser
+from .backend import pyplot
+from .columns import ColumnParser
+from .decimate import figure_pixels, minmax, pixel_points
 
 class QueuePlotter:
 	"""Parses a file of queue events and plots a graph over time."""
 
-	def load(self, parser):
-		"""Load data from the parser."""
+	def load(self, parser, link='3'):
+		"""Load data about the queue of a link (its id) from the parser (an EventParser or
+		ColumnParser)."""
+		if hasattr(parser, 'columns'):
+			columns = parser.columns(names=('queue-start', 'queue-end', 'queue-overflow'),
+				endpoints=(link,))
+			delta = columns.mask(names=('queue-start',)).astype(int) \
+				- columns.mask(names=('queue-end',)).astype(int)
+			size = numpy.cumsum(delta)
+			change = delta != 0
+			drop = columns.mask(names=('queue-overflow',))
+			self.sizes = zip(columns.time[change].tolist(), size[change].tolist())
+			self.drops = zip(columns.time[drop].tolist(), (size[drop] + 1).tolist())
+			return
 		sizes = []
 		drops = []
 		size = 0
 		for event in parser.parse():
-			if event.name == 'queue-start' and event.args[0] == '3':
+			if event.name == 'queue-start' and event.args[0] == link:
 				size += 1
 				sizes.append((event.time, size))
-			elif event.name == 'queue-end' and event.args[0] == '3':
+			elif event.name == 'queue-end' and event.args[0] == link:
 				size -= 1
 				sizes.append((event.time, size))
-			elif event.name == 'queue-overflow' and event.args[0] == '3':
+			elif event.name == 'queue-overflow' and event.args[0] == link:
 				drops.append((event.time, size+1))
 		self.sizes = sizes
 		self.drops = drops
@@ -30,7 +43,8 @@ class QueuePlotter:
 		"""Create and save the graph."""
 		if not hasattr(self, 'sizes') or not hasattr(self, 'drops'):
 			raise Exception('nothing loaded, please load() first')
-		clf()
+		plt = pyplot()
+		figure = plt.figure()
 		x, y = [], []
 		for time, size in self.sizes:
 			x.append(time)
@@ -39,13 +53,18 @@ class QueuePlotter:
 		for time, size in self.drops:
 			drop_x.append(time)
 			drop_y.append(size)
-		plot(x,y)
-		scatter(drop_x, drop_y, marker='x', color='black')
-		xlabel('Time (seconds)')
-		ylabel('Queue Size (packets)')
-		xlim([min(x), max(x)])
-		ylim([0, max(y)+2])
-		savefig(file_path)
+		ylimit = [0, max(y)+2]
+		size = figure_pixels(figure)
+		x, y = minmax(x, y, size[0])
+		drop_x, drop_y = pixel_points(drop_x, drop_y, size, [min(x), max(x)], ylimit)
+		plt.plot(x,y)
+		plt.scatter(drop_x, drop_y, marker='x', color='black', rasterized=True)
+		plt.xlabel('Time (seconds)')
+		plt.ylabel('Queue Size (packets)')
+		plt.xlim([min(x), max(x)])
+		plt.ylim(ylimit)
+		plt.savefig(file_path)
+		plt.close(figure)
 
 def _parse_args():
 		parser = argparse.ArgumentParser(description='Plot queue size over time')
@@ -56,5 +75,5 @@ def _parse_args():
 if __name__ == '__main__':
 	args = _parse_args()
 	p = QueuePlotter()
-	p.load(EventParser(args.input_file))
+	p.load(ColumnParser(args.input_file))
 	p.plot(args.output_file, 15)
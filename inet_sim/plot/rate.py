@@ -3,9 +3,7 @@ import argparse
 from collections import deque
 import string
 
-import matplotlib
-from pylab import *
-
+from .backend import pyplot
 from .parse import EventParser
 
 # Class that parses a file of rates and plots a smoothed graph
@@ -41,20 +39,22 @@ class RatePlotter:
 
 	def plot(self, input_file, file_path, *ip_ports):
 		"""Create and save the graph."""
-		clf()
+		plt = pyplot()
+		figure = plt.figure()
 		colors = ['g','b','r','y','m']
-		parser = EventParser(args.input_file)
+		parser = EventParser(input_file)
 		mx, mn = 0, 10e9
 		for i, ip_port in enumerate(ip_ports): 
 			x, y = self.load(parser, ip_port)
 			#mx = max(mx, max(x))
-			plot(x, y, c=colors[i])
-		xlabel('Time (seconds)')
-		ylabel('Rate (Kbps)')
-		xlim([0, max(x)])
+			plt.plot(x, y, c=colors[i])
+		plt.xlabel('Time (seconds)')
+		plt.ylabel('Rate (Kbps)')
+		plt.xlim([0, max(x)])
 		#ylim([0, max(y)])
 		print max(y)
-		savefig(file_path)
+		plt.savefig(file_path)
+		plt.close(figure)
 
 def _parse_args():
 		parser = argparse.ArgumentParser(description='Plot queue size over time')
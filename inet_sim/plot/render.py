@@ -0,0 +1,115 @@
+"""Batch rendering of figures in parallel worker processes.
+
+Each figure is a kind (sequence, window, queue or rate), an input log and the endpoints to plot,
+and is saved as <output dir>/<input name>-<kind>[-<endpoints>].png. Inputs are first parsed (and
+their column caches written) in parallel, then the figures are drawn in parallel; every worker
+imports matplotlib once, with a non-interactive backend.
+
+	python -m inet_sim.plot.render -i run1.txt -i run2.txt -o figures \\
+		sequence:101.0.0.0:81 window:101.0.0.0:81 queue:3 rate:123.0.0.0:32768,123.0.0.0:32769
+
+renders four figures of each run. A kind without endpoints uses those of all.bat.
+"""
+import argparse
+import multiprocessing
+import os
+
+DEFAULT_ENDPOINTS = {
+	'sequence': ['101.0.0.0:81'],
+	'window': ['101.0.0.0:81'],
+	'queue': ['3'], # link id
+	'rate': ['123.0.0.0:32768', '123.0.0.0:32769', '123.0.0.0:32770'],
+}
+
+class Figure:
+	"""A figure to render: kind of plot, the input log, endpoints and the output file."""
+
+	def __init__(self, kind, input_file, output_file, endpoints=None):
+		if kind not in DEFAULT_ENDPOINTS:
+			raise Exception('Unknown kind of figure %s' % (kind,))
+		self.kind = kind
+		self.input_file = input_file
+		self.output_file = output_file
+		self.endpoints = endpoints or DEFAULT_ENDPOINTS[kind]
+
+	def render(self):
+		"""Draw and save this figure."""
+		from .columns import ColumnParser
+		if self.kind == 'sequence':
+			from .sequence import SequencePlotter
+			plotter = SequencePlotter()
+			plotter.parse(ColumnParser(self.input_file), self.endpoints[0])
+			plotter.plot(self.output_file)
+		elif self.kind == 'window':
+			from .window import WindowPlotter
+			plotter = WindowPlotter()
+			plotter.load(ColumnParser(self.input_file), self.endpoints[0])
+			plotter.plot(self.output_file)
+		elif self.kind == 'queue':
+			from .queue import QueuePlotter
+			plotter = QueuePlotter()
+			plotter.load(ColumnParser(self.input_file), self.endpoints[0])
+			plotter.plot(self.output_file, 15)
+		elif self.kind == 'rate':
+			from .rate import RatePlotter
+			RatePlotter().plot(self.input_file, self.output_file, *self.endpoints)
+		return self.output_file
+
+def figures(inputs, specs, output_dir='.'):
+	"""Return the Figures of every spec (a kind, optionally followed by :endpoint,endpoint...) for
+	every input file."""
+	result = []
+	for input_file in inputs:
+		name = os.path.splitext(os.path.basename(input_file))[0]
+		for spec in specs:
+			kind, _, endpoints = spec.partition(':')
+			endpoints = endpoints.split(',') if endpoints else None
+			suffix = '-' + '_'.join(endpoints).replace(':', '.') if endpoints else ''
+			output_file = os.path.join(output_dir, '%s-%s%s.png' % (name, kind, suffix))
+			result.append(Figure(kind, input_file, output_file, endpoints))
+	return result
+
+def _init_worker():
+	from .backend import pyplot
+	pyplot()
+
+def _parse(input_file):
+	from .columns import ColumnParser
+	ColumnParser(input_file).columns()
+
+def _render(figure):
+	try:
+		return figure.render(), None
+	except Exception as e:
+		return figure.output_file, '%s: %s' % (e.__class__.__name__, e)
+
+def render(figures, processes=None):
+	"""Render figures in processes worker processes (by default, one per CPU). Return a list of
+	(output file, error message or None), in order."""
+	pool = multiprocessing.Pool(processes, _init_worker)
+	try:
+		inputs = sorted(set(f.input_file for f in figures if f.kind != 'rate'))
+		pool.map(_parse, inputs)
+		return pool.map(_render, figures, chunksize=1)
+	finally:
+		pool.close()
+		pool.join()
+
+def _parse_args():
+		parser = argparse.ArgumentParser(description='Render figures of many logs in parallel')
+		parser.add_argument('specs', nargs='+', metavar='kind[:endpoint,...]',
+			help='figure to render for each input: sequence, window, queue or rate')
+		parser.add_argument('-i', '--input', dest='inputs', action='append', required=True,
+			help='input file')
+		parser.add_argument('-o', '--output', dest='output_dir', default='.',
+			help='output directory')
+		parser.add_argument('-j', '--processes', type=int, help='worker processes (default: CPUs)')
+		return parser.parse_args()
+
+if __name__ == '__main__':
+	args = _parse_args()
+	if not os.path.isdir(args.output_dir):
+		os.makedirs(args.output_dir)
+	for output_file, error in render(figures(args.inputs, args.specs, args.output_dir),
+			args.processes):
+		print output_file if error is None else '%s: %s' % (output_file, error)
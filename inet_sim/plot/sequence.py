@@ -1,15 +1,21 @@
 import argparse
 
-import matplotlib
-from pylab import *
-
-from inet_sim.plot.parse import EventParser
+from inet_sim.plot.backend import pyplot
+from inet_sim.plot.columns import ColumnParser
+from inet_sim.plot.decimate import figure_pixels, pixel_points
 
 class SequencePlotter:
 	"""Plots a graph of sequence numbers."""
 
 	def parse(self, parser, ip_port):
-		"""Load data from the parser."""
+		"""Load data from the parser (an EventParser or ColumnParser)."""
+		if hasattr(parser, 'columns'):
+			columns = parser.columns(names=('tcp-send', 'tcp-recv'), endpoints=(ip_port,))
+			send = columns.mask(names=('tcp-send',), tags=('data',))
+			ack = columns.mask(names=('tcp-recv',), tags=('ack',))
+			self.sends = zip(columns.time[send].tolist(), (columns.b[send] + 1).astype(int).tolist())
+			self.acks = zip(columns.time[ack].tolist(), columns.a[ack].astype(int).tolist())
+			return
 		sends = []
 		acks = []
 		for event in parser.parse():
@@ -25,8 +31,8 @@ class SequencePlotter:
 		""" Create and save the graph."""
 		if not hasattr(self, 'sends') or not hasattr(self, 'acks'):
 			raise Exception('nothing loaded, please load() first')
-		clf()
-		figure(figsize=(15,5))
+		plt = pyplot()
+		figure = plt.figure(figsize=(15,5))
 		x, y = [], []
 		ackX, ackY = [], []
 		for time, seq in self.sends:
@@ -35,13 +41,18 @@ class SequencePlotter:
 		for time, seq in self.acks:
 			ackX.append(time)
 			ackY.append(seq % 200000)
-		scatter(x, y, marker='o', s=7, linewidths=(0.,))
-		scatter(ackX, ackY, marker='+', c='g', s=9)
-		xlabel('Time (seconds)')
-		ylabel('Sequence Number Mod 200000')
-		xlim([0, max(x)])
-		ylim([0, 200000])
-		savefig(file_path)
+		size = figure_pixels(figure)
+		xlimit = [0, max(x)]
+		x, y = pixel_points(x, y, size, xlimit, [0, 200000])
+		ackX, ackY = pixel_points(ackX, ackY, size, xlimit, [0, 200000])
+		plt.scatter(x, y, marker='o', s=7, linewidths=(0.,), rasterized=True)
+		plt.scatter(ackX, ackY, marker='+', c='g', s=9, rasterized=True)
+		plt.xlabel('Time (seconds)')
+		plt.ylabel('Sequence Number Mod 200000')
+		plt.xlim(xlimit)
+		plt.ylim([0, 200000])
+		plt.savefig(file_path)
+		plt.close(figure)
 
 def _parse_args():
 		parser = argparse.ArgumentParser(description='Plot queue size over time')
@@ -52,5 +63,5 @@ def _parse_args():
 if __name__ == '__main__':
 	args = _parse_args()
 	p = SequencePlotter()
-	p.parse(EventParser(args.input_file), '101.0.0.0:81')
+	p.parse(ColumnParser(args.input_file), '101.0.0.0:81')
 	p.plot(args.output_file)
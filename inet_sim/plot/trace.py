@@ -0,0 +1,157 @@
+"""Block-compressed, indexed trace files.
+
+A trace file starts with MAGIC, followed by zlib-compressed blocks of log lines and a pickled
+index. The last 8 bytes hold the offset of the index. The index records, for every block, its
+offset, compressed size and the first and last simulated time it contains, plus which blocks
+contain each event name and each endpoint, so a reader only has to decompress the blocks that
+can match a query.
+"""
+from __future__ import division
+import argparse
+import bisect
+import cPickle as pickle
+import struct
+import zlib
+
+MAGIC = 'INETTRC1'
+_FOOTER = struct.Struct('<Q')
+
+def is_trace(file_path):
+	"""Return whether the file at file_path is an indexed trace."""
+	with open(file_path, 'rb') as file:
+		return file.read(len(MAGIC)) == MAGIC
+
+def _split(line):
+	"""Return (time, name, endpoint) for a log line, or None if it is not an event."""
+	if line.startswith('#'):
+		return None
+	fields = line.split(None, 3)
+	if len(fields) < 2:
+		return None
+	try:
+		time = float(fields[0])
+	except ValueError:
+		return None
+	return time, fields[1], fields[2] if len(fields) > 2 else None
+
+class TraceWriter:
+	"""Writes log lines into an indexed trace file."""
+
+	def __init__(self, file_path, block_size=4096, level=6):
+		"""Open file_path for writing. Every block holds at most block_size lines."""
+		self.file = open(file_path, 'wb')
+		self.file.write(MAGIC)
+		self.block_size = block_size
+		self.level = level
+		self.blocks = []  # (offset, size, first time, last time)
+		self.names = {}   # event name to list of block numbers
+		self.endpoints = {} # endpoint to list of block numbers
+		self.__lines = []
+		self.__first = None
+		self.__last = None
+
+	def write(self, line):
+		"""Append one log line to the trace. Lines that are not events are skipped."""
+		split = _split(line)
+		if split is None:
+			return
+		time, name, endpoint = split
+		block = len(self.blocks)
+		if self.__first is None:
+			self.__first = time
+		self.__last = time
+		for key, index in ((name, self.names), (endpoint, self.endpoints)):
+			if key is None:
+				continue
+			blocks = index.setdefault(key, [])
+			if not blocks or blocks[-1] != block:
+				blocks.append(block)
+		self.__lines.append(line if line.endswith('\n') else line + '\n')
+		if len(self.__lines) >= self.block_size:
+			self.__flush()
+
+	def __flush(self):
+		if not self.__lines:
+			return
+		data = zlib.compress(''.join(self.__lines), self.level)
+		self.blocks.append((self.file.tell(), len(data), self.__first, self.__last))
+		self.file.write(data)
+		self.__lines = []
+		self.__first = self.__last = None
+
+	def close(self):
+		"""Write the remaining lines and the index, and close the file."""
+		self.__flush()
+		offset = self.file.tell()
+		index = {'blocks': self.blocks, 'names': self.names, 'endpoints': self.endpoints}
+		pickle.dump(index, self.file, pickle.HIGHEST_PROTOCOL)
+		self.file.write(_FOOTER.pack(offset))
+		self.file.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc_info):
+		self.close()
+
+class TraceReader:
+	"""Reads selected blocks of an indexed trace file."""
+
+	def __init__(self, file_path):
+		"""Open an indexed trace file and load its index."""
+		self.file_path = file_path
+		with open(file_path, 'rb') as file:
+			if file.read(len(MAGIC)) != MAGIC:
+				raise Exception('%s is not an indexed trace' % (file_path,))
+			file.seek(-_FOOTER.size, 2)
+			end = file.tell()
+			offset, = _FOOTER.unpack(file.read(_FOOTER.size))
+			file.seek(offset)
+			index = pickle.loads(file.read(end - offset))
+		self.blocks = index['blocks']
+		self.names = index['names']
+		self.endpoints = index['endpoints']
+		self.__last_times = [b[3] for b in self.blocks]
+
+	def select(self, start=None, end=None, names=None, endpoints=None):
+		"""Return the sorted numbers of the blocks that may contain matching events."""
+		first = 0 if start is None else bisect.bisect_left(self.__last_times, start)
+		selected = set(i for i in xrange(first, len(self.blocks))
+			if end is None or self.blocks[i][2] <= end)
+		for keys, index in ((names, self.names), (endpoints, self.endpoints)):
+			if keys is not None:
+				selected.intersection_update(b for k in keys for b in index.get(k, ()))
+		return sorted(selected)
+
+	def lines(self, start=None, end=None, names=None, endpoints=None):
+		"""Yield the lines of the blocks that may contain matching events.
+		Lines are not filtered individually; see EventParser.parse for that.
+		"""
+		file = open(self.file_path, 'rb')
+		try:
+			for i in self.select(start, end, names, endpoints):
+				offset, size, _, _ = self.blocks[i]
+				file.seek(offset)
+				for line in zlib.decompress(file.read(size)).splitlines(True):
+					yield line
+		finally:
+			file.close()
+
+def convert(input_path, output_path, block_size=4096):
+	"""Convert a plain text log into an indexed trace."""
+	with open(input_path) as input:
+		with TraceWriter(output_path, block_size) as writer:
+			for line in input:
+				writer.write(line)
+
+def _parse_args():
+		parser = argparse.ArgumentParser(description='Convert a log into an indexed trace')
+		parser.add_argument('-i', '--input' , dest='input_file', help='input file')
+		parser.add_argument('-o', '--output' , dest='output_file', help='output file')
+		parser.add_argument('-b', '--block-size', dest='block_size', type=int, default=4096,
+			help='lines per compressed block')
+		return parser.parse_args()
+
+if __name__ == '__main__':
+	args = _parse_args()
+	convert(args.input_file, args.output_file, args.block_size)
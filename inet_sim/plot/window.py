@@ -1,19 +1,25 @@
 from __future__ import division
 import argparse
 
-import matplotlib
-from pylab import *
-
-from .parse import EventParser
+from .backend import pyplot
+from .columns import ColumnParser
+from .decimate import figure_pixels, minmax
 
 # Class that parses a file of rates and plots a smoothed graph
 class WindowPlotter:
 	"""Plots a graph of cwnd and ssthresh."""
 
 	def load(self, parser, ip_port):
-		"""Load data from the parser."""
+		"""Load data from the parser (an EventParser or ColumnParser)."""
 		self.cwnd = [(0,1500)]
 		self.ssthresh = [(0,9600)]
+		if hasattr(parser, 'columns'):
+			columns = parser.columns(names=('tcp-cwnd-adjust', 'tcp-ssthresh-adjust'),
+				endpoints=(ip_port,))
+			for name, values in (('tcp-cwnd-adjust', self.cwnd), ('tcp-ssthresh-adjust', self.ssthresh)):
+				mask = columns.mask(names=(name,))
+				values.extend(zip(columns.time[mask].tolist(), columns.a[mask].astype(int).tolist()))
+			return
 		for event in parser.parse():
 			if event.name == 'tcp-cwnd-adjust' and event.args[0] == ip_port:
 				self.cwnd.append((event.time, int(event.args[1])))
@@ -24,16 +30,19 @@ class WindowPlotter:
 		"""Create and save the graph."""
 		if not hasattr(self, 'cwnd') or not hasattr(self, 'ssthresh'):
 			raise Exception('nothing loaded, please load() first')
-		clf()
+		plt = pyplot()
+		figure = plt.figure()
 		cwnd_xy = zip(*self.cwnd)
 		ssthresh_xy = zip(*self.ssthresh)
-		plot(cwnd_xy[0], cwnd_xy[1])
-		plot(ssthresh_xy[0], ssthresh_xy[1], c='g')
-		xlabel('Time')
-		ylabel('Value')
-		xlim([0, 1.1*max(cwnd_xy[0] + ssthresh_xy[0])])
-		ylim([0, 100000])
-		savefig(file_path)
+		width, _ = figure_pixels(figure)
+		plt.plot(*minmax(cwnd_xy[0], cwnd_xy[1], width))
+		plt.plot(*minmax(ssthresh_xy[0], ssthresh_xy[1], width), c='g')
+		plt.xlabel('Time')
+		plt.ylabel('Value')
+		plt.xlim([0, 1.1*max(cwnd_xy[0] + ssthresh_xy[0])])
+		plt.ylim([0, 100000])
+		plt.savefig(file_path)
+		plt.close(figure)
 
 def _parse_args():
 		parser = argparse.ArgumentParser(description='Plot queue size over time')
@@ -44,5 +53,5 @@ def _parse_args():
 if __name__ == '__main__':
 	args = _parse_args()
 	p = WindowPlotter()
-	p.load(EventParser(args.input_file), '101.0.0.0:81')
+	p.load(ColumnParser(args.input_file), '101.0.0.0:81')
 	p.plot(args.output_file)
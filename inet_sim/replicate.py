@@ -0,0 +1,206 @@
+"""Independent replications of a scenario, run until its metrics are known to a target precision.
+
+A scenario is a function scenario(seed, **params) which runs one simulation and returns a dict of
+metrics. Replications with seeds 0, 1, 2, ... run in parallel worker processes, and a running mean
+and confidence interval is kept for each metric of interest. A configuration (a set of params)
+stops once every metric's confidence interval half-width is within the target fraction of its
+mean, or after max_runs.
+
+	python -m inet_sim.replicate -s lossy --set loss=0.01,0.02,0.05 -m goodput -m drop_rate
+
+runs the bench scenario 'lossy' for each loss rate, and reports how many runs each one needed.
+"""
+from __future__ import division
+import argparse
+import itertools
+import json
+import math
+import multiprocessing
+
+class Summary:
+	"""Running mean and variance of a metric (by Welford's method)."""
+
+	def __init__(self):
+		self.n = 0
+		self.mean = 0.
+		self.__m2 = 0.
+
+	def add(self, value):
+		self.n += 1
+		delta = value - self.mean
+		self.mean += delta / self.n
+		self.__m2 += delta * (value - self.mean)
+
+	@property
+	def variance(self):
+		return self.__m2 / (self.n - 1) if self.n > 1 else float('inf')
+
+	def half_width(self, confidence=.95):
+		"""Return the half-width of the confidence interval of the mean."""
+		if self.n < 2:
+			return float('inf')
+		return t_quantile(1 - (1 - confidence) / 2, self.n - 1) * math.sqrt(self.variance / self.n)
+
+	def relative_precision(self, confidence=.95):
+		"""Return the half-width of the confidence interval as a fraction of the mean."""
+		if not self.mean:
+			return 0. if self.n > 1 and not self.variance else float('inf')
+		return self.half_width(confidence) / abs(self.mean)
+
+def normal_quantile(p):
+	"""Return the p quantile of the standard normal distribution (Acklam's approximation, with
+	relative error below 1.2e-9)."""
+	a = (-3.969683028665376e+01, 2.209460984245205e+02, -2.759285104469687e+02,
+		1.383577518672690e+02, -3.066479806614716e+01, 2.506628277459239e+00)
+	b = (-5.447609879822406e+01, 1.615858368580409e+02, -1.556989798598866e+02,
+		6.680131188771972e+01, -1.328068155288572e+01)
+	c = (-7.784894002430293e-03, -3.223964580411365e-01, -2.400758277161838e+00,
+		-2.549732539343734e+00, 4.374664141464968e+00, 2.938163982698783e+00)
+	d = (7.784695709041462e-03, 3.224671290700398e-01, 2.445134137142996e+00,
+		3.754408661907416e+00)
+	if p < .02425:
+		q = math.sqrt(-2 * math.log(p))
+		return (((((c[0]*q + c[1])*q + c[2])*q + c[3])*q + c[4])*q + c[5]) / \
+			((((d[0]*q + d[1])*q + d[2])*q + d[3])*q + 1)
+	if p > 1 - .02425:
+		return -normal_quantile(1 - p)
+	q = p - .5
+	r = q * q
+	return (((((a[0]*r + a[1])*r + a[2])*r + a[3])*r + a[4])*r + a[5])*q / \
+		(((((b[0]*r + b[1])*r + b[2])*r + b[3])*r + b[4])*r + 1)
+
+def t_quantile(p, dof):
+	"""Return the p quantile of Student's t distribution with dof degrees of freedom: exact for 1
+	and 2, otherwise by the Cornish-Fisher expansion about the normal quantile."""
+	if dof == 1:
+		return math.tan(math.pi * (p - .5))
+	if dof == 2:
+		return (2*p - 1) / math.sqrt(2 * p * (1 - p))
+	z = normal_quantile(p)
+	z2 = z * z
+	return z + (z2 + 1) * z / (4 * dof) \
+		+ ((5*z2 + 16)*z2 + 3) * z / (96 * dof**2) \
+		+ (((3*z2 + 19)*z2 + 17)*z2 - 15) * z / (384 * dof**3) \
+		+ ((((79*z2 + 776)*z2 + 1482)*z2 - 1920)*z2 - 945) * z / (92160 * dof**4)
+
+class Replications:
+	"""The replications of one configuration."""
+
+	def __init__(self, params, metrics):
+		self.params = params
+		self.summaries = dict((metric, Summary()) for metric in metrics)
+		self.runs = 0
+		self.converged = False
+
+	def add(self, result):
+		"""Add the metrics of one run."""
+		self.runs += 1
+		for metric, summary in self.summaries.iteritems():
+			value = result.get(metric)
+			if value is not None:
+				summary.add(value)
+
+	def precise(self, precision, confidence):
+		"""Return whether every metric is within the target relative precision."""
+		return all(s.relative_precision(confidence) <= precision for s in self.summaries.itervalues())
+
+def _call(args):
+	scenario, seed, params = args
+	return scenario(seed, **params)
+
+def replicate(scenario, params={}, metrics=('goodput',), precision=.05, confidence=.95,
+		min_runs=5, max_runs=100, pool=None):
+	"""Run replications of scenario(seed, **params) until every metric's mean is known to within
+	precision (relative half-width of its confidence interval), or for max_runs. Runs go to the
+	worker processes of pool (by default, a new one with a process per CPU), as many at a time as
+	there are workers. Results are used in seed order, so the outcome does not depend on timing;
+	runs still in flight when the target is reached are discarded. Return the Replications.
+	"""
+	own_pool = pool is None
+	if own_pool:
+		pool = multiprocessing.Pool()
+	try:
+		workers = getattr(pool, '_processes', None) or multiprocessing.cpu_count()
+		replications = Replications(params, metrics)
+		seeds = itertools.count()
+		pending = [] # AsyncResults, in seed order
+		while True:
+			while len(pending) < workers and replications.runs + len(pending) < max_runs:
+				pending.append(pool.apply_async(_call, ((scenario, next(seeds), params),)))
+			if not pending:
+				break
+			replications.add(pending.pop(0).get())
+			if replications.runs >= min_runs and replications.precise(precision, confidence):
+				replications.converged = True
+				break
+		for result in pending:
+			result.wait()
+		return replications
+	finally:
+		if own_pool:
+			pool.close()
+			pool.join()
+
+def sweep(scenario, configurations, **kwargs):
+	"""Replicate scenario for each dict of params in configurations, sharing one pool of worker
+	processes. Each configuration stops on its own. Return a list of Replications."""
+	pool = kwargs.pop('pool', None) or multiprocessing.Pool()
+	try:
+		return [replicate(scenario, params, pool=pool, **kwargs) for params in configurations]
+	finally:
+		pool.close()
+		pool.join()
+
+def bench_scenario(seed, name, scale=1., **options):
+	"""Run a scenario of inet_sim.bench. Return its metrics: goodput (bytes per second read by
+	sinks), completion_mean (mean time at which flows finished), drop_rate (fraction of packets
+	lost or dropped by links), and the rest of bench.run's measurements."""
+	from inet_sim import bench
+	return bench.run(name, scale, options=options, seed=seed)
+
+def _configurations(settings):
+	"""Return the cross product of --set options, like 'loss=0.01,0.02', as a list of dicts."""
+	axes = []
+	for setting in settings:
+		key, values = setting.split('=', 1)
+		axes.append([(key, _value(v)) for v in values.split(',')])
+	return [dict(c) for c in itertools.product(*axes)]
+
+def _value(string):
+	try:
+		return json.loads(string)
+	except ValueError:
+		return string
+
+def _parse_args():
+		parser = argparse.ArgumentParser(description='Replicate a bench scenario to a target precision')
+		parser.add_argument('-s', '--scenario', required=True, help='bench scenario')
+		parser.add_argument('--scale', type=float, default=1., help='size of the scenario')
+		parser.add_argument('--set', dest='settings', action='append', default=[],
+			help='scenario option and comma-separated values to sweep, e.g. loss=0.01,0.02')
+		parser.add_argument('-m', '--metric', dest='metrics', action='append',
+			help='metric to estimate (default: goodput)')
+		parser.add_argument('-p', '--precision', type=float, default=.05,
+			help='target relative half-width of confidence intervals')
+		parser.add_argument('-c', '--confidence', type=float, default=.95, help='confidence level')
+		parser.add_argument('--min-runs', type=int, default=5, help='runs before stopping early')
+		parser.add_argument('--max-runs', type=int, default=100, help='most runs per configuration')
+		parser.add_argument('-j', '--processes', type=int, help='worker processes (default: CPUs)')
+		return parser.parse_args()
+
+if __name__ == '__main__':
+	args = _parse_args()
+	metrics = args.metrics or ['goodput']
+	configurations = [dict(c, name=args.scenario, scale=args.scale)
+		for c in _configurations(args.settings)]
+	results = sweep(bench_scenario, configurations, metrics=metrics, precision=args.precision,
+		confidence=args.confidence, min_runs=args.min_runs, max_runs=args.max_runs,
+		pool=multiprocessing.Pool(args.processes))
+	for r in results:
+		options = ' '.join('%s=%s' % (k, v) for k, v in sorted(r.params.iteritems())
+			if k not in ('name', 'scale')) or '-'
+		print '%-20s %4d runs%s' % (options, r.runs, '' if r.converged else ' (not converged)')
+		for metric in metrics:
+			s = r.summaries[metric]
+			print '    %-16s %12.6g +- %-12.4g (%.1f%%)' % (metric, s.mean,
+				s.half_width(args.confidence), 100 * s.relative_precision(args.confidence))
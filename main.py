@@ -3,6 +3,7 @@ from datetime import datetime
 import logging
 import random
 
+from inet_sim.context import DEFAULT
 from inet_sim.network.host import AF_INET, Host, SOCK_STREAM
 from inet_sim.network.link import Link
 from sim import sim
@@ -78,32 +79,80 @@ class FileClient:
 		file.close()
 		self.socket.close()
 
+class AsyncServer(Server):
+	"""Server as a coroutine, for AsyncHost."""
+
+	def run(self):
+		self.socket.listen()
+		socket = yield self.socket.accept()
+		yield self.handle_conn(socket)
+
+	def handle_conn(self, socket):
+		message = ''
+		while not message or message[-1] != '\n':
+			message += ''.join((yield socket.recv()))
+		logging.getLogger(__name__).info(message[:-1])
+		if message[:4] == 'time':
+			yield socket.sendall('%s' % (datetime.now(),))
+		elif message[:4] == 'file':
+			yield socket.sendall(open(message[5:-1], 'rb').read())
+		else:
+			yield socket.sendall('unrecognized request')
+		yield socket.close()
+
+class AsyncFileClient(FileClient):
+	"""FileClient as a coroutine, for AsyncHost."""
+
+	def download_file(self):
+		yield self.socket.connect(self.addr)
+		yield self.socket.sendall('file large.jpg\n')
+		file = open('downloaded.jpg', 'wb')
+		while True:
+			m = yield self.socket.recv()
+			if not m:
+				break
+			file.write(''.join(m))
+		file.close()
+		yield self.socket.close()
+
+def demo_async_client_server(loop, host1, host2, n_client=1):
+	"""Like demo_client_server, for AsyncHosts running on loop."""
+	server_ip = host2.ip
+	for i in range(0,n_client):
+		loop.create_task(AsyncFileClient(host1, (server_ip, 80+i)).download_file())
+		loop.create_task(AsyncServer(host2, 80+i).run())
+	loop.run()
+
 def demo_client_server(host1, host2, n_client=1, n_server=1):
-	sim.__init__()
+	context = host1.context
+	context.reset()
 	server_ip = host2.ip
 	for i in range(0,n_client):
 		def c(client=FileClient(host1, (server_ip, 80+i))):
 			#sleep(i*15)
 			client.download_file()
-		sim.new_thread(c)	
+		context.new_thread(c)	
 	for i in range(0,n_server):
 		server = Server(host2, 80+i)
-		sim.new_thread(server.run)
+		context.new_thread(server.run)
 		#def stop(server=server):
 		#	sim.sleep(5)
 		#	server.end()
 		#sim.new_thread(stop)
-	sim.run()
+	context.run()
 
-def configure_logging(level):
+def configure_logging(level, time=None):
+	"""Log to stdout, stamping records with time() (by default, that of the DEFAULT Context); pass
+	the time method of a Context or EventLoop to log its simulated time."""
 	import sys
+	time = time or DEFAULT.time
 	logging.basicConfig(stream=sys.stdout, level=level)
 	class Formatter(logging.Formatter):
 		def format(self, record):
 			if record.levelno == logging.DEBUG:
 				self._fmt = '%(name)s - %(message)s'
 			else:
-				record.time = sim.time()
+				record.time = time()
 				self._fmt = '%(time)7.4f %(message)s'
 			return super(Formatter, self).format(record)
 	logging.getLogger().handlers[0].setFormatter(Formatter())
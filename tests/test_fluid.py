@@ -0,0 +1,68 @@
+import unittest
+
+from inet_sim.context import Context
+from inet_sim.network.fluid import FluidSimulator, validate, _dumbbell
+from inet_sim.network.host import Host
+from inet_sim.network.link import Link
+from inet_sim.network.routing import static_routes
+from inet_sim.network.topology import FatTree
+
+class FluidSimulatorTest(unittest.TestCase):
+
+	def setUp(self):
+		context = Context()
+		self.host1 = Host('10.0.0.1', context)
+		self.host2 = Host('10.0.0.2', context)
+		Link.duplex_link(self.host1, self.host2, 0., 1e5)
+		static_routes([self.host1, self.host2])
+		self.fluid = FluidSimulator()
+
+	def test_shared_group(self):
+		self.fluid.add_flow(self.host1, self.host2, 1e5)
+		self.fluid.add_flow(self.host1, self.host2, 2e5)
+		self.fluid.run()
+		self.assertEqual(self.fluid.completion_times(), [2., 3.])
+		self.assertEqual(sorted(self.fluid.link_bytes().values()), [3e5])
+
+	def test_sequential_flows(self):
+		self.fluid.add_flow(self.host1, self.host2, 1e5)
+		self.fluid.add_flow(self.host1, self.host2, 1e5, 1.)
+		self.fluid.run()
+		self.assertEqual(self.fluid.completion_times(), [1., 1.])
+
+	def test_resume(self):
+		self.fluid.add_flow(self.host1, self.host2, 1e5)
+		self.fluid.add_flow(self.host1, self.host2, 2e5)
+		self.fluid.run(until=1.5)
+		self.assertEqual(self.fluid.completion_times(), [None, None])
+		self.fluid.run()
+		self.assertEqual(self.fluid.completion_times(), [2., 3.])
+
+class EcmpTest(unittest.TestCase):
+
+	def test_same_paths_as_packets(self):
+		fattree = FatTree(4, context=Context(seed=1))
+		size = 30000
+		sources, dests = fattree.hosts[:4], fattree.hosts[-4:]
+		flows = [(src, dest, size, 0.) for src, dest in zip(sources, dests)]
+		validate(fattree.nodes, flows)
+		fluid = FluidSimulator()
+		for i, (src, dest, size, start) in enumerate(flows):
+			# each source's first connection, to the port validate listens on
+			fluid.add_flow(src, dest, size, start, (32768, 10000 + i))
+		fluid.run()
+		packet_links = set(link for link in fattree.links() if link.bytes >= size)
+		fluid_links = set(link for link, b in fluid.link_bytes().iteritems() if b)
+		self.assertEqual(packet_links, fluid_links)
+
+class ValidateTest(unittest.TestCase):
+
+	def test_dumbbell(self):
+		nodes, clients, server = _dumbbell(2)
+		flows = [(client, server, 200000, .1 * i) for i, client in enumerate(clients)]
+		for packet, fluid in validate(nodes, flows):
+			self.assertIsNotNone(packet)
+			self.assertLess(abs(fluid - packet) / packet, .25)
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,51 @@
+import unittest
+
+from inet_sim.context import Context
+from inet_sim.network.host import Host, AF_INET, SOCK_STREAM
+from inet_sim.network.link import Link
+from inet_sim.network.routing import Node, static_routes
+
+class OffloadTest(unittest.TestCase):
+
+	def transfer(self, hops, size, **options):
+		"""Return the time to send size bytes over a path of hops links, with socket options."""
+		context = Context(seed=1)
+		context.reset()
+		client, server = Host('10.0.0.1', context), Host('10.0.1.1', context)
+		nodes = [client] + [Node('10.0.2.%d' % i, context) for i in xrange(hops - 1)] + [server]
+		for node1, node2 in zip(nodes, nodes[1:]):
+			Link.duplex_link(node1, node2, .001, 1e6)
+		static_routes(nodes)
+		listener = server.socket(AF_INET, SOCK_STREAM)
+		listener.bind((server.ip, 80))
+		listener.listen()
+		done = []
+		def receive():
+			socket = listener.accept()
+			while socket.recv():
+				pass
+			done.append(context.time())
+			socket.close()
+		def send():
+			socket = client.socket(AF_INET, SOCK_STREAM)
+			for name, value in options.iteritems():
+				setattr(socket, name, value)
+			socket.connect((server.ip, 80))
+			socket.sendall('x' * size)
+			socket.close()
+		context.new_thread(receive)
+		context.new_thread(send)
+		context.run()
+		return done[0]
+
+	def test_pipelined(self):
+		# super-segments are not split on these links, but their wire packets still pipeline
+		# across the hops instead of each being stored and forwarded whole (on paths long enough
+		# that no queue overflows)
+		for hops in (2, 4, 6):
+			mss = self.transfer(hops, 200000)
+			offload = self.transfer(hops, 200000, offload=True)
+			self.assertLess(abs(offload - mss) / mss, .05)
+
+if __name__ == '__main__':
+	unittest.main()
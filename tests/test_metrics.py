@@ -0,0 +1,24 @@
+import unittest
+
+from inet_sim.context import Context
+from inet_sim.network.host import Host
+from inet_sim.network.link import Link
+from inet_sim.network.metrics import LinkMetrics
+
+class MetricsTest(unittest.TestCase):
+
+	def test_timer(self):
+		context = Context()
+		context.reset()
+		link, _ = Link.duplex_link(Host('10.0.0.1', context), Host('10.0.0.2', context), .01, 1e6)
+		metrics = LinkMetrics(link, interval=.1)
+		for time in (.05, .15, .35, 1.):
+			context.call_later(time, lambda: metrics.transmit(context.time(), 1000))
+		context.run() # returns once the timer has stopped
+		# every interval while there are updates, and one more; the missed ones at the next update
+		self.assertEqual([s['time'] for s in metrics.snapshots], [i * .1 for i in xrange(1, 13)])
+		self.assertEqual([s['bytes'] for s in metrics.snapshots],
+			[1000, 2000, 2000, 3000, 3000, 3000, 3000, 3000, 3000, 3000, 4000, 4000])
+
+if __name__ == '__main__':
+	unittest.main()
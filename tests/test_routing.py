@@ -0,0 +1,36 @@
+import random
+import unittest
+
+from inet_sim.context import Context
+from inet_sim.network.routing import Routes
+from inet_sim.network.topology import FatTree
+
+class RoutesTest(unittest.TestCase):
+
+	def routes(self, nodes):
+		return dict((node, dict((ip, [link.id for link in links])
+			for ip, links in node.routes.iteritems())) for node in nodes)
+
+	def test_update_matches_recompute(self):
+		rand = random.Random(1)
+		fattree = FatTree(4, context=Context())
+		nodes = fattree.nodes
+		links = fattree.links()
+		for _ in xrange(200):
+			changed = rand.sample(links, rand.randint(1, 3))
+			for link in changed:
+				if rand.random() < .5:
+					link.up = not link.up
+				else: # few delays, for ties as well as changes
+					link.prop_delay = rand.choice((.0005, .001, .002))
+			fattree.routes.update(changed)
+			incremental = self.routes(nodes)
+			Routes(nodes)
+			self.assertEqual(incremental, self.routes(nodes))
+			for node in nodes: # keep updating the incremental routes
+				by_id = dict((link.id, link) for link in node.links())
+				node.routes = dict((ip, [by_id[i] for i in ids])
+					for ip, ids in incremental[node].iteritems())
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,77 @@
+import logging
+import unittest
+
+from inet_sim.context import Context
+from inet_sim.network.host import Host, AF_INET, SOCK_STREAM
+from inet_sim.network.link import Link
+from inet_sim.network.routing import static_routes
+from inet_sim.network.tcp import Reno
+
+class _Events(logging.Handler):
+	"""Collects the event types of socket log messages."""
+
+	def __init__(self):
+		logging.Handler.__init__(self)
+		self.events = []
+
+	def emit(self, record):
+		self.events.append(record.args[2])
+
+class PersistTest(unittest.TestCase):
+
+	def setUp(self):
+		self.context = Context(seed=1)
+		self.context.reset()
+		self.client = Host('10.0.0.1', self.context)
+		self.server = Host('10.0.0.2', self.context)
+		Link.duplex_link(self.client, self.server, .01, 1e6)
+		static_routes([self.client, self.server])
+		self.log = _Events()
+		logger = logging.getLogger('inet_sim.network.socket')
+		logger.addHandler(self.log)
+		logger.setLevel(logging.INFO)
+		logger.propagate = False
+
+	def tearDown(self):
+		logger = logging.getLogger('inet_sim.network.socket')
+		logger.removeHandler(self.log)
+		logger.setLevel(logging.NOTSET)
+		logger.propagate = True
+
+	def test_zero_window(self):
+		context = self.context
+		size = 50000
+		received = []
+		listener = self.server.socket(AF_INET, SOCK_STREAM)
+		listener.bind((self.server.ip, 80))
+		listener.rcvbuf = 10000
+		listener.listen()
+		def server():
+			socket = listener.accept()
+			context.sleep(20) # the window closes, and the client probes it
+			data = socket.recv()
+			while data:
+				received.extend(data)
+				data = socket.recv()
+			socket.close()
+		client = self.client.socket(AF_INET, SOCK_STREAM)
+		client.congestion = Reno(client)
+		duplicates = [] # rwnd at each duplicate ACK
+		def dup_ack(ack_num, dup_ack=client.congestion.dup_ack):
+			duplicates.append(client.rwnd)
+			dup_ack(ack_num)
+		client.congestion.dup_ack = dup_ack
+		def send():
+			client.connect((self.server.ip, 80))
+			client.sendall('x' * size)
+			client.close()
+		context.new_thread(server)
+		context.new_thread(send)
+		context.run()
+		self.assertEqual(len(received), size)
+		self.assertIn('tcp-probe', self.log.events)
+		self.assertNotIn(0, duplicates)
+		self.assertNotIn('tcp-loss triple-ack', self.log.events)
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,46 @@
+import unittest
+
+from inet_sim.context import Context
+from inet_sim.loop import EventLoop
+from inet_sim.network.aio import AsyncHost, AsyncLink
+from inet_sim.network.host import Host, AF_INET, SOCK_STREAM
+from inet_sim.network.link import Link
+from inet_sim.network.topology import FatTree
+
+class FatTreeTest(unittest.TestCase):
+
+	def test_event_loop(self):
+		context = Context(EventLoop(), seed=1)
+		fattree = FatTree(4, .001, 1e6, context=context)
+		self.assertTrue(all(isinstance(host, AsyncHost) for host in fattree.hosts))
+		self.assertTrue(all(isinstance(link, AsyncLink) for link in fattree.links()))
+		client, server = fattree.hosts[0], fattree.hosts[-1]
+		done = []
+		def serve():
+			listener = server.socket(AF_INET, SOCK_STREAM)
+			listener.bind((server.ip, 80))
+			listener.listen()
+			socket = yield listener.accept()
+			data = yield socket.recv()
+			done.append((context.time(), ''.join(data)))
+			yield socket.close()
+		def request():
+			socket = client.socket(AF_INET, SOCK_STREAM)
+			yield socket.connect((server.ip, 80))
+			yield socket.sendall('hello')
+			yield socket.close()
+		context.new_thread(serve)
+		context.new_thread(request)
+		context.run()
+		# the handshake and the data cross 6 links each way, in 1.5 round trips
+		self.assertEqual([data for _, data in done], ['hello'])
+		self.assertGreaterEqual(done[0][0], 18 * .001)
+
+	def test_threaded_classes(self):
+		context = Context(EventLoop())
+		self.assertRaises(Exception, Host, '10.0.0.1', context)
+		host1, host2 = AsyncHost('10.0.0.1', context), AsyncHost('10.0.0.2', context)
+		self.assertRaises(Exception, Link, host1, host2, .01, 1e6)
+
+if __name__ == '__main__':
+	unittest.main()